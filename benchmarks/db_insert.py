@@ -0,0 +1,56 @@
+"""Compare the "multi" and "bulk" insert modes of db_functions.insert_dataframe.
+
+Runs against an in-memory SQLite database, so "bulk" is a plain executemany here. On SQL Server the
+bulk engine also turns on pyodbc fast_executemany, which is where most of the gain comes from.
+
+Usage:
+    python -m benchmarks.db_insert
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from tj_worker.utils import db_functions
+
+ROWS = 100000
+
+
+def make_swaps_df(rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "block_number": np.arange(ROWS) // 10,
+            "pair_idx": rng.integers(0, 2000, size=ROWS),
+            "amount0_in": rng.random(size=ROWS),
+            "amount0_out": rng.random(size=ROWS),
+            "amount1_in": rng.random(size=ROWS),
+            "amount1_out": rng.random(size=ROWS),
+            "amount_usd": rng.random(size=ROWS),
+        }
+    )
+
+
+def main():
+    swaps_df = make_swaps_df(rng=np.random.default_rng(0))
+
+    for insert_mode in ("multi", "bulk"):
+        engine = create_engine("sqlite://")
+
+        start = time.perf_counter()
+        db_functions.insert_dataframe(df=swaps_df, table_name="fact_swap", insert_mode=insert_mode, engine=engine)
+        elapsed = time.perf_counter() - start
+
+        with engine.connect() as conn:
+            count = conn.exec_driver_sql("SELECT COUNT(*) FROM fact_swap").scalar()
+        assert count == ROWS
+
+        print(
+            "{m:>5}: {r} rows in {s:.2f}s | {t:,.0f} rows/s".format(m=insert_mode, r=ROWS, s=elapsed, t=ROWS / elapsed)
+        )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare BlockSwapMaintainer's per-file aggregation with get_clean_batch_dfs.
+
+Usage:
+    python -m benchmarks.etl_aggregation
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from tj_worker.swap_etl import maintain_block_swaps
+
+ROWS_PER_FILE = 40
+PAIR_IDS = ["0x{p:040x}".format(p=p) for p in range(2000)]
+
+
+def make_file_df(block_number: int, rng: np.random.Generator) -> pd.DataFrame:
+    is_sell = rng.integers(0, 2, size=ROWS_PER_FILE).astype(bool)
+    amount0 = rng.random(size=ROWS_PER_FILE)
+    amount1 = rng.random(size=ROWS_PER_FILE)
+    return pd.DataFrame(
+        {
+            "transact_id": ["0x{b:064x}".format(b=block_number)] * ROWS_PER_FILE,
+            "block_number": block_number,
+            "timestamp_unix": 1640000000 + block_number,
+            "swap_number": range(ROWS_PER_FILE),
+            "pair_id": rng.choice(PAIR_IDS, size=ROWS_PER_FILE),
+            "amount0In": np.where(is_sell, amount0, 0),
+            "amount0Out": np.where(is_sell, 0, amount0),
+            "amount1In": np.where(is_sell, 0, amount1),
+            "amount1Out": np.where(is_sell, amount1, 0),
+            "amountUSD": rng.random(size=ROWS_PER_FILE),
+        }
+    )
+
+
+def per_file(file_dfs: list, valid_pair_ids: list):
+    master_swaps_df = pd.DataFrame()
+    master_blocks_df = pd.DataFrame()
+    for file_df in file_dfs:
+        file_df = file_df[file_df["pair_id"].isin(valid_pair_ids)]
+        file_swap_df = maintain_block_swaps.BlockSwapMaintainer.get_clean_file_swap_df(file_df=file_df)
+        file_block_df = maintain_block_swaps.BlockSwapMaintainer.get_clean_file_block_df(file_df=file_df)
+        master_swaps_df = pd.concat([master_swaps_df, file_swap_df], ignore_index=True)
+        master_blocks_df = pd.concat([master_blocks_df, file_block_df], ignore_index=True)
+
+
+def batch(file_dfs: list, valid_pair_ids: list):
+    maintain_block_swaps.BlockSwapMaintainer.get_clean_batch_dfs(file_dfs=file_dfs, valid_pair_ids=valid_pair_ids)
+
+
+def run():
+    rng = np.random.default_rng(seed=1)
+    valid_pair_ids = PAIR_IDS[:1500]
+
+    print("{:>6} | {:>10} | {:>16} | {:>16}".format("files", "rows", "per file rows/s", "batch rows/s"))
+    for file_count in [50, 5000]:
+        file_dfs = [make_file_df(block_number=b, rng=rng) for b in range(file_count)]
+        rows = file_count * ROWS_PER_FILE
+
+        rates = list()
+        for aggregate in [per_file, batch]:
+            start = time.perf_counter()
+            aggregate(file_dfs, valid_pair_ids)
+            rates.append(rows / (time.perf_counter() - start))
+
+        print("{:>6} | {:>10} | {:>16,.0f} | {:>16,.0f}".format(file_count, rows, *rates))
+
+
+if __name__ == "__main__":
+    run()
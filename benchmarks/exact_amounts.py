@@ -0,0 +1,75 @@
+"""Compare BlockSwapMaintainer's float aggregation of swap amounts with the exact fixed point one.
+
+Both start from the amounts as written in the swaps_raw files, so the float path includes parsing them.
+
+Usage:
+    python -m benchmarks.exact_amounts
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from tj_worker.swap_etl import maintain_block_swaps
+
+ROWS_PER_FILE = 40
+PAIR_IDS = ["0x{p:040x}".format(p=p) for p in range(2000)]
+AMOUNT_COLUMNS = ["amount0In", "amount0Out", "amount1In", "amount1Out", "amountUSD"]
+
+
+def to_amount_strings(amounts: np.ndarray) -> list:
+    return ["{a:.18f}".format(a=a) if a > 0 else "0" for a in amounts]
+
+
+def make_file_df(block_number: int, rng: np.random.Generator) -> pd.DataFrame:
+    is_sell = rng.integers(0, 2, size=ROWS_PER_FILE).astype(bool)
+    amount0 = rng.random(size=ROWS_PER_FILE) * 1000
+    amount1 = rng.random(size=ROWS_PER_FILE) * 1000
+    return pd.DataFrame(
+        {
+            "transact_id": ["0x{b:064x}".format(b=block_number)] * ROWS_PER_FILE,
+            "block_number": block_number,
+            "timestamp_unix": 1640000000 + block_number,
+            "swap_number": range(ROWS_PER_FILE),
+            "pair_id": rng.choice(PAIR_IDS, size=ROWS_PER_FILE),
+            "amount0In": to_amount_strings(np.where(is_sell, amount0, 0)),
+            "amount0Out": to_amount_strings(np.where(is_sell, 0, amount0)),
+            "amount1In": to_amount_strings(np.where(is_sell, 0, amount1)),
+            "amount1Out": to_amount_strings(np.where(is_sell, amount1, 0)),
+            "amountUSD": to_amount_strings(rng.random(size=ROWS_PER_FILE) * 1000),
+        }
+    )
+
+
+def float_amounts(file_dfs: list, valid_pair_ids: list):
+    file_dfs = [file_df.astype({col: float for col in AMOUNT_COLUMNS}) for file_df in file_dfs]
+    maintain_block_swaps.BlockSwapMaintainer.get_clean_batch_dfs(file_dfs=file_dfs, valid_pair_ids=valid_pair_ids)
+
+
+def exact_amounts(file_dfs: list, valid_pair_ids: list):
+    maintain_block_swaps.BlockSwapMaintainer.get_clean_batch_dfs(
+        file_dfs=file_dfs, valid_pair_ids=valid_pair_ids, exact_amounts=True
+    )
+
+
+def run():
+    rng = np.random.default_rng(seed=1)
+    valid_pair_ids = PAIR_IDS[:1500]
+
+    print("{:>6} | {:>10} | {:>16} | {:>16}".format("files", "rows", "float rows/s", "exact rows/s"))
+    for file_count in [50, 500, 5000]:
+        file_dfs = [make_file_df(block_number=b, rng=rng) for b in range(file_count)]
+        rows = file_count * ROWS_PER_FILE
+
+        rates = list()
+        for aggregate in [float_amounts, exact_amounts]:
+            start = time.perf_counter()
+            aggregate(file_dfs, valid_pair_ids)
+            rates.append(rows / (time.perf_counter() - start))
+
+        print("{:>6} | {:>10} | {:>16,.0f} | {:>16,.0f}".format(file_count, rows, *rates))
+
+
+if __name__ == "__main__":
+    run()
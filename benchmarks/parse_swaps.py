@@ -0,0 +1,72 @@
+"""Compare SwapParserToCSV's row parser with the columnar parser, into a SwapBatchBuffer.
+
+Usage:
+    python -m benchmarks.parse_swaps
+"""
+
+import tempfile
+import time
+
+import numpy as np
+
+from tj_worker.swap_getter import batch_buffer, swaps_to_csv
+
+PAIR_IDS = ["0x{p:040x}".format(p=p) for p in range(2000)]
+
+
+def make_data(transaction_count: int, rng: np.random.Generator) -> list:
+    data = list()
+    for t in range(transaction_count):
+        transact_id = "0x{t:064x}".format(t=t)
+        block_number = 10000000 + t // 5
+        data.append(
+            {
+                "id": transact_id,
+                "timestamp": str(1640000000 + block_number),
+                "blockNumber": str(block_number),
+                "swaps": [
+                    {
+                        "id": transact_id + "-" + str(s),
+                        "amountUSD": "{a:.6f}".format(a=rng.random() * 1000),
+                        "amount0In": "{a:.18f}".format(a=rng.random()),
+                        "amount0Out": "0",
+                        "amount1In": "0",
+                        "amount1Out": "{a:.18f}".format(a=rng.random()),
+                        "pair": {"id": PAIR_IDS[rng.integers(0, len(PAIR_IDS))]},
+                    }
+                    for s in range(rng.integers(1, 4))
+                ],
+            }
+        )
+    return data
+
+
+def parse(data: list, columnar: bool) -> int:
+    with tempfile.TemporaryDirectory() as local_file_path:
+        SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=local_file_path, columnar=columnar)
+        Buffer = batch_buffer.SwapBatchBuffer(headers=SwapsToCSV.file_headers, local_file_path=local_file_path)
+        SwapsToCSV.batch_buffer = Buffer
+
+        SwapsToCSV.parse_all_data(data=data, max_block_number=20000000)
+        return Buffer.row_count
+
+
+def run():
+    rng = np.random.default_rng(seed=1)
+    parse(data=make_data(transaction_count=100, rng=rng), columnar=True)
+
+    print("{:>12} | {:>10} | {:>14} | {:>16}".format("transactions", "rows", "row rows/s", "columnar rows/s"))
+    for transaction_count in [100, 1000, 10000, 100000]:
+        data = make_data(transaction_count=transaction_count, rng=rng)
+
+        rates = list()
+        for columnar in [False, True]:
+            start = time.perf_counter()
+            rows = parse(data=data, columnar=columnar)
+            rates.append(rows / (time.perf_counter() - start))
+
+        print("{:>12} | {:>10} | {:>14,.0f} | {:>16,.0f}".format(transaction_count, rows, *rates))
+
+
+if __name__ == "__main__":
+    run()
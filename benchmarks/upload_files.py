@@ -0,0 +1,82 @@
+"""Compare combining swaps_raw files with a pandas concat per file against concat_csv_files.
+
+Usage:
+    python -m benchmarks.upload_files
+"""
+
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from tj_worker.utils import csv_functions
+
+HEADERS = [
+    "transact_id",
+    "block_number",
+    "timestamp_unix",
+    "swap_number",
+    "pair_id",
+    "amount0In",
+    "amount0Out",
+    "amount1In",
+    "amount1Out",
+    "amountUSD",
+]
+ROWS_PER_FILE = 20
+
+
+def write_files(local_file_path: str, file_count: int) -> list:
+    full_filepaths = list()
+    for block_number in range(file_count):
+        rows = [
+            [
+                "0x{b:064x}".format(b=block_number),
+                block_number,
+                1640000000 + block_number,
+                i,
+                "0xpair",
+                "1.5",
+                "0",
+                "0",
+                "2.25",
+                "10.5",
+            ]
+            for i in range(ROWS_PER_FILE)
+        ]
+        full_filepath = os.path.join(local_file_path, "swaps_raw_" + str(block_number).zfill(10) + ".csv")
+        csv_functions.append_list_of_lists_to_csv(full_filepath=full_filepath, data=rows, headers=HEADERS)
+        full_filepaths.append(full_filepath)
+    return full_filepaths
+
+
+def concat_per_file(full_filepaths: list):
+    master_df = pd.DataFrame()
+    for full_filepath in full_filepaths:
+        file_df = csv_functions.read_csv_to_dataframe(full_filepath=full_filepath, dtype=str)
+        master_df = pd.concat([master_df, file_df], ignore_index=True)
+    csv_functions.write_dataframe_to_csv(full_filepaths[-1] + ".out", df=master_df)
+
+
+def concat_streaming(full_filepaths: list):
+    csv_functions.concat_csv_files(full_filepaths=full_filepaths, output_filepath=full_filepaths[-1] + ".out")
+
+
+def run():
+    print("{:>6} | {:>12} | {:>12}".format("files", "per file (s)", "streamed (s)"))
+    for file_count in [100, 500, 1000, 3000]:
+        with tempfile.TemporaryDirectory() as local_file_path:
+            full_filepaths = write_files(local_file_path=local_file_path, file_count=file_count)
+
+            durations = list()
+            for concat in [concat_per_file, concat_streaming]:
+                start = time.perf_counter()
+                concat(full_filepaths)
+                durations.append(time.perf_counter() - start)
+
+        print("{:>6} | {:>12.3f} | {:>12.3f}".format(file_count, *durations))
+
+
+if __name__ == "__main__":
+    run()
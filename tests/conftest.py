@@ -5,3 +5,29 @@ import pytest
 def test_container_name():
     test_container_name = "swapdata"
     return test_container_name
+
+
+@pytest.fixture
+def make_transaction():
+    """Build one thegraph.com transaction with a single swap."""
+
+    def make_transaction(block_number: int, transact_number: int = 0, pair_id: str = "0xpair") -> dict:
+        transact_id = "0x{b:08x}{t:04x}".format(b=block_number, t=transact_number)
+        return {
+            "id": transact_id,
+            "timestamp": str(1640000000 + block_number),
+            "blockNumber": str(block_number),
+            "swaps": [
+                {
+                    "id": transact_id + "-0",
+                    "amountUSD": "10.5",
+                    "amount0In": "1",
+                    "amount0Out": "0",
+                    "amount1In": "0",
+                    "amount1Out": "2",
+                    "pair": {"id": pair_id},
+                }
+            ],
+        }
+
+    return make_transaction
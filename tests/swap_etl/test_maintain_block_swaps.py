@@ -0,0 +1,185 @@
+import io
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tj_worker import swap_etl
+from tj_worker.swap_etl import maintain_block_swaps
+from tj_worker.utils import csv_functions, data_classes, hex_ids, settings
+
+PAIR_IDS = ["0x{p:040x}".format(p=p) for p in range(1, 3)]
+
+
+def make_file_df(block_number: int, rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    is_sell = rng.integers(0, 2, size=rows).astype(bool)
+    amount0 = rng.random(size=rows)
+    amount1 = rng.random(size=rows)
+    return pd.DataFrame(
+        {
+            "transact_id": ["0x{b:x}{r:04x}".format(b=block_number, r=r) for r in range(rows)],
+            "block_number": block_number + rng.integers(0, 3, size=rows),
+            "timestamp_unix": 1640000000 + block_number,
+            "swap_number": range(rows),
+            "pair_id": rng.choice(["0xaa", "0xbb", "0xcc", "0xdd"], size=rows),
+            "amount0In": np.where(is_sell, amount0, 0),
+            "amount0Out": np.where(is_sell, 0, amount0),
+            "amount1In": np.where(is_sell, 0, amount1),
+            "amount1Out": np.where(is_sell, amount1, 0),
+            "amountUSD": rng.random(size=rows),
+        }
+    ).sort_values("block_number", ignore_index=True)
+
+
+class FakePairTokens(object):
+    def __init__(self, pair_ids: list):
+        self.valid_pair_ids = pd.Index(hex_ids.hex_to_bytes(pair_ids))
+
+
+def make_maintainer(monkeypatch, tmp_path) -> maintain_block_swaps.BlockSwapMaintainer:
+    """BlockSwapMaintainer in direct load mode with only PAIR_IDS[0] whitelisted."""
+    monkeypatch.setattr(settings, "ETL_LOAD_MODE", "direct")
+    monkeypatch.setattr(maintain_block_swaps.db_functions, "get_last_inserted_block_number", lambda: 0)
+    monkeypatch.setattr(
+        maintain_block_swaps.maintain_pair_tokens, "PairTokenMaintainer", lambda **kwargs: FakePairTokens(PAIR_IDS[:1])
+    )
+    return maintain_block_swaps.BlockSwapMaintainer(local_file_path=str(tmp_path), azure_storage_container="swapdata")
+
+
+def make_raw_file(block_number: int, amounts: list) -> data_classes.FileItem:
+    """In-memory swaps_raw CSV with one swap per amount, alternating between PAIR_IDS."""
+    lines = [
+        "transact_id,block_number,timestamp_unix,swap_number,pair_id,amount0In,amount0Out,amount1In,amount1Out,amountUSD"
+    ]
+    for i, amount in enumerate(amounts):
+        lines.append(
+            "0x{b:x}{i:04x},{b},{t},{i},{p},{a},0,0,{a},{a}".format(
+                b=block_number, i=i, t=1640000000 + block_number, p=PAIR_IDS[i % 2], a=amount
+            )
+        )
+    file_name = "swaps_raw_{b:010d}.csv".format(b=block_number)
+    return data_classes.FileItem(
+        file_name=file_name, full_local_path=file_name, data=io.BytesIO("\n".join(lines).encode("utf-8"))
+    )
+
+
+def test_add_files_to_master_dfs_keeps_raw_rows(monkeypatch, tmp_path):
+    MaintainBlockSwaps = make_maintainer(monkeypatch, tmp_path)
+    files = [
+        make_raw_file(block_number=100, amounts=["12.000000000000000001", "0.5"]),
+        make_raw_file(block_number=101, amounts=["1E-7", "3.250"]),
+    ]
+
+    MaintainBlockSwaps.add_files_to_master_dfs(files=files)
+
+    raw_df = MaintainBlockSwaps.get_raw_df()
+    assert raw_df["block_number"].tolist() == [100, 100, 101, 101]
+    assert raw_df["pair_id"].tolist() == [PAIR_IDS[0], PAIR_IDS[1], PAIR_IDS[0], PAIR_IDS[1]]
+    assert raw_df["amount0In"].tolist() == ["12.000000000000000001", "0.5", "1E-7", "3.250"]
+    assert raw_df["amountUSD"].tolist() == ["12.000000000000000001", "0.5", "1E-7", "3.250"]
+
+    swap_df = pd.concat(MaintainBlockSwaps.swap_dfs, ignore_index=True)
+    assert swap_df["block_number"].tolist() == [100, 101]
+    assert MaintainBlockSwaps._last_block_candidate == 101
+
+
+def test_amounts_out_of_range_are_dropped(monkeypatch, tmp_path):
+    MaintainBlockSwaps = make_maintainer(monkeypatch, tmp_path)
+    monkeypatch.setattr(MaintainBlockSwaps, "exact_amounts", True)
+    monkeypatch.setattr(
+        MaintainBlockSwaps.MaintainPairTokens, "valid_pair_ids", pd.Index(hex_ids.hex_to_bytes(PAIR_IDS))
+    )
+    files = [
+        # the second swap is over DECIMAL(36, 18), the two swaps of block 101 on PAIR_IDS[0] only in total
+        make_raw_file(block_number=100, amounts=["1.5", "1000000000000000000", "2.25"]),
+        make_raw_file(block_number=101, amounts=["600000000000000000", "0.5", "600000000000000000"]),
+    ]
+
+    MaintainBlockSwaps.add_files_to_master_dfs(files=files)
+
+    swap_df = pd.concat(MaintainBlockSwaps.swap_dfs, ignore_index=True)
+    assert swap_df[["block_number", "amount0_in"]].values.tolist() == [
+        [100, Decimal("3.75")],
+        [101, Decimal("0.5")],
+    ]
+    assert swap_df.index.tolist() == [0, 1]
+    assert MaintainBlockSwaps.get_raw_df().shape[0] == 6
+
+
+@pytest.mark.parametrize("swap_file_format", ["csv", "parquet"])
+def test_combine_files_round_trips_raw_rows(monkeypatch, tmp_path, swap_file_format):
+    monkeypatch.setattr(settings, "SWAP_FILE_FORMAT", swap_file_format)
+    files = [
+        make_raw_file(block_number=100, amounts=["12.000000000000000001", "0.5"]),
+        make_raw_file(block_number=101, amounts=["1E-7", "3.250"]),
+    ]
+    InsertSwaps = object.__new__(swap_etl.SwapETL)
+    InsertSwaps.local_file_path = str(tmp_path)
+    InsertSwaps.files_to_process = data_classes.ListofFiles(_items=files)
+    InsertSwaps.MaintainBlockSwaps = make_maintainer(monkeypatch, tmp_path)
+    InsertSwaps.MaintainBlockSwaps.add_files_to_master_dfs(files=files)
+
+    combined_file = InsertSwaps._combine_files()
+
+    assert combined_file.file_name == "swaps_raw_0000000101." + swap_file_format
+    combined_df = csv_functions.read_file_to_dataframe(
+        full_filepath=combined_file.full_local_path,
+        dtype=InsertSwaps.MaintainBlockSwaps.raw_swap_df_dtypes,
+        data=combined_file.data,
+    )
+    pd.testing.assert_frame_equal(combined_df, InsertSwaps.MaintainBlockSwaps.get_raw_df())
+
+
+def test_batch_matches_per_file_aggregation():
+    rng = np.random.default_rng(seed=1)
+    file_dfs = [make_file_df(block_number=b, rows=40, rng=rng) for b in range(100, 400, 3)]
+    valid_pair_ids = ["0xaa", "0xbb", "0xcc"]
+    Maintainer = maintain_block_swaps.BlockSwapMaintainer
+
+    swap_dfs = list()
+    block_dfs = list()
+    for file_df in file_dfs:
+        file_df = file_df[file_df["pair_id"].isin(valid_pair_ids)]
+        swap_dfs.append(Maintainer.get_clean_file_swap_df(file_df=file_df, max_block_uploaded=150))
+        block_dfs.append(Maintainer.get_clean_file_block_df(file_df=file_df))
+
+    batch_swap_df, batch_block_df = Maintainer.get_clean_batch_dfs(
+        file_dfs=file_dfs, valid_pair_ids=valid_pair_ids, max_block_uploaded=150
+    )
+
+    pd.testing.assert_frame_equal(batch_swap_df, pd.concat(swap_dfs, ignore_index=True))
+    pd.testing.assert_frame_equal(batch_block_df.reset_index(drop=True), pd.concat(block_dfs, ignore_index=True))
+
+
+def test_exact_amounts_sum_without_precision_loss():
+    rng = np.random.default_rng(seed=2)
+    file_df = make_file_df(block_number=100, rows=200, rng=rng)
+    amount_columns = ["amount0In", "amount0Out", "amount1In", "amount1Out", "amountUSD"]
+    # 18 decimals and integer parts that a float64 sum can not hold exactly
+    exact_df = file_df.assign(
+        **{
+            col: ["{i}.{d:018d}".format(i=int(a * 1e6), d=int(a * 1e18)) if a > 0 else "0" for a in file_df[col]]
+            for col in amount_columns
+        }
+    )
+
+    float_swap_df = maintain_block_swaps.BlockSwapMaintainer.get_clean_file_swap_df(file_df=file_df)
+    exact_swap_df = maintain_block_swaps.BlockSwapMaintainer.get_clean_file_swap_df(
+        file_df=exact_df, exact_amounts=True
+    )
+
+    pd.testing.assert_frame_equal(
+        exact_swap_df[["block_number", "pair_id"]], float_swap_df[["block_number", "pair_id"]]
+    )
+
+    is_sell = exact_df["amount0In"] != "0"
+    for (block_number, pair_id, sell), group in exact_df.groupby(["block_number", "pair_id", is_sell]):
+        row = exact_swap_df[
+            (exact_swap_df["block_number"] == block_number)
+            & (exact_swap_df["pair_id"] == pair_id)
+            & ((exact_swap_df["amount0_in"] > 0) == sell)
+        ]
+        assert row.shape[0] == 1
+        assert row["amount_usd"].iloc[0] == sum(Decimal(value) for value in group["amountUSD"])
+        assert row["amount1_out"].iloc[0] == sum(Decimal(value) for value in group["amount1Out"])
@@ -0,0 +1,107 @@
+import io
+
+import pandas as pd
+
+from tj_worker.swap_etl import maintain_pair_tokens, whitelist_tokens
+from tj_worker.utils import hex_ids
+
+TOKEN_IDS = [token["address"].lower() for token in whitelist_tokens.tokens[:3]]
+PAIR_IDS = ["0x{p:040x}".format(p=p) for p in range(1, 4)]
+P1, P2, P3 = hex_ids.hex_to_bytes(PAIR_IDS)
+
+
+class FakeDimensions(object):
+    """dim_tokens / dim_pairs kept in dicts, recording the idx filter of every lookup."""
+
+    def __init__(self):
+        self.tokens = dict()
+        self.pairs = dict()
+        self.lookups = list()
+
+    def get_token_ids_to_dict(self, token_idx_greater_than: int = 0) -> dict:
+        self.lookups.append(("tokens", token_idx_greater_than))
+        return {k: v for k, v in self.tokens.items() if v > token_idx_greater_than}
+
+    def get_pair_ids_to_dict(self, pair_idx_greater_than: int = 0) -> dict:
+        self.lookups.append(("pairs", pair_idx_greater_than))
+        return {k: v for k, v in self.pairs.items() if v > pair_idx_greater_than}
+
+    def upsert_dim_tokens(self, tokens_df: pd.DataFrame) -> dict:
+        for token_id in tokens_df["id"]:
+            self.tokens.setdefault(token_id, len(self.tokens) + 1)
+        return {token_id: self.tokens[token_id] for token_id in tokens_df["id"]}
+
+    def upsert_dim_pairs(self, pairs_df: pd.DataFrame) -> dict:
+        for pair_id in pairs_df["id"]:
+            self.pairs.setdefault(pair_id, len(self.pairs) + 1)
+        return {pair_id: self.pairs[pair_id] for pair_id in pairs_df["id"]}
+
+
+class FakePairsBlob(object):
+    def __init__(self):
+        self.pairs = list()
+        self.etag = 0
+        self.downloads = 0
+
+    def add_pair(self, pair_id: str, token0_id: str, token1_id: str):
+        self.pairs.append([pair_id, "pair", token0_id, "T0", "Token0", token1_id, "T1", "Token1"])
+        self.etag += 1
+
+    def download_blob_if_changed(self, blob_name: str, container_name: str, etag: str = None) -> tuple:
+        if etag == str(self.etag):
+            return None, etag
+        self.downloads += 1
+        df = pd.DataFrame(self.pairs, columns=maintain_pair_tokens.PairTokenMaintainer.pair_headers)
+        return io.BytesIO(df.to_csv(index=False).encode()), str(self.etag)
+
+
+def patch_sources(monkeypatch) -> tuple:
+    dimensions = FakeDimensions()
+    blob = FakePairsBlob()
+    for name in ("get_token_ids_to_dict", "get_pair_ids_to_dict", "upsert_dim_tokens", "upsert_dim_pairs"):
+        monkeypatch.setattr(maintain_pair_tokens.db_functions, name, getattr(dimensions, name))
+    monkeypatch.setattr(maintain_pair_tokens.azure_storage, "download_blob_if_changed", blob.download_blob_if_changed)
+    return dimensions, blob
+
+
+def test_refresh_picks_up_new_pairs_incrementally(monkeypatch, tmp_path):
+    dimensions, blob = patch_sources(monkeypatch)
+
+    blob.add_pair(pair_id=PAIR_IDS[0], token0_id=TOKEN_IDS[0], token1_id=TOKEN_IDS[1])
+    Pairs = maintain_pair_tokens.PairTokenMaintainer(local_file_path=str(tmp_path), azure_storage_container="swapdata")
+    assert list(Pairs.valid_pair_ids) == [P1]
+    assert blob.downloads == 1
+
+    Pairs.refresh()
+    assert blob.downloads == 1
+    assert list(Pairs.valid_pair_ids) == [P1]
+
+    # a pair inserted by another worker, then one added to pairs.csv
+    dimensions.pairs[P2] = len(dimensions.pairs) + 1
+    blob.add_pair(pair_id=PAIR_IDS[2], token0_id=TOKEN_IDS[1], token1_id=TOKEN_IDS[2])
+    Pairs.refresh()
+
+    assert blob.downloads == 2
+    assert sorted(Pairs.valid_pair_ids) == [P1, P2, P3]
+    assert Pairs.map_pair_id_to_idx == dimensions.pairs
+    assert Pairs.map_token_id_to_idx == dimensions.tokens
+    assert dimensions.lookups[-2:] == [("tokens", 2), ("pairs", 1)]
+    assert Pairs.get_pair_idxs(pair_ids=pd.Series([P3, P1, P3])).tolist() == [
+        dimensions.pairs[P3],
+        dimensions.pairs[P1],
+        dimensions.pairs[P3],
+    ]
+
+
+def test_refresh_keeps_cached_pairs_when_no_pair_is_whitelisted(monkeypatch, tmp_path):
+    dimensions, blob = patch_sources(monkeypatch)
+    blob.add_pair(pair_id=PAIR_IDS[0], token0_id=TOKEN_IDS[0], token1_id=TOKEN_IDS[1])
+    Pairs = maintain_pair_tokens.PairTokenMaintainer(local_file_path=str(tmp_path), azure_storage_container="swapdata")
+
+    # pairs.csv rewritten with a single pair on a token outside the whitelist
+    blob.pairs = list()
+    blob.add_pair(pair_id=PAIR_IDS[1], token0_id=TOKEN_IDS[0], token1_id="0x" + "f" * 40)
+    Pairs.refresh()
+
+    assert list(Pairs.valid_pair_ids) == [P1]
+    assert Pairs.pair_file_etag == str(blob.etag)
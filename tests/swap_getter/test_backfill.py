@@ -0,0 +1,97 @@
+import asyncio
+import os
+
+from tj_worker.swap_getter import backfill, thegraph, upload_data
+from tj_worker.utils import azure_storage
+
+
+class FakeGraphAPI(object):
+    """Return one transaction per block of a range, failing the ranges starting at a block of failures."""
+
+    def __init__(self, make_transaction, failures: set = None):
+        self.make_transaction = make_transaction
+        self.failures = set() if failures is None else failures
+
+    def run(self, coroutine):
+        return asyncio.run(coroutine)
+
+    async def get_transactions_range_async(self, start_block_number: int, end_block_number: int, page_size: int):
+        if start_block_number in self.failures:
+            raise thegraph.GraphAPIError("shard failed")
+        return [
+            self.make_transaction(block_number=b, pair_id="0xpair" + str(b))
+            for b in range(start_block_number, end_block_number)
+        ]
+
+
+class FakePairMaintainer(object):
+    def __init__(self, local_file_path, azure_storage_container: str, events: list, fail: bool = False):
+        self.events = events
+        self.fail = fail
+
+    def upload_pairs(self, pair_ids: list) -> bool:
+        self.events.append(("pairs", sorted(pair_ids)))
+        return not self.fail
+
+
+def make_backfiller(tmp_path, monkeypatch, make_transaction, failures: set = None, fail_pairs: bool = False):
+    events = list()
+    monkeypatch.setattr(
+        thegraph, "get_graph_api", lambda: FakeGraphAPI(make_transaction=make_transaction, failures=failures)
+    )
+    monkeypatch.setattr(
+        upload_data,
+        "PairMaintainer",
+        lambda **kwargs: FakePairMaintainer(events=events, fail=fail_pairs, **kwargs),
+    )
+    monkeypatch.setattr(
+        azure_storage,
+        "upload_localfile",
+        lambda local_file_path, upload_filename, container_name: events.append(("swaps", upload_filename)),
+    )
+
+    Backfill = backfill.BlockRangeBackfiller(
+        start_block_number=10, end_block_number=20, shard_size=2, max_in_flight=5, local_file_path=str(tmp_path)
+    )
+    return Backfill, events
+
+
+def test_run_uploads_pairs_before_each_shard(tmp_path, monkeypatch, make_transaction):
+    Backfill, events = make_backfiller(tmp_path, monkeypatch, make_transaction)
+
+    Backfill.run()
+
+    assert events == [
+        event
+        for b in range(10, 20, 2)
+        for event in [
+            ("pairs", ["0xpair" + str(b), "0xpair" + str(b + 1)]),
+            ("swaps", "swaps_raw_00000000{b}.csv".format(b=b + 1)),
+        ]
+    ]
+    assert os.listdir(tmp_path) == list()
+
+
+def test_run_removes_shards_after_failed_shard(tmp_path, monkeypatch, make_transaction):
+    Backfill, events = make_backfiller(tmp_path, monkeypatch, make_transaction, failures={14})
+
+    Backfill.run()
+
+    assert [event for event in events if event[0] == "swaps"] == [
+        ("swaps", "swaps_raw_0000000011.csv"),
+        ("swaps", "swaps_raw_0000000013.csv"),
+    ]
+    assert Backfill.failed_shards == [(14, 16)]
+    assert Backfill.next_shard_to_upload == 2
+    assert Backfill.completed_shards == dict()
+    assert os.listdir(tmp_path) == list()
+
+
+def test_run_stops_when_pairs_are_not_uploaded(tmp_path, monkeypatch, make_transaction):
+    Backfill, events = make_backfiller(tmp_path, monkeypatch, make_transaction, fail_pairs=True)
+
+    Backfill.run()
+
+    assert [event for event in events if event[0] == "swaps"] == list()
+    assert Backfill.failed_shards == [(10, 12)]
+    assert os.listdir(tmp_path) == list()
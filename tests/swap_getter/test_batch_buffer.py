@@ -0,0 +1,54 @@
+import os
+
+from tj_worker.swap_getter import batch_buffer, swaps_to_csv
+from tj_worker.utils import csv_functions
+
+
+def make_buffer(tmp_path, **kwargs) -> batch_buffer.SwapBatchBuffer:
+    headers = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path)).file_headers
+    return batch_buffer.SwapBatchBuffer(headers=headers, local_file_path=str(tmp_path), **kwargs)
+
+
+def test_parse_all_data_appends_to_buffer(tmp_path, make_transaction):
+    Buffer = make_buffer(tmp_path, max_rows=50)
+    SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path), batch_buffer=Buffer)
+    data = [make_transaction(block_number=b, transact_number=t) for b in range(10, 20) for t in range(10)]
+
+    assert SwapsToCSV.parse_all_data(data=data, max_block_number=24) == list()
+    assert os.listdir(tmp_path) == list()
+    assert Buffer.is_full()
+
+    batch = Buffer.pop()
+    assert batch.row_count == 100
+    assert batch.max_block_number == 24
+    assert batch.file_name == "swaps_raw_0000000024.csv"
+    assert Buffer.pop() is None
+
+
+def test_recover_drops_last_spilled_block(tmp_path, make_transaction):
+    Buffer = make_buffer(tmp_path, spill_to_disk=True)
+    SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path), batch_buffer=Buffer)
+    data = [make_transaction(block_number=b, transact_number=t) for b in range(10, 20) for t in range(2)]
+    SwapsToCSV.parse_all_data(data=data, max_block_number=19)
+
+    Recovered = make_buffer(tmp_path, spill_to_disk=True)
+
+    assert Recovered.recover(block_number_greater_than=11) == 18
+    assert Recovered.row_count == 14
+    assert Recovered.pop().columns["block_number"][0] == 12
+
+
+def test_parquet_batch_keeps_amount_strings(tmp_path, make_transaction):
+    Buffer = make_buffer(tmp_path, file_format="parquet")
+    SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path), batch_buffer=Buffer)
+    SwapsToCSV.parse_all_data(data=[make_transaction(block_number=10, transact_number=0)], max_block_number=10)
+
+    batch = Buffer.pop()
+    full_filepath = str(tmp_path / batch.file_name)
+    with open(full_filepath, "wb") as f:
+        f.write(batch.to_bytes())
+
+    df = csv_functions.read_file_to_dataframe(full_filepath=full_filepath)
+    assert batch.file_name == "swaps_raw_0000000010.parquet"
+    assert df["block_number"].dtype == "int64"
+    assert df["amountUSD"].tolist() == ["10.5"]
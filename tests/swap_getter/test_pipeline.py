@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from tj_worker import swap_getter
+from tj_worker.swap_getter import swaps_to_csv
+from tj_worker.utils import data_classes
+
+
+class FakeGraphAPI(object):
+    """Return one transaction per block, counting the range requests."""
+
+    def __init__(self, make_transaction):
+        self.make_transaction = make_transaction
+        self.requests = 0
+
+    def get_indexed_block_number(self) -> int:
+        return 10**9
+
+    def get_transactions_range(self, start_block_number: int, end_block_number: int, page_size: int) -> list:
+        self.requests += 1
+        return [self.make_transaction(block_number=b) for b in range(start_block_number, end_block_number)]
+
+
+class FakeUploader(object):
+    """Record queued files in order, optionally blocking until release is set."""
+
+    def __init__(self, release: threading.Event = None):
+        self.release = release
+        self.files_to_upload = data_classes.ListofFiles()
+        self.uploaded = list()
+
+    def add_files_to_upload(self, full_local_paths: list):
+        if self.release is not None:
+            self.release.wait()
+        for full_local_path in full_local_paths:
+            self.files_to_upload.addFile(
+                file=data_classes.FileItem(
+                    file_name=os.path.basename(full_local_path), full_local_path=full_local_path
+                )
+            )
+
+    def upload_files(self):
+        self.uploaded.extend(file.file_name for file in self.files_to_upload._items)
+        self.files_to_upload = data_classes.ListofFiles()
+
+
+class FailingParser(swaps_to_csv.SwapParserToCSV):
+    def parse_all_data(self, data: list, max_block_number: int = None):
+        raise ValueError("bad data")
+
+
+def make_swap_getter(
+    tmp_path, make_transaction, UploadData, SwapsToCSV=None, testing: bool = True
+) -> swap_getter.SwapGetter:
+    # skip __init__, which connects to thegraph.com and azure blob storage
+    GetSwaps = object.__new__(swap_getter.SwapGetter)
+    GetSwaps.testing = testing
+    GetSwaps.block_range = 2
+    GetSwaps.page_size = 1000
+    GetSwaps.indexed_block_number = 0
+    GetSwaps.GraphAPI = FakeGraphAPI(make_transaction=make_transaction)
+    GetSwaps.UploadData = UploadData
+    GetSwaps.BatchBuffer = None
+    GetSwaps.SwapsToCSV = SwapsToCSV or swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path))
+    GetSwaps.SwapsToCSV.max_block_number_processed = 9
+    GetSwaps.data_current_timestamp = datetime.utcnow()
+    return GetSwaps
+
+
+def run_in_thread(GetSwaps: swap_getter.SwapGetter, **kwargs) -> tuple:
+    errors = list()
+
+    def target():
+        try:
+            GetSwaps.run_pipeline(**kwargs)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread, errors
+
+
+def test_pipeline_uploads_blocks_in_order(tmp_path, make_transaction):
+    UploadData = FakeUploader()
+    GetSwaps = make_swap_getter(tmp_path, make_transaction, UploadData=UploadData)
+
+    GetSwaps.run_pipeline(queue_size=2)
+
+    assert GetSwaps.GraphAPI.requests == 4
+    assert UploadData.uploaded == ["swaps_raw_{b:010d}.csv".format(b=b) for b in range(10, 18)]
+
+
+def test_pipeline_blocks_fetching_when_queues_are_full(tmp_path, make_transaction):
+    release = threading.Event()
+    UploadData = FakeUploader(release=release)
+    GetSwaps = make_swap_getter(tmp_path, make_transaction, UploadData=UploadData, testing=False)
+
+    thread, errors = run_in_thread(GetSwaps, queue_size=1)
+    time.sleep(1)
+
+    # one range held by each stage plus one in each queue
+    assert GetSwaps.GraphAPI.requests <= 5
+    assert thread.is_alive()
+
+    GetSwaps.stop_event.set()
+    release.set()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert errors == list()
+
+
+def test_pipeline_stops_every_stage_when_one_fails(tmp_path, make_transaction):
+    UploadData = FakeUploader()
+    GetSwaps = make_swap_getter(
+        tmp_path,
+        make_transaction,
+        UploadData=UploadData,
+        SwapsToCSV=FailingParser(local_file_path=str(tmp_path)),
+        testing=False,
+    )
+
+    thread, errors = run_in_thread(GetSwaps, queue_size=1)
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert [str(e) for e in errors] == ["bad data"]
+    assert GetSwaps.stop_event.is_set()
+    assert UploadData.uploaded == list()
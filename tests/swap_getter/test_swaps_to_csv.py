@@ -0,0 +1,52 @@
+import os
+
+from tj_worker.swap_getter import swaps_to_csv
+
+
+def test_parse_all_data_keeps_last_block_of_complete_range(tmp_path, make_transaction):
+    SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path))
+    data = [make_transaction(block_number=b, transact_number=t) for b in range(10, 20) for t in range(10)]
+
+    SwapsToCSV.parse_all_data(data=data, max_block_number=24)
+
+    assert SwapsToCSV.max_block_number_processed == 24
+    assert len(os.listdir(tmp_path)) == 10
+
+
+def test_parse_all_data_drops_last_block_of_full_page(tmp_path, make_transaction):
+    SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path))
+    data = [make_transaction(block_number=b, transact_number=t) for b in range(10, 20) for t in range(10)]
+
+    SwapsToCSV.parse_all_data(data=data)
+
+    assert SwapsToCSV.max_block_number_processed == 18
+    assert len(os.listdir(tmp_path)) == 9
+
+
+def test_parse_columns_matches_row_parser(tmp_path, make_transaction):
+    SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(tmp_path))
+    data = [make_transaction(block_number=b, transact_number=t) for b in range(10, 20) for t in range(3)]
+    data[0]["swaps"].append(dict(data[0]["swaps"][0], id=data[0]["id"] + "-1", amount0In="0.000000000000000001"))
+    data[1]["swaps"] = list()
+
+    columns = SwapsToCSV.parse_columns(data=data, max_block_number=18)
+
+    rows = [row for transact_data in data[:27] for row in SwapsToCSV._parse_transaction(transact_data=transact_data)]
+    assert list(columns) == SwapsToCSV.file_headers
+    assert list(zip(*[columns[header].tolist() for header in SwapsToCSV.file_headers])) == [tuple(r) for r in rows]
+
+
+def test_columnar_files_match_row_files(tmp_path, make_transaction):
+    data = [make_transaction(block_number=b, transact_number=t) for b in range(10, 15) for t in range(3)]
+    for columnar in [False, True]:
+        local_file_path = tmp_path / str(columnar)
+        local_file_path.mkdir()
+        SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=str(local_file_path), columnar=columnar)
+        SwapsToCSV.parse_all_data(data=data, max_block_number=14)
+        SwapsToCSV.parse_to_file(data=data, block_number=99)
+
+    file_names = sorted(os.listdir(tmp_path / "True"))
+    assert file_names == sorted(os.listdir(tmp_path / "False"))
+    assert len(file_names) == 6
+    for file_name in file_names:
+        assert (tmp_path / "True" / file_name).read_bytes() == (tmp_path / "False" / file_name).read_bytes()
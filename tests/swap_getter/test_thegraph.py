@@ -0,0 +1,120 @@
+import os
+import time
+
+from graphql import build_schema, introspection_from_schema
+
+from tj_worker.swap_getter import thegraph
+
+SCHEMA = """
+type Pair {
+    id: ID!
+    name: String!
+}
+
+type Query {
+    pairs(first: Int): [Pair!]!
+}
+"""
+
+
+class FakeGraphAPI(object):
+    def close(self):
+        pass
+
+
+def make_graph_api(schema_cache_path: str, **kwargs) -> thegraph.GraphAPI:
+    return thegraph.GraphAPI(schema_cache_path=schema_cache_path, **kwargs)
+
+
+def close_graph_api(GraphAPI: thegraph.GraphAPI):
+    GraphAPI.session = None
+    GraphAPI.close()
+
+
+def test_schema_cache_round_trip(tmp_path):
+    schema_cache_path = str(tmp_path / "schema.json")
+
+    GraphAPI = make_graph_api(schema_cache_path=schema_cache_path)
+    assert GraphAPI.client.schema is None
+
+    GraphAPI.client.introspection = introspection_from_schema(build_schema(SCHEMA))
+    GraphAPI._save_schema_cache()
+    close_graph_api(GraphAPI)
+
+    Cached = make_graph_api(schema_cache_path=schema_cache_path)
+    assert Cached.client.schema is not None
+    assert Cached.client.schema.get_type("Pair") is not None
+    close_graph_api(Cached)
+
+
+def test_schema_cache_is_ignored_when_stale_or_unreadable(tmp_path):
+    schema_cache_path = tmp_path / "schema.json"
+    schema_cache_path.write_text('{"__schema": ')
+
+    Unreadable = make_graph_api(schema_cache_path=str(schema_cache_path))
+    assert Unreadable.client.schema is None
+    close_graph_api(Unreadable)
+
+    GraphAPI = make_graph_api(schema_cache_path=str(schema_cache_path))
+    GraphAPI.client.introspection = introspection_from_schema(build_schema(SCHEMA))
+    GraphAPI._save_schema_cache()
+    close_graph_api(GraphAPI)
+    old = time.time() - 120
+    os.utime(schema_cache_path, (old, old))
+
+    Stale = make_graph_api(schema_cache_path=str(schema_cache_path), schema_cache_max_age=60)
+    assert Stale._load_schema_cache() is None
+    assert Stale.client.schema is None
+    close_graph_api(Stale)
+
+
+def test_connect_async_reuses_the_session(tmp_path):
+    schema_cache_path = tmp_path / "schema.json"
+    GraphAPI = make_graph_api(schema_cache_path=str(schema_cache_path))
+    GraphAPI.client.introspection = introspection_from_schema(build_schema(SCHEMA))
+    GraphAPI._save_schema_cache()
+    close_graph_api(GraphAPI)
+
+    GraphAPI = make_graph_api(schema_cache_path=str(schema_cache_path))
+    connects = list()
+
+    async def connect():
+        connects.append(1)
+
+    GraphAPI.client.transport.connect = connect
+
+    session = GraphAPI.run(GraphAPI.connect_async())
+
+    assert GraphAPI.run(GraphAPI.connect_async()) is session
+    assert len(connects) == 1
+    close_graph_api(GraphAPI)
+
+
+def test_get_graph_api_is_shared(monkeypatch):
+    monkeypatch.setattr(thegraph, "_shared_graph_api", None)
+    monkeypatch.setattr(thegraph, "GraphAPI", FakeGraphAPI)
+
+    assert thegraph.get_graph_api() is thegraph.get_graph_api()
+
+
+def test_get_pairs_sends_id_in_batches(tmp_path):
+    GraphAPI = make_graph_api(schema_cache_path=str(tmp_path / "schema.json"))
+    requests = list()
+
+    async def send_request_async(query=None, variable_values=None):
+        requests.append(variable_values)
+        # thegraph.com leaves out unknown pairs
+        return {"pairs": [{"id": id} for id in variable_values["pairFilter"]["id_in"] if id != "0x3"]}
+
+    GraphAPI._send_request_async = send_request_async
+
+    data = GraphAPI.get_pairs(ids=["0x" + str(i) for i in range(7)], batch_size=3, max_in_flight=2)
+
+    assert [request["pairFilter"]["id_in"] for request in requests] == [
+        ["0x0", "0x1", "0x2"],
+        ["0x3", "0x4", "0x5"],
+        ["0x6"],
+    ]
+    assert [request["first"] for request in requests] == [3, 3, 1]
+    assert [pair["id"] for pair in data] == ["0x0", "0x1", "0x2", "0x4", "0x5", "0x6"]
+    close_graph_api(GraphAPI)
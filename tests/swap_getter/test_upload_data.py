@@ -0,0 +1,43 @@
+from tj_worker.swap_getter import thegraph, upload_data
+from tj_worker.utils import azure_storage, csv_functions
+
+
+class FakeGraphAPI(object):
+    def __init__(self):
+        self.requests = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def get_pairs(self, ids: list, batch_size: int = 100) -> list:
+        self.requests.append(ids)
+        return [make_pair(pair_id=pair_id) for pair_id in ids if pair_id != "0xunknown"]
+
+
+def make_pair(pair_id: str) -> dict:
+    return {
+        "id": pair_id,
+        "name": "WAVAX-USDC",
+        "token0": {"id": "0xtoken0", "symbol": "WAVAX", "name": "Wrapped AVAX"},
+        "token1": {"id": "0xtoken1", "symbol": "USDC", "name": "USD Coin"},
+    }
+
+
+def test_add_pairs_appends_every_pair_in_one_request(tmp_path, monkeypatch):
+    GraphAPI = FakeGraphAPI()
+    monkeypatch.setattr(thegraph, "get_graph_api", lambda: GraphAPI)
+    monkeypatch.setattr(azure_storage, "download_blobs", lambda **kwargs: None)
+    Pairs = upload_data.PairMaintainer(local_file_path=str(tmp_path), azure_storage_container="swapdata")
+    Pairs._download_master_pair_file()
+
+    Pairs.add_pairs(pair_ids=["0xpair0", "0xunknown", "0xpair1"])
+
+    df = csv_functions.read_csv_to_dataframe(full_filepath=Pairs.pair_file.full_local_path)
+    assert GraphAPI.requests == [["0xpair0", "0xunknown", "0xpair1"]]
+    assert list(df.columns) == Pairs.pair_file.headers
+    assert df["pair_id"].tolist() == ["0xpair0", "0xpair1"]
+    assert df["token1_symbol"].tolist() == ["USDC", "USDC"]
+    assert Pairs.pair_ids_uploaded == {"0xpair0": True, "0xpair1": True}
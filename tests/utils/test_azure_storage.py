@@ -0,0 +1,230 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from azure.core import exceptions
+
+from tj_worker.utils import azure_storage, blob_manifest, retry
+
+
+class FakeDownload(object):
+    def __init__(self, data: bytes):
+        self.data = data
+        self.size = len(data)
+
+    def readinto(self, stream) -> int:
+        stream.write(self.data)
+        return len(self.data)
+
+
+class FakeBlobServiceClient(object):
+    """Serve blob names as their content, failing the first attempts of each blob in failures."""
+
+    def __init__(self, failures: dict = None):
+        self.failures = dict() if failures is None else failures
+
+    def get_blob_client(self, container_name: str, blob: str, snapshot=None):
+        return self._BlobClient(service=self, blob=blob)
+
+    class _BlobClient(object):
+        def __init__(self, service, blob: str):
+            self.service = service
+            self.blob = blob
+
+        def download_blob(self) -> FakeDownload:
+            if self.service.failures.get(self.blob, 0) > 0:
+                self.service.failures[self.blob] -= 1
+                raise exceptions.ServiceResponseError("connection reset")
+            return FakeDownload(data=self.blob.encode())
+
+
+def test_download_blob_list_retries_each_blob(tmp_path):
+    blob_names = ["swaps_raw_{b:010d}.csv".format(b=b) for b in range(20)]
+    policy = retry.RetryPolicy(max_retries=2, base_delay=0, retry_on={exceptions.ServiceResponseError: None})
+
+    azure_storage.download_blob_list(
+        blob_service_client=FakeBlobServiceClient(failures={blob_names[3]: 2}),
+        container_name="swapdata",
+        blob_names=blob_names,
+        destination_folder=str(tmp_path),
+        max_concurrency=4,
+        retry_policy=policy,
+    )
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == blob_names
+    assert (tmp_path / blob_names[3]).read_bytes() == blob_names[3].encode()
+
+
+def test_download_blob_list_removes_failed_files(tmp_path):
+    blob_names = ["swaps_raw_{b:010d}.csv".format(b=b) for b in range(5)]
+    policy = retry.RetryPolicy(max_retries=1, base_delay=0, retry_on={exceptions.ServiceResponseError: None})
+
+    with pytest.raises(retry.RetryError):
+        azure_storage.download_blob_list(
+            blob_service_client=FakeBlobServiceClient(failures={blob_names[1]: 5}),
+            container_name="swapdata",
+            blob_names=blob_names,
+            destination_folder=str(tmp_path),
+            retry_policy=policy,
+        )
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == blob_names[:1] + blob_names[2:]
+
+
+def make_http_error(error_class, status_code: int) -> exceptions.HttpResponseError:
+    error = error_class(message="status {s}".format(s=status_code))
+    error.status_code = status_code
+    return error
+
+
+@pytest.mark.parametrize(
+    "error, retried",
+    [
+        (exceptions.ServiceResponseError("connection reset"), True),
+        (make_http_error(exceptions.HttpResponseError, 503), True),
+        (make_http_error(exceptions.HttpResponseError, 429), True),
+        (make_http_error(exceptions.HttpResponseError, 408), True),
+        (make_http_error(exceptions.ResourceNotFoundError, 404), False),
+        (make_http_error(exceptions.ClientAuthenticationError, 403), False),
+        (exceptions.HttpResponseError(message="no response"), False),
+    ],
+)
+def test_download_retry_policy_retries_transient_errors_only(error, retried):
+    assert azure_storage.download_retry_policy.is_retryable(error) == retried
+
+
+def test_download_blob_list_to_memory_spills_large_blobs(tmp_path):
+    blob_names = ["swaps_raw_0000000001.csv", "swaps_raw_0000000002_large.csv"]
+
+    files = azure_storage.download_blob_list(
+        blob_service_client=FakeBlobServiceClient(),
+        container_name="swapdata",
+        blob_names=blob_names,
+        destination_folder=str(tmp_path),
+        to_memory=True,
+        spill_size=len(blob_names[0]),
+    )
+
+    assert [file.file_name for file in files] == blob_names
+    assert files[0].data.read() == blob_names[0].encode()
+    assert files[1].data is None
+    assert [path.name for path in tmp_path.iterdir()] == blob_names[1:]
+
+
+def test_get_blob_service_client_is_shared_between_threads():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: azure_storage.get_blob_service_client(), range(16)))
+
+    assert all(client is clients[0] for client in clients)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.reason = "Forbidden" if status_code == 403 else "Accepted"
+
+
+class FakeContainerClient(object):
+    def __init__(self, forbidden: list = None):
+        self.forbidden = list() if forbidden is None else forbidden
+        self.requests = list()
+
+    def delete_blobs(self, *blobs, raise_on_any_failure=True):
+        self.requests.append(blobs)
+        return iter([FakeResponse(403 if blob in self.forbidden else 202) for blob in blobs])
+
+
+def test_delete_blobs_reports_failures_per_blob(monkeypatch):
+    container_client = FakeContainerClient(forbidden=["swaps_raw_0000000300.csv"])
+    monkeypatch.setattr(azure_storage, "get_blob_service_client", lambda: None)
+    monkeypatch.setattr(azure_storage, "get_container_client", lambda **kwargs: container_client)
+
+    file_names = ["swaps_raw_{b:010d}.csv".format(b=b) for b in range(600)]
+    failed = azure_storage.delete_blobs(file_names=file_names, container_name="swapdata")
+
+    assert [len(blobs) for blobs in container_client.requests] == [256, 256, 88]
+    assert list(failed) == ["swaps_raw_0000000300.csv"]
+
+
+class FakeBlob(object):
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeListingContainerClient(object):
+    def __init__(self, blob_names: list):
+        self.blob_names = sorted(blob_names)
+        self.listed = 0
+        self.list_calls = 0
+
+    def list_blobs(self, name_starts_with=""):
+        self.list_calls += 1
+        return self._list(name_starts_with=name_starts_with)
+
+    def _list(self, name_starts_with: str):
+        for name in self.blob_names:
+            if name.startswith(name_starts_with):
+                self.listed += 1
+                yield FakeBlob(name=name)
+
+
+def test_block_number_prefixes_match_only_newer_blocks():
+    prefixes = azure_storage._block_number_prefixes(block_number_greater_than=1995)
+    block_numbers = [1990, 1995, 1996, 1999, 2000, 9999, 10000, 9999999999]
+
+    newer = [b for b in block_numbers if str(b).zfill(10).startswith(tuple(prefixes))]
+
+    assert newer == [1996, 1999, 2000, 9999, 10000, 9999999999]
+    assert prefixes == sorted(prefixes, key=lambda p: p.ljust(10, "0"))
+
+
+def test_list_block_blob_names_skips_older_blobs(monkeypatch, tmp_path):
+    blob_names = ["swaps_raw_{b:010d}.csv".format(b=b) for b in range(1000)] + ["pairs.csv"]
+    container_client = FakeListingContainerClient(blob_names=blob_names)
+    monkeypatch.setattr(azure_storage, "get_blob_service_client", lambda: None)
+    monkeypatch.setattr(azure_storage, "get_container_client", lambda **kwargs: container_client)
+
+    names = azure_storage.list_block_blob_names(
+        container_name="swapdata",
+        blobname_starts_with="swaps_raw_",
+        block_number_greater_than=989,
+        limit=5,
+        seek_block_prefixes=True,
+    )
+    assert names == blob_names[990:995]
+    assert container_client.listed == 10
+
+    manifest = blob_manifest.BlobManifest(manifest_path=str(tmp_path / "manifest.json"))
+    assert (
+        azure_storage.get_last_block_number(
+            container_name="swapdata", blobname_starts_with="swaps_raw_", manifest=manifest
+        )
+        == 999
+    )
+    assert blob_manifest.BlobManifest(manifest_path=manifest.manifest_path).get("swapdata", "swaps_raw_") == 999
+
+
+def test_blob_manifest_creates_its_directory(tmp_path):
+    manifest = blob_manifest.BlobManifest(manifest_path=str(tmp_path / "data" / "manifest.json"))
+
+    manifest.update(container_name="swapdata", blobname_starts_with="swaps_raw_", block_number=10)
+
+    assert blob_manifest.BlobManifest(manifest_path=manifest.manifest_path).get("swapdata", "swaps_raw_") == 10
+
+
+def test_list_block_blob_names_lists_once_without_seeking(monkeypatch):
+    blob_names = ["swaps_raw_{b:010d}.csv".format(b=b) for b in range(20)] + ["swaps_raw_0000000020.json"]
+    container_client = FakeListingContainerClient(blob_names=blob_names)
+    monkeypatch.setattr(azure_storage, "get_blob_service_client", lambda: None)
+    monkeypatch.setattr(azure_storage, "get_container_client", lambda **kwargs: container_client)
+
+    names = azure_storage.list_block_blob_names(
+        container_name="swapdata", blobname_starts_with="swaps_raw_", block_number_greater_than=14, limit=3
+    )
+    assert names == blob_names[15:18]
+    assert container_client.list_calls == 1
+
+    names = azure_storage.list_block_blob_names(
+        container_name="swapdata", blobname_starts_with="swaps_raw_", block_number_greater_than=19
+    )
+    assert names == []
+    assert container_client.list_calls == 2
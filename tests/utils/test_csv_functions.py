@@ -0,0 +1,19 @@
+import pandas as pd
+
+from tj_worker.utils import csv_functions
+
+
+def test_concat_csv_files_keeps_first_header(tmp_path):
+    full_filepaths = list()
+    for i in range(3):
+        full_filepath = str(tmp_path / "swaps_raw_{i}.csv".format(i=i))
+        csv_functions.append_list_of_lists_to_csv(
+            full_filepath=full_filepath, data=[[i, "0xpair"], [i, "0xother"]], headers=["block_number", "pair_id"]
+        )
+        full_filepaths.append(full_filepath)
+
+    csv_functions.concat_csv_files(full_filepaths=full_filepaths, output_filepath=full_filepaths[-1])
+
+    df = pd.read_csv(full_filepaths[-1])
+    assert df["block_number"].tolist() == [0, 0, 1, 1, 2, 2]
+    assert sorted(tmp_path.iterdir()) == [tmp_path / "swaps_raw_{i}.csv".format(i=i) for i in range(3)]
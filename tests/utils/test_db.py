@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import URL
+from sqlalchemy.pool import QueuePool
+
+from tj_worker.model import swaps
+from tj_worker.utils import db, db_functions
+
+
+@pytest.fixture
+def sqlite_db(monkeypatch, tmp_path):
+    """Point the shared engine of tj_worker.utils.db at a SQLite file, with a fresh engine and pool counters."""
+    create_engine = db.create_engine
+
+    def create_sqlite_engine(url, fast_executemany=False, **kwargs):
+        # fast_executemany is a pyodbc option, and SQLite file engines default to NullPool
+        engine = create_engine(url, poolclass=QueuePool, **kwargs)
+
+        @event.listens_for(engine, "connect")
+        def attach_schemas(dbapi_connection, connection_record):
+            dbapi_connection.execute("ATTACH DATABASE '{p}' AS tj".format(p=tmp_path / "tj.db"))
+
+        return engine
+
+    monkeypatch.setattr(db, "get_connection_url", lambda: URL.create("sqlite", database=str(tmp_path / "main.db")))
+    monkeypatch.setattr(db, "create_engine", create_sqlite_engine)
+    monkeypatch.setattr(db, "_engine", None)
+    monkeypatch.setattr(db, "_session_registry", None)
+    monkeypatch.setattr(db, "_pool_events", {"connect": 0, "checkout": 0, "invalidate": 0})
+
+    engine = db.get_engine()
+    swaps.factSwaps.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_get_engine_is_shared_between_threads(sqlite_db):
+    engines = list()
+    registries = list()
+
+    def get_shared():
+        engines.append(db.get_engine())
+        registries.append(db.get_db_session())
+
+    threads = [threading.Thread(target=get_shared) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(engines) == 8
+    assert all(engine is sqlite_db for engine in engines)
+    assert all(registry is registries[0] for registry in registries)
+
+
+def test_db_session_remove_returns_connection_to_pool(sqlite_db):
+    checkouts = db.get_pool_stats()["checkout"]
+
+    for _ in range(5):
+        assert db_functions.get_last_inserted_block_number() == 0
+
+    stats = db.get_pool_stats()
+    assert stats["checkout"] >= checkouts + 5
+    assert stats["connect"] == 1
+    assert sqlite_db.pool.checkedout() == 0
@@ -0,0 +1,205 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+import sqlalchemy
+from packaging.version import Version
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.dialects.mssql import DATETIME2
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+from tj_worker.model import blocks, pairs, swaps, tokens, watermarks
+from tj_worker.utils import db_functions
+
+
+@compiles(DATETIME2, "sqlite")
+def compile_datetime2(type_, compiler, **kw):
+    return "DATETIME"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+
+    @event.listens_for(engine, "connect")
+    def attach_schemas(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS chain")
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS tj")
+
+    for model in (tokens.dimTokens, pairs.dimPairs, blocks.dimBlocks, swaps.factSwaps, watermarks.etlWatermarks):
+        model.__table__.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def key(number: int) -> bytes:
+    return number.to_bytes(20, "big")
+
+
+def make_tokens_df(token_numbers: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "id": [key(t) for t in token_numbers],
+            "symbol": ["T{t}".format(t=t) for t in token_numbers],
+            "name": ["Token {t}".format(t=t) for t in token_numbers],
+        }
+    )
+
+
+def test_upsert_dim_tokens_inserts_only_new_tokens(engine):
+    first = db_functions.upsert_dim_tokens(tokens_df=make_tokens_df([1, 2, 3]), engine=engine)
+    second = db_functions.upsert_dim_tokens(tokens_df=make_tokens_df([2, 3, 4, 4]), engine=engine)
+
+    assert sorted(first) == [key(t) for t in [1, 2, 3]]
+    assert sorted(second) == [key(t) for t in [2, 3, 4]]
+    for token_id in [key(t) for t in [2, 3]]:
+        assert first[token_id] == second[token_id]
+
+    with engine.connect() as conn:
+        rows = conn.execute(select(tokens.dimTokens.id, tokens.dimTokens.token_idx)).all()
+    assert len(rows) == 4
+    assert {row.id: row.token_idx for row in rows} == {**first, **second}
+
+
+def test_upsert_dim_pairs(engine):
+    token_map = db_functions.upsert_dim_tokens(tokens_df=make_tokens_df([1, 2]), engine=engine)
+    pairs_df = pd.DataFrame(
+        {
+            "id": [key(p) for p in [10, 11]],
+            "name": ["T1-T2", "T2-T1"],
+            "token0_idx": [token_map[key(1)], token_map[key(2)]],
+            "token1_idx": [token_map[key(2)], token_map[key(1)]],
+        }
+    )
+
+    pair_map = db_functions.upsert_dim_pairs(pairs_df=pairs_df, engine=engine)
+
+    assert sorted(pair_map) == list(pairs_df["id"])
+    assert len(set(pair_map.values())) == 2
+    assert db_functions.upsert_dim_pairs(pairs_df=pairs_df, engine=engine) == pair_map
+
+
+def test_upsert_dimension_empty():
+    assert db_functions.upsert_dim_tokens(tokens_df=make_tokens_df([])) == dict()
+
+
+def make_batch(block_numbers: list) -> tuple:
+    blocks_df = pd.DataFrame(
+        {
+            "block_number": block_numbers,
+            "timestamp_unix": [1640000000 + b for b in block_numbers],
+            "timestamp": [datetime.utcfromtimestamp(1640000000 + b) for b in block_numbers],
+        }
+    )
+    swaps_df = pd.DataFrame(
+        {
+            "block_number": block_numbers,
+            "pair_idx": 1,
+            "amount0_in": 1.5,
+            "amount0_out": 0.0,
+            "amount1_in": 0.0,
+            "amount1_out": 2.5,
+            "amount_usd": 3.0,
+        }
+    )
+    return blocks_df, swaps_df
+
+
+def count_rows(engine, model) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(model.__table__)).scalar()
+
+
+def test_load_blocks_and_swaps_is_idempotent(engine):
+    assert db_functions.get_etl_watermark(name="test", engine=engine) == 0
+
+    blocks_df, swaps_df = make_batch([10, 11, 12])
+    for _ in range(2):
+        watermark = db_functions.load_blocks_and_swaps(
+            blocks_df=blocks_df, swaps_df=swaps_df, watermark_name="test", block_number=13, engine=engine
+        )
+        assert watermark == 13
+        assert count_rows(engine, blocks.dimBlocks) == 3
+        assert count_rows(engine, swaps.factSwaps) == 3
+
+    blocks_df, swaps_df = make_batch([12, 13, 14])
+    db_functions.load_blocks_and_swaps(
+        blocks_df=blocks_df, swaps_df=swaps_df, watermark_name="test", block_number=14, engine=engine
+    )
+    assert count_rows(engine, blocks.dimBlocks) == 5
+    assert count_rows(engine, swaps.factSwaps) == 4
+    assert count_rows(engine, watermarks.etlWatermarks) == 1
+    assert db_functions.get_etl_watermark(name="test", engine=engine) == 14
+
+
+def test_load_blocks_and_swaps_rolls_back_on_failure(engine):
+    blocks_df, swaps_df = make_batch([10, 11])
+    db_functions.get_etl_watermark(name="test", engine=engine)
+
+    with pytest.raises(KeyError):
+        db_functions.load_blocks_and_swaps(
+            blocks_df=blocks_df,
+            swaps_df=swaps_df.drop(columns=["amount_usd"]),
+            watermark_name="test",
+            block_number=11,
+            engine=engine,
+        )
+
+    assert count_rows(engine, blocks.dimBlocks) == 0
+    assert db_functions.get_etl_watermark(name="test", engine=engine) == 0
+
+
+def test_drop_staging_tables_logs_errors(engine):
+    staging = db_functions.get_staging_table(table=blocks.dimBlocks.__table__, columns=["block_number"])
+
+    with engine.begin() as conn:
+        # never created, so the DROP fails
+        db_functions.drop_staging_tables(conn=conn, tables=[staging])
+
+
+def make_blocks_df(block_numbers: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "block_number": block_numbers,
+            "timestamp_unix": [1640000000 + b for b in block_numbers],
+            "timestamp": [datetime.utcfromtimestamp(1640000000 + b) for b in block_numbers],
+        }
+    )
+
+
+def count_inserts(engine) -> list:
+    """Rows sent by each INSERT into dim_blocks, one entry per round-trip."""
+    inserts = list()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO chain.dim_blocks"):
+            inserts.append(len(parameters) if executemany else statement.count("?") // 3)
+
+    return inserts
+
+
+# pandas >= 2.2 only accepts SQLAlchemy >= 2.0 connections in to_sql
+@pytest.mark.skipif(
+    Version(pd.__version__) >= Version("2.2") and Version(sqlalchemy.__version__) < Version("2.0"),
+    reason="to_sql needs SQLAlchemy 2.0 with this pandas",
+)
+@pytest.mark.parametrize("insert_mode, expected_inserts", [("bulk", [4, 4, 2]), ("multi", [10])])
+def test_insert_dataframe_chunks_rows(engine, monkeypatch, insert_mode, expected_inserts):
+    monkeypatch.setattr(db_functions.settings, "DB_BULK_CHUNK_SIZE", 4)
+    inserts = count_inserts(engine)
+    blocks_df = make_blocks_df(list(range(10)))
+
+    db_functions.insert_dataframe(
+        df=blocks_df,
+        table_name=blocks.dimBlocks.__tablename__,
+        schema=blocks.dimBlocks.__table_args__["schema"],
+        insert_mode=insert_mode,
+        engine=engine,
+    )
+
+    assert inserts == expected_inserts
+    with engine.connect() as conn:
+        rows = conn.execute(select(blocks.dimBlocks.block_number, blocks.dimBlocks.timestamp_unix)).all()
+    assert sorted(rows) == list(zip(blocks_df["block_number"], blocks_df["timestamp_unix"]))
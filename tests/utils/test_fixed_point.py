@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from tj_worker.utils import fixed_point
+
+
+def test_to_parts_truncates_and_formats_exponents():
+    parts = fixed_point.to_parts(
+        pd.Series(["12", "0.000000000000000001", "1234567890.1234567890123456789", "1E-7", "999999999999999999"])
+    )
+
+    assert parts.values.tolist() == [
+        [0, 12, 0, 0],
+        [0, 0, 0, 1],
+        [1, 234567890, 123456789, 12345678],
+        [0, 0, 100, 0],
+        [999999999, 999999999, 0, 0],
+    ]
+
+
+def test_to_parts_marks_negative_and_missing_values_invalid():
+    values = pd.Series(["-1.5", "nan", np.nan, "inf", "abc", "-0", "0"])
+    df = fixed_point.expand_columns(df=pd.DataFrame({"amount": values}), columns=["amount"])
+
+    assert df["amount__int_hi"].tolist() == [fixed_point.INVALID] * 5 + [0, 0]
+    assert fixed_point.is_positive(df=df, column="amount").tolist() == [False] * 7
+    assert fixed_point.is_zero(df=df, column="amount").tolist() == [False] * 5 + [True, True]
+
+
+def test_to_parts_marks_values_out_of_range_invalid():
+    parts = fixed_point.to_parts(pd.Series(["1", "1000000000000000000", "12345678901234567890.5"]))
+
+    assert parts.values.tolist() == [[0, 1, 0, 0], [fixed_point.INVALID, 0, 0, 0], [fixed_point.INVALID, 0, 0, 0]]
+
+
+def test_collapse_columns_carries_parts():
+    df = pd.DataFrame(
+        {
+            "key": [1, 1, 2, 3, 3],
+            "amount": ["0.999999999999999999", "0.000000000000000001", "0", "999999999.5", "0.5"],
+        }
+    )
+
+    summed = fixed_point.expand_columns(df=df, columns=["amount"]).groupby("key", as_index=False).sum()
+    collapsed = fixed_point.collapse_columns(df=summed, columns=["amount"])
+
+    assert list(collapsed.columns) == ["key", "amount"]
+    assert collapsed["amount"].tolist() == [Decimal("1"), Decimal("0"), Decimal("1000000000")]
+
+
+def test_collapse_columns_drops_totals_out_of_range():
+    df = pd.DataFrame({"key": [1, 1, 2, 3, 3], "amount": ["999999999999999999", "1", "2.5", "-1", "1"], "other": "1"})
+
+    summed = fixed_point.expand_columns(df=df, columns=["amount", "other"]).groupby("key", as_index=False).sum()
+    collapsed = fixed_point.collapse_columns(df=summed, columns=["amount", "other"])
+
+    assert collapsed["key"].tolist() == [2]
+    assert collapsed["amount"].tolist() == [Decimal("2.5")]
+    assert collapsed["other"].tolist() == [Decimal("1")]
@@ -0,0 +1,27 @@
+import pytest
+
+from tj_worker.utils import hex_ids
+
+
+def test_hex_to_bytes_round_trip():
+    ids = ["0x" + "00" * 20, "0x" + "ab" * 19 + "00", "0x1f9840a85d5af5bf1d1762f925bdaddc4201f984"]
+
+    keys = hex_ids.hex_to_bytes(ids)
+
+    assert keys.tolist() == [bytes.fromhex(hex_id[2:]) for hex_id in ids]
+    assert all(len(key) == 20 for key in keys)
+    assert hex_ids.bytes_to_hex(keys).tolist() == ids
+
+
+def test_hex_to_bytes_transaction_hashes():
+    ids = ["0x" + "{b:02x}".format(b=b) * 32 for b in range(3)]
+
+    keys = hex_ids.hex_to_bytes(ids, width=hex_ids.HASH_BYTES)
+
+    assert hex_ids.bytes_to_hex(keys, width=hex_ids.HASH_BYTES).tolist() == ids
+
+
+def test_hex_to_bytes_rejects_other_widths():
+    with pytest.raises(ValueError):
+        hex_ids.hex_to_bytes(["0x" + "aa" * 21, "0x" + "aa" * 19])
+    assert hex_ids.hex_to_bytes([]).shape == (0,)
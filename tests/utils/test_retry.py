@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from tj_worker.utils import retry
+
+
+class Flaky(object):
+    def __init__(self, failures: int, exception: Exception = ConnectionError):
+        self.failures = failures
+        self.exception = exception
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exception("failure {c}".format(c=self.calls))
+        return "ok"
+
+    async def call_async(self):
+        return self()
+
+
+def test_call_retries_until_success():
+    policy = retry.RetryPolicy(max_retries=3, base_delay=0)
+    flaky = Flaky(failures=2)
+
+    assert policy.call(flaky) == "ok"
+    assert flaky.calls == 3
+
+
+def test_call_raises_retry_error_after_max_retries():
+    policy = retry.RetryPolicy(max_retries=2, base_delay=0)
+    flaky = Flaky(failures=10)
+
+    with pytest.raises(retry.RetryError) as e:
+        policy.call(flaky)
+
+    assert flaky.calls == 3
+    assert isinstance(e.value.last_exception, ConnectionError)
+
+
+def test_call_does_not_retry_other_exceptions():
+    policy = retry.RetryPolicy(max_retries=3, base_delay=0, retry_on={ConnectionError: None})
+    flaky = Flaky(failures=1, exception=ValueError)
+
+    with pytest.raises(ValueError):
+        policy.call(flaky)
+
+    assert flaky.calls == 1
+
+
+def test_call_async_retries_until_success():
+    policy = retry.RetryPolicy(max_retries=3, base_delay=0)
+    flaky = Flaky(failures=2)
+
+    assert asyncio.run(policy.call_async(flaky.call_async)) == "ok"
+    assert flaky.calls == 3
+
+
+def test_get_delay_backs_off_with_jitter():
+    policy = retry.RetryPolicy(base_delay=1, max_delay=5, jitter=0.5, retry_on={TimeoutError: 2, Exception: None})
+
+    assert 0.5 <= policy.get_delay(attempt=0, exception=ConnectionError()) <= 1
+    assert 2 <= policy.get_delay(attempt=2, exception=ConnectionError()) <= 4
+    assert 2.5 <= policy.get_delay(attempt=10, exception=ConnectionError()) <= 5
+    assert 1 <= policy.get_delay(attempt=0, exception=TimeoutError()) <= 2
+
+
+def test_circuit_breaker_fails_fast_once_open():
+    breaker = retry.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    policy = retry.RetryPolicy(max_retries=5, base_delay=0, circuit_breaker=breaker)
+    flaky = Flaky(failures=10)
+
+    with pytest.raises(retry.CircuitOpenError):
+        policy.call(flaky)
+
+    assert flaky.calls == 2
+    assert breaker.is_open
+
+
+def test_circuit_breaker_closes_after_successful_trial():
+    breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    policy = retry.RetryPolicy(max_retries=1, base_delay=0, circuit_breaker=breaker)
+    flaky = Flaky(failures=1)
+
+    assert policy.call(flaky) == "ok"
+    assert not breaker.is_open
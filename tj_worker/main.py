@@ -12,5 +12,7 @@ if settings.SLEEP_MODE is not None:
 
 if settings.MODULE_TO_RUN == "swap_getter":
     swap_getter.run()
+elif settings.MODULE_TO_RUN == "swap_backfill":
+    swap_getter.run_backfill()
 elif settings.MODULE_TO_RUN == "swap_etl":
     swap_etl.run()
@@ -0,0 +1,7 @@
+-- tj.etl_watermarks, see tj_worker/model/watermarks.py. Deploy with the other tables of the database project.
+CREATE TABLE [tj].[etl_watermarks] (
+    [name]         NVARCHAR (200) NOT NULL,
+    [block_number] INT            NOT NULL,
+    [updated_at]   DATETIME2 (7)  NOT NULL,
+    CONSTRAINT [PK_etl_watermarks] PRIMARY KEY CLUSTERED ([name] ASC)
+);
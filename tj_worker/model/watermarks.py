@@ -0,0 +1,11 @@
+from sqlalchemy import Column
+from sqlalchemy.dialects.mssql import DATETIME2, INTEGER, NVARCHAR
+from tj_worker.utils import db
+
+
+class etlWatermarks(db.Base):
+    __tablename__ = "etl_watermarks"
+    __table_args__ = {"schema": "tj"}
+    name = Column(NVARCHAR(200), primary_key=True, autoincrement=False)
+    block_number = Column(INTEGER, nullable=False)
+    updated_at = Column(DATETIME2, nullable=False)
@@ -1,11 +1,10 @@
+import io
 import os
 import sys
 from time import sleep
 
-import pandas as pd
-
 from ..swap_etl import maintain_block_swaps
-from ..utils import azure_storage, csv_functions, data_classes, log
+from ..utils import azure_storage, csv_functions, data_classes, db, log, settings
 
 logger = log.setup_custom_logger(name=__file__)
 
@@ -34,6 +33,7 @@ class SwapETL(object):
         self.testing = testing
 
         self.files_to_process = data_classes.ListofFiles()
+        self.downloaded_files = list()
 
         self.MaintainBlockSwaps = maintain_block_swaps.BlockSwapMaintainer(
             local_file_path=self.local_file_path,
@@ -64,36 +64,37 @@ class SwapETL(object):
 
             self._maintain_files()
 
+            if i % settings.DB_POOL_STATS_EVERY == 0:
+                db.log_pool_stats()
+
             if self.testing:
                 break
 
     def clear_existing_files(self):
-        file_names = [fn for fn in os.listdir(self.local_file_path) if ".csv" in fn]
+        file_names = [fn for fn in os.listdir(self.local_file_path) if fn.endswith((".csv", ".parquet"))]
         for file in file_names:
             csv_functions.remove_file(full_filepath=os.path.join(self.local_file_path, file))
 
-        file_names = [fn for fn in os.listdir(self.raw_file_dir) if ".csv" in fn]
+        file_names = [fn for fn in os.listdir(self.raw_file_dir) if fn.endswith((".csv", ".parquet"))]
         for file in file_names:
             csv_functions.remove_file(full_filepath=os.path.join(self.raw_file_dir, file))
 
     def _download_files_to_process(self):
-
-        azure_storage.download_block_blobs(
+        """Download the next swaps_raw files into memory; files over BLOB_SPILL_SIZE go to raw_file_dir."""
+        self.downloaded_files = azure_storage.download_block_blobs(
             container_name=self.azure_storage_container,
-            blobname_starts_with="swaps_raw",
-            blobname_ends_with=".csv",
+            blobname_starts_with="swaps_raw_",
+            blobname_ends_with=(".csv", ".parquet"),
             destination_folder=self.raw_file_dir,
             limit=50,
             block_number_greater_than=self.MaintainBlockSwaps.max_block_uploaded,
+            to_memory=True,
         )
 
     def _set_files_to_process(self):
         self.files_to_process = data_classes.ListofFiles()
-        file_names = [fn for fn in os.listdir(self.raw_file_dir) if "swaps_raw" in fn]
-        file_names.sort()
 
-        for file in file_names:
-            file_item = data_classes.FileItem(file_name=file, full_local_path=os.path.join(self.raw_file_dir, file))
+        for file_item in sorted(self.downloaded_files, key=lambda f: f.file_name):
             self.files_to_process.addFile(file=file_item)
 
         if len(self.files_to_process._items) > 0:
@@ -107,53 +108,60 @@ class SwapETL(object):
             sleep(15)
 
     def _process_files(self):
+        self.MaintainBlockSwaps.MaintainPairTokens.refresh()
         self.MaintainBlockSwaps.reset()
 
-        for i, file in enumerate(self.files_to_process._items):
-            if i % 10 == 0:
-                logger.info(
-                    "{i} of {l} | Processing file {f}".format(
-                        i=i + 1, l=len(self.files_to_process._items), f=file.file_name
+        if settings.ETL_BATCH_AGGREGATION:
+            logger.info("Processing {l} files".format(l=len(self.files_to_process._items)))
+            self.MaintainBlockSwaps.add_files_to_master_dfs(files=self.files_to_process._items)
+        else:
+            for i, file in enumerate(self.files_to_process._items):
+                if i % 10 == 0:
+                    logger.info(
+                        "{i} of {l} | Processing file {f}".format(
+                            i=i + 1, l=len(self.files_to_process._items), f=file.file_name
+                        )
                     )
-                )
-            self.MaintainBlockSwaps.add_to_master_dfs(file=file)
-
-        self.MaintainBlockSwaps.insert_master_blocks_df()
+                self.MaintainBlockSwaps.add_to_master_dfs(file=file)
 
-        self.MaintainBlockSwaps.insert_master_swaps_df()
+        self.MaintainBlockSwaps.load_master_dfs()
 
     def _maintain_files(self):
         if len(self.files_to_process._items) == 0:
             return
 
-        combined_csv = self._combine_files()
+        combined_file = self._combine_files()
 
-        blob_storage_full_path = os.path.join("processed", combined_csv.file_name)
+        blob_storage_full_path = os.path.join("processed", combined_file.file_name)
 
         logger.info("Uploading File: {f}".format(f=blob_storage_full_path))
-        azure_storage.upload_localfile(
-            container_name=self.azure_storage_container,
-            local_file_path=combined_csv.full_local_path,
+        azure_storage.upload_data(
+            data=combined_file.data.getvalue(),
             upload_filename=blob_storage_full_path,
+            container_name=self.azure_storage_container,
         )
 
         logger.info("Deleting {d} files from azure storage...".format(d=len(self.files_to_process._items)))
-        for file in self.files_to_process._items:
-            azure_storage.delete_blob(file_name=file.file_name, container_name=self.azure_storage_container)
+        azure_storage.delete_blobs(
+            file_names=[file.file_name for file in self.files_to_process._items],
+            container_name=self.azure_storage_container,
+        )
 
     def _combine_files(self) -> data_classes.FileItem:
+        """Build the processed/ archive in memory from the rows parsed by MaintainBlockSwaps."""
+        file_name = os.path.splitext(self.files_to_process._items[-1].file_name)[0] + "." + settings.SWAP_FILE_FORMAT
 
-        # combine all files in the list
-        combined_csv = pd.concat([pd.read_csv(f.full_local_path) for f in self.files_to_process._items])
+        combined_df = self.MaintainBlockSwaps.get_raw_df()
 
-        # export to csv
-        combined_csv_name_full_path = os.path.join(self.local_file_path, self.files_to_process._items[-1].file_name)
-        combined_file = data_classes.FileItem(
-            file_name=self.files_to_process._items[-1].file_name, full_local_path=combined_csv_name_full_path
-        )
-        combined_csv.to_csv(combined_file.full_local_path, index=False, encoding="utf-8")
+        data = io.BytesIO()
+        if settings.SWAP_FILE_FORMAT == "parquet":
+            combined_df.to_parquet(data, index=False, compression=settings.PARQUET_COMPRESSION)
+        else:
+            data.write(combined_df.to_csv(index=False).encode("utf-8"))
 
-        return combined_file
+        return data_classes.FileItem(
+            file_name=file_name, full_local_path=os.path.join(self.local_file_path, file_name), data=data
+        )
 
 
 def run():
@@ -4,7 +4,7 @@ import numpy as np
 import pandas as pd
 
 from ..swap_etl import maintain_pair_tokens
-from ..utils import csv_functions, data_classes, db_functions, log
+from ..utils import csv_functions, data_classes, db_functions, fixed_point, hex_ids, log, settings
 
 logger = log.setup_custom_logger(name=__file__)
 
@@ -24,30 +24,54 @@ class BlockSwapMaintainer(object):
 
     def __init__(self, local_file_path, azure_storage_container: str):
         self.local_file_path = local_file_path
+        self.watermark_name = "swap_etl/" + azure_storage_container
         self._max_block_uploaded = 0
-        self.max_block_uploaded = db_functions.get_last_inserted_block_number()
+        if settings.ETL_LOAD_MODE == "staged":
+            self.max_block_uploaded = db_functions.get_etl_watermark(name=self.watermark_name)
+        else:
+            self.max_block_uploaded = db_functions.get_last_inserted_block_number()
         self._last_block_candidate = 0
         self.MaintainPairTokens = maintain_pair_tokens.PairTokenMaintainer(
             local_file_path=self.local_file_path, azure_storage_container=azure_storage_container
         )
 
+        # with exact_amounts, amounts stay strings and are summed as fixed point, see utils.fixed_point
+        self.exact_amounts = settings.ETL_EXACT_AMOUNTS
+        amount_dtype = str if self.exact_amounts else float
         self.swap_df_dtypes = {
             "transact_id": str,
             "block_number": int,
             "timestamp_unix": int,
             "swap_number": int,
             "pair_id": str,
-            "amount0In": float,
-            "amount0Out": float,
-            "amount1In": float,
-            "amount1Out": float,
-            "amountUSD": float,
+            "amount0In": amount_dtype,
+            "amount0Out": amount_dtype,
+            "amount1In": amount_dtype,
+            "amount1Out": amount_dtype,
+            "amountUSD": amount_dtype,
+        }
+        # raw files are parsed once with the amounts as written, for the processed/ archive
+        self.raw_swap_df_dtypes = {
+            "transact_id": str,
+            "block_number": int,
+            "timestamp_unix": int,
+            "swap_number": int,
+            "pair_id": str,
+            "amount0In": str,
+            "amount0Out": str,
+            "amount1In": str,
+            "amount1Out": str,
+            "amountUSD": str,
         }
         self.reset()
 
     def reset(self):
+        self._last_block_candidate = 0
         self.master_blocks_df = pd.DataFrame()
         self.master_swaps_df = pd.DataFrame()
+        self.raw_dfs = list()
+        self.swap_dfs = list()
+        self.block_dfs = list()
 
     def get_max_block_uploaded(self):
         return self._max_block_uploaded
@@ -56,24 +80,61 @@ class BlockSwapMaintainer(object):
         if value > self._max_block_uploaded:
             self._max_block_uploaded = value
 
+    def read_file(self, file: data_classes.FileItem) -> pd.DataFrame:
+        """Parse a swaps_raw file, keeping the parsed rows for get_raw_df.
+
+        Returns:
+            pd.DataFrame: rows of the file with swap_df_dtypes, pair_id as 20 byte keys
+        """
+        raw_df = csv_functions.read_file_to_dataframe(
+            full_filepath=file.full_local_path, dtype=self.raw_swap_df_dtypes, data=file.data
+        )
+        self.raw_dfs.append(raw_df)
+        return raw_df.astype(self.swap_df_dtypes).assign(pair_id=hex_ids.hex_to_bytes(raw_df["pair_id"]))
+
+    def get_raw_df(self) -> pd.DataFrame:
+        """Every row read since the last reset, as written in the swaps_raw files."""
+        return self._concat(self.raw_dfs)
+
     def add_to_master_dfs(self, file: data_classes.FileItem):
 
-        file_df = csv_functions.read_csv_to_dataframe(full_filepath=file.full_local_path, dtype=self.swap_df_dtypes)
+        file_df = self.read_file(file=file)
 
         self._last_block_candidate = file_df["block_number"].max()
 
         file_df = file_df[file_df["pair_id"].isin(self.MaintainPairTokens.valid_pair_ids)]
 
-        file_swap_df = self.get_clean_file_swap_df(file_df=file_df, max_block_uploaded=self.max_block_uploaded)
+        file_swap_df = self.get_clean_file_swap_df(
+            file_df=file_df, max_block_uploaded=self.max_block_uploaded, exact_amounts=self.exact_amounts
+        )
         file_block_df = self.get_clean_file_block_df(file_df=file_df)
 
-        self.master_swaps_df = pd.concat([self.master_swaps_df, file_swap_df], ignore_index=True)
-        self.master_blocks_df = pd.concat([self.master_blocks_df, file_block_df], ignore_index=True)
+        self.swap_dfs.append(file_swap_df)
+        self.block_dfs.append(file_block_df)
 
-    def insert_master_blocks_df(self):
+    def add_files_to_master_dfs(self, files: list):
+        """Read every file of a cycle and filter and aggregate them at once, see get_clean_batch_dfs."""
+        if len(files) == 0:
+            return
+
+        file_dfs = [self.read_file(file=file) for file in files]
+        self._last_block_candidate = file_dfs[-1]["block_number"].max()
+
+        batch_swap_df, batch_block_df = self.get_clean_batch_dfs(
+            file_dfs=file_dfs,
+            valid_pair_ids=self.MaintainPairTokens.valid_pair_ids,
+            max_block_uploaded=self.max_block_uploaded,
+            exact_amounts=self.exact_amounts,
+        )
+
+        self.swap_dfs.append(batch_swap_df)
+        self.block_dfs.append(batch_block_df)
+
+    def set_master_blocks_df(self):
         def convert_unix_to_timestamp(timestamp_unix: int):
             return datetime.utcfromtimestamp(timestamp_unix)
 
+        self.master_blocks_df = self._concat(self.block_dfs)
         if self.master_blocks_df.shape[0] == 0:
             return
 
@@ -81,20 +142,68 @@ class BlockSwapMaintainer(object):
             map(convert_unix_to_timestamp, self.master_blocks_df["timestamp_unix"])
         )
 
+    def set_master_swaps_df(self):
+        self.master_swaps_df = self._concat(self.swap_dfs)
+        if self.master_swaps_df.shape[0] == 0:
+            return
+
+        self.master_swaps_df["pair_idx"] = self.MaintainPairTokens.get_pair_idxs(
+            pair_ids=self.master_swaps_df["pair_id"]
+        )
+
+        self.master_swaps_df = self.master_swaps_df.drop(columns=["pair_id"])
+
+    def load_master_dfs(self):
+        """Load the blocks and swaps read since the last reset with the ETL_LOAD_MODE setting."""
+        if settings.ETL_LOAD_MODE == "staged":
+            self.load_master_dfs_staged()
+        else:
+            self.insert_master_blocks_df()
+            self.insert_master_swaps_df()
+
+    def load_master_dfs_staged(self):
+        """Load dim_blocks and fact_swap and advance the watermark to the last block read, in one transaction."""
+        self.set_master_blocks_df()
+        self.set_master_swaps_df()
+
+        if self._last_block_candidate == 0:
+            return
+
+        logger.info(
+            "Loading {b} rows into dim_blocks and {s} rows into fact_swap...".format(
+                b=self.master_blocks_df.shape[0], s=self.master_swaps_df.shape[0]
+            )
+        )
+        self.max_block_uploaded = db_functions.load_blocks_and_swaps(
+            blocks_df=self.master_blocks_df.reindex(columns=["block_number", "timestamp_unix", "timestamp"]),
+            swaps_df=self.master_swaps_df.reindex(
+                columns=[
+                    "block_number",
+                    "pair_idx",
+                    "amount0_in",
+                    "amount0_out",
+                    "amount1_in",
+                    "amount1_out",
+                    "amount_usd",
+                ]
+            ),
+            watermark_name=self.watermark_name,
+            block_number=self._last_block_candidate,
+        )
+
+    def insert_master_blocks_df(self):
+        self.set_master_blocks_df()
+        if self.master_blocks_df.shape[0] == 0:
+            return
+
         logger.info("Inserting {c} rows into dim_blocks...".format(c=self.master_blocks_df.shape[0]))
         db_functions.insert_dim_blocks(blocks_df=self.master_blocks_df)
 
     def insert_master_swaps_df(self):
-        def add_pair_idx(pair_id: str):
-            return self.MaintainPairTokens.map_pair_id_to_idx[pair_id]
-
+        self.set_master_swaps_df()
         if self.master_swaps_df.shape[0] == 0:
             return
 
-        self.master_swaps_df["pair_idx"] = pd.Series(map(add_pair_idx, self.master_swaps_df["pair_id"]))
-
-        self.master_swaps_df = self.master_swaps_df.drop(columns=["pair_id"])
-
         logger.info("Inserting {c} rows into fact_swap...".format(c=self.master_swaps_df.shape[0]))
         db_functions.insert_fact_swaps(swaps_df=self.master_swaps_df)
 
@@ -102,31 +211,80 @@ class BlockSwapMaintainer(object):
             self.max_block_uploaded = self._last_block_candidate
 
     @staticmethod
-    def get_clean_file_swap_df(file_df: pd.DataFrame, max_block_uploaded: int = 0) -> pd.DataFrame:
-        swap_columns = ["block_number", "pair_id", "amount0In", "amount0Out", "amount1In", "amount1Out", "amountUSD"]
+    def _concat(dfs: list) -> pd.DataFrame:
+        # one concat per cycle, so memory and CPU grow linearly with the number of files
+        if len(dfs) == 0:
+            return pd.DataFrame()
+        return pd.concat(dfs, ignore_index=True)
+
+    @staticmethod
+    def get_clean_batch_dfs(
+        file_dfs: list, valid_pair_ids: list, max_block_uploaded: int = 0, exact_amounts: bool = False
+    ) -> tuple:
+        """Filter and aggregate the swaps of several files in one pass.
+
+        Gives the same rows, in the same order, as get_clean_file_swap_df and get_clean_file_block_df
+        run on each file in turn, as long as the files are in block order and no block spans two files.
+        Pair ids are grouped on as categorical codes rather than strings.
+
+        Returns:
+            tuple[pd.DataFrame, pd.DataFrame]: swap and block data frames
+        """
+        batch_df = pd.concat(file_dfs, ignore_index=True)
+        batch_df = batch_df[batch_df["pair_id"].isin(valid_pair_ids)]
+        pair_id_dtype = batch_df["pair_id"].dtype
+        batch_df = batch_df.assign(pair_id=pd.Categorical(batch_df["pair_id"]))
+
+        batch_swap_df = BlockSwapMaintainer.get_clean_file_swap_df(
+            file_df=batch_df, max_block_uploaded=max_block_uploaded, exact_amounts=exact_amounts
+        )
+        batch_swap_df["pair_id"] = batch_swap_df["pair_id"].astype(pair_id_dtype)
+
+        batch_block_df = BlockSwapMaintainer.get_clean_file_block_df(file_df=batch_df)
+
+        return batch_swap_df, batch_block_df
+
+    @staticmethod
+    def get_clean_file_swap_df(
+        file_df: pd.DataFrame, max_block_uploaded: int = 0, exact_amounts: bool = False
+    ) -> pd.DataFrame:
+        """Keep one-directional swaps after max_block_uploaded and sum them per block, pair and direction.
+
+        Args:
+            exact_amounts (bool, optional): Amounts are decimal strings, summed exactly as fixed point into
+                                            Decimal values. Otherwise amounts are floats. Defaults to False.
+        """
+        amount_columns = ["amount0In", "amount0Out", "amount1In", "amount1Out", "amountUSD"]
+        swap_columns = ["block_number", "pair_id"] + amount_columns
         file_swap_df = file_df.drop(columns=[col for col in file_df if col not in swap_columns])
 
+        if exact_amounts:
+            file_swap_df = fixed_point.expand_columns(df=file_swap_df, columns=amount_columns)
+            swap_columns = swap_columns + [part for col in amount_columns for part in fixed_point.part_columns(col)]
+            positive = {col: fixed_point.is_positive(df=file_swap_df, column=col) for col in amount_columns}
+            zero = {col: fixed_point.is_zero(df=file_swap_df, column=col) for col in amount_columns}
+        else:
+            positive = {col: file_swap_df[col] > 0 for col in amount_columns}
+            zero = {col: file_swap_df[col] == 0 for col in amount_columns}
+
         file_swap_df = file_swap_df[
-            (
-                (file_swap_df.amount0In > 0)
-                & (file_swap_df.amount0Out == 0)
-                & (file_swap_df.amount1In == 0)
-                & (file_swap_df.amount1Out > 0)
-            )
-            | (
-                (file_swap_df.amount0In == 0)
-                & (file_swap_df.amount0Out > 0)
-                & (file_swap_df.amount1In > 0)
-                & (file_swap_df.amount1Out == 0)
-            )
+            (positive["amount0In"] & zero["amount0Out"] & zero["amount1In"] & positive["amount1Out"])
+            | (zero["amount0In"] & positive["amount0Out"] & positive["amount1In"] & zero["amount1Out"])
         ]
 
         file_swap_df = file_swap_df[file_swap_df.block_number > max_block_uploaded]
 
-        file_swap_df["isSell"] = np.where(file_swap_df.amount0In > 0, 1, 0)
-        file_swap_df = file_swap_df.groupby(by=["block_number", "pair_id", "isSell"], as_index=False).sum()
+        file_swap_df["isSell"] = np.where(positive["amount0In"].loc[file_swap_df.index], 1, 0)
+        file_swap_df = file_swap_df.groupby(
+            by=["block_number", "pair_id", "isSell"], as_index=False, observed=True
+        ).sum()
+        # pandas < 2 keeps observed categorical groups in order of appearance rather than sorted
+        file_swap_df = file_swap_df.sort_values(by=["block_number", "pair_id", "isSell"], ignore_index=True)
         file_swap_df = file_swap_df.drop(columns=[col for col in file_swap_df if col not in swap_columns])
 
+        if exact_amounts:
+            file_swap_df = fixed_point.collapse_columns(df=file_swap_df, columns=amount_columns).reset_index(drop=True)
+
         file_swap_df = file_swap_df.rename(
             columns={
                 "amount0In": "amount0_in",
@@ -1,14 +1,14 @@
-import codecs
 import os
 
 import pandas as pd
-from tj_worker.model import pairs, tokens
 
 from ..swap_etl import whitelist_tokens
-from ..utils import azure_storage, csv_functions, data_classes, db_functions, log
+from ..utils import azure_storage, csv_functions, data_classes, db_functions, hex_ids, log
 
 logger = log.setup_custom_logger(name=__file__)
 
+WHITELIST_TOKEN_IDS = pd.Index([token["address"].lower() for token in whitelist_tokens.tokens]).unique()
+
 
 class PairTokenMaintainer(object):
     """Maintain dictionary of pair data from database. Insert Pair data from thegraph.com.
@@ -23,6 +23,17 @@ class PairTokenMaintainer(object):
 
     """
 
+    pair_headers = [
+        "pair_id",
+        "name",
+        "token0_id",
+        "token0_symbol",
+        "token0_name",
+        "token1_id",
+        "token1_symbol",
+        "token1_name",
+    ]
+
     def __init__(self, local_file_path, azure_storage_container: str):
         self.azure_storage_container = azure_storage_container
         self.pair_ids_uploaded = dict()
@@ -30,43 +41,67 @@ class PairTokenMaintainer(object):
         self.pair_file = data_classes.FileItem(
             file_name="pairs.csv",
             full_local_path=os.path.join(local_file_path, "pairs.csv"),
-            headers=[
-                "pair_id",
-                "name",
-                "token0_id",
-                "token0_symbol",
-                "token0_name",
-                "token1_id",
-                "token1_symbol",
-                "token1_name",
-            ],
+            headers=self.pair_headers,
         )
         self.reset()
 
     def reset(self):
-        self.map_token_id_to_idx = db_functions.get_token_ids_to_dict()
-        self.map_pair_id_to_idx = db_functions.get_pair_ids_to_dict()
-        pairs_master_df = self._get_pairs_df()
+        """Drop the cached dimensions and load them again in full."""
+        self.map_token_id_to_idx = dict()
+        self.map_pair_id_to_idx = dict()
+        self.pair_idxs = pd.Series(dtype="int64")
+        self.last_token_idx = 0
+        self.last_pair_idx = 0
+        self.pair_file_etag = None
+        self.refresh()
+
+    def refresh(self):
+        """Add the dim_tokens / dim_pairs rows inserted since the last refresh, and the new pairs of pairs.csv
+        if its ETag changed. Called every ETL cycle, at a cost proportional to what changed."""
+        new_tokens = db_functions.get_token_ids_to_dict(token_idx_greater_than=self.last_token_idx)
+        self.map_token_id_to_idx.update(new_tokens)
+        self.last_token_idx = max(new_tokens.values(), default=self.last_token_idx)
+
+        new_pairs = db_functions.get_pair_ids_to_dict(pair_idx_greater_than=self.last_pair_idx)
+        self._add_pairs(new_pairs=new_pairs)
+        self.last_pair_idx = max(new_pairs.values(), default=self.last_pair_idx)
+
+        data, etag = azure_storage.download_blob_if_changed(
+            blob_name=self.pair_file.file_name, container_name=self.azure_storage_container, etag=self.pair_file_etag
+        )
+        if data is None and self.pair_file_etag is not None:
+            if etag is None:
+                logger.warning("Pairs file not found, keeping cached pairs")
+            return
+
+        pairs_master_df = self._get_pairs_df(data=data)
+        if pairs_master_df.shape[0] == 0:
+            if self.pair_file_etag is None:
+                logger.error("Pairs file not found")
+                exit()
+            logger.warning("No whitelisted pairs in pairs file, keeping cached pairs")
+            self.pair_file_etag = etag
+            return
+
         self._insert_tokens(pairs_df=pairs_master_df)
         self._insert_pairs(pairs_df=pairs_master_df)
-
-    def _get_pairs_df(self):
-
-        self._download_master_pair_file()
-
-        pairs_df = csv_functions.read_csv_to_dataframe(full_filepath=self.pair_file.full_local_path)
-
-        csv_functions.remove_file(self.pair_file.full_local_path)
-
-        valid_token_ids = [x["address"].lower() for x in whitelist_tokens.tokens]
-
-        pairs_df = pairs_df[pairs_df["token0_id"].isin(valid_token_ids) & pairs_df["token1_id"].isin(valid_token_ids)]
-
-        if pairs_df.shape[0] == 0:
-            logger.error("Pairs file not found")
-            exit()
-
-        return pairs_df.drop_duplicates()
+        self.pair_file_etag = etag
+
+    def _get_pairs_df(self, data) -> pd.DataFrame:
+        if data is None:
+            pairs_df = pd.DataFrame(columns=self.pair_file.headers)
+        else:
+            pairs_df = csv_functions.read_file_to_dataframe(full_filepath=self.pair_file.full_local_path, data=data)
+
+        pairs_df = pairs_df[
+            pairs_df["token0_id"].isin(WHITELIST_TOKEN_IDS) & pairs_df["token1_id"].isin(WHITELIST_TOKEN_IDS)
+        ]
+
+        pairs_df = pairs_df.drop_duplicates()
+        # ids are kept as 20 byte keys from here on, as stored in dim_tokens / dim_pairs
+        return pairs_df.assign(
+            **{col: hex_ids.hex_to_bytes(pairs_df[col]) for col in ["pair_id", "token0_id", "token1_id"]}
+        )
 
     def _insert_tokens(self, pairs_df: pd.DataFrame):
         token0_df = pairs_df[["token0_id", "token0_symbol", "token0_name"]]
@@ -77,46 +112,52 @@ class PairTokenMaintainer(object):
 
         token_df = pd.concat([token0_df, token1_df], ignore_index=True)
 
-        token_df = token_df.drop_duplicates()
+        token_df = token_df.drop_duplicates(subset=["id"])
+        token_df = token_df[~token_df["id"].isin(self.map_token_id_to_idx)]
 
-        token_dict = token_df.to_dict("records")
-
-        for each in token_dict:
-            if each["id"] in self.map_token_id_to_idx:
-                continue
-            token_id = codecs.decode(str.encode(each["id"][2:]), "hex_codec")
-            token_object = tokens.dimTokens(id=token_id, symbol=each["symbol"], name=each["name"])
-            self.map_token_id_to_idx[each["id"]] = db_functions.insert_dim_tokens(token_object=token_object)
+        if token_df.shape[0] > 0:
+            logger.info("Upserting {c} tokens into dim_tokens...".format(c=token_df.shape[0]))
+            self.map_token_id_to_idx.update(db_functions.upsert_dim_tokens(tokens_df=token_df))
 
     def _insert_pairs(self, pairs_df: pd.DataFrame):
         pair_df_limited = pairs_df[["pair_id", "name", "token0_id", "token1_id"]]
-
-        pair_dict = pair_df_limited.to_dict("records")
-
-        for each in pair_dict:
-            if each["pair_id"] in self.map_pair_id_to_idx:
-                continue
-            pair_id_encoded = codecs.decode(str.encode(each["pair_id"][2:]), "hex_codec")
-            pair_object = pairs.dimPairs(
-                id=pair_id_encoded,
-                name=each["name"],
-                token0_idx=self.map_token_id_to_idx[each["token0_id"]],
-                token1_idx=self.map_token_id_to_idx[each["token1_id"]],
-            )
-            self.map_pair_id_to_idx[each["pair_id"]] = db_functions.insert_dim_pairs(pair_object=pair_object)
-
-    def _download_master_pair_file(self):
-
-        csv_functions.write_empty_file(full_filepath=self.pair_file.full_local_path, headers=self.pair_file.headers)
-
-        azure_storage.download_blobs(
-            container_name=self.azure_storage_container,
-            blobname_starts_with=self.pair_file.file_name,
-            blobname_ends_with="",
-            blobname_contains="",
-            destination_folder=self.local_file_path,
+        pair_df_limited = pair_df_limited.drop_duplicates(subset=["pair_id"])
+        pair_df_limited = pair_df_limited[~pair_df_limited["pair_id"].isin(self.map_pair_id_to_idx)]
+
+        if pair_df_limited.shape[0] == 0:
+            return
+
+        pair_df_limited = pd.DataFrame(
+            {
+                "id": pair_df_limited["pair_id"],
+                "name": pair_df_limited["name"],
+                "token0_idx": pair_df_limited["token0_id"].map(self.map_token_id_to_idx),
+                "token1_idx": pair_df_limited["token1_id"].map(self.map_token_id_to_idx),
+            }
         )
 
+        logger.info("Upserting {c} pairs into dim_pairs...".format(c=pair_df_limited.shape[0]))
+        self._add_pairs(new_pairs=db_functions.upsert_dim_pairs(pairs_df=pair_df_limited))
+
+    def _add_pairs(self, new_pairs: dict):
+        new_pairs = {
+            pair_id: pair_idx for pair_id, pair_idx in new_pairs.items() if pair_id not in self.map_pair_id_to_idx
+        }
+        if len(new_pairs) == 0:
+            return
+
+        self.map_pair_id_to_idx.update(new_pairs)
+        self.pair_idxs = pd.concat([self.pair_idxs, pd.Series(new_pairs, dtype="int64")])
+
     @property
-    def valid_pair_ids(self) -> list:
-        return [pair_id for pair_id in self.map_pair_id_to_idx]
+    def valid_pair_ids(self) -> pd.Index:
+        """Hashed index of every pair id, kept up to date by refresh rather than rebuilt per access."""
+        return self.pair_idxs.index
+
+    def get_pair_idxs(self, pair_ids: pd.Series) -> pd.Series:
+        """pair_idx of every pair id in pair_ids, looked up in one vectorized join."""
+        positions = self.valid_pair_ids.get_indexer(pair_ids)
+        if (positions == -1).any():
+            raise KeyError("Unknown pair ids: {p}".format(p=list(pair_ids[positions == -1].unique())))
+
+        return pd.Series(self.pair_idxs.to_numpy()[positions], index=pair_ids.index, name="pair_idx")
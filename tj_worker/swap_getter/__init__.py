@@ -1,16 +1,25 @@
 import os
-import re
+import queue
 import sys
+import threading
 from datetime import datetime
 from time import sleep
 
 from tj_worker.utils import log
 
-from ..swap_getter import swaps_to_csv, thegraph, upload_data
-from ..utils import azure_storage, csv_functions
+from ..swap_getter import backfill, batch_buffer, swaps_to_csv, thegraph, upload_data
+from ..utils import azure_storage, csv_functions, settings
 
 logger = log.setup_custom_logger(name=__file__)
 
+# Markers passed between pipeline stages
+PIPELINE_FLUSH = object()
+PIPELINE_STOP = object()
+
+
+class PipelineStopped(Exception):
+    """Raised in a pipeline stage when another stage failed."""
+
 
 class SwapGetter(object):
     """Query traderjoe swap data in a loop and save to azure blob storage / SFTP.
@@ -21,8 +30,17 @@ class SwapGetter(object):
 
     """
 
-    def __init__(self, testing: bool = False, azure_storage_container: str = "swapdata"):
+    def __init__(
+        self,
+        testing: bool = False,
+        azure_storage_container: str = "swapdata",
+        block_range: int = settings.GRAPH_BLOCK_RANGE,
+        page_size: int = settings.GRAPH_PAGE_SIZE,
+    ):
         self.azure_storage_container = azure_storage_container
+        self.block_range = block_range
+        self.page_size = page_size
+        self.indexed_block_number = 0
 
         dir_name = os.path.dirname(__file__).replace(os.getcwd() + "/", "")
         self.local_file_path = os.path.join(dir_name, "data")
@@ -30,7 +48,7 @@ class SwapGetter(object):
             os.mkdir(self.local_file_path)
 
         self.testing = testing
-        self.GraphAPI = thegraph.GraphAPI()
+        self.GraphAPI = thegraph.get_graph_api()
 
         self.UploadData = upload_data.DataUploader(
             local_file_path=self.local_file_path,
@@ -38,6 +56,18 @@ class SwapGetter(object):
         )
         self.SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=self.local_file_path)
 
+        self.BatchBuffer = None
+        if settings.SWAP_BATCH_BUFFER:
+            self.BatchBuffer = batch_buffer.SwapBatchBuffer(
+                headers=self.SwapsToCSV.file_headers,
+                local_file_path=self.local_file_path,
+                max_rows=settings.SWAP_BUFFER_MAX_ROWS,
+                max_age=settings.SWAP_BUFFER_MAX_AGE,
+                spill_to_disk=settings.SWAP_BUFFER_SPILL is not None,
+                file_format=settings.SWAP_FILE_FORMAT,
+            )
+            self.SwapsToCSV.batch_buffer = self.BatchBuffer
+
         self.data_current_timestamp = datetime.utcnow()
 
         self.clear_existing_files()
@@ -59,15 +89,145 @@ class SwapGetter(object):
 
         while True:
             i += 1
-            self._get_data(block_number=self.current_block_number)
+            try:
+                self._get_data(block_number=self.current_block_number)
+            except thegraph.GraphAPIError:
+                # already logged, keep uploading and retry the same block after the sleep
+                self.data_current_timestamp = datetime.utcnow()
             self._upload_data()
             self._set_current_block_number()
             self._sleep_time()
             if self.testing and i > 3:
                 break
 
+    def run_pipeline(self, queue_size: int = settings.PIPELINE_QUEUE_SIZE, threshold_count: int = 3000):
+        """Run fetching, parsing and uploading as three threads connected by bounded queues.
+
+        Network fetches, CSV parsing and blob uploads overlap, and a stage blocks once its
+        output queue holds queue_size items so memory stays bounded. Requires the paginated
+        fetch mode, since the fetcher moves on to the next range without waiting for the parser.
+
+        Args:
+            queue_size (int, optional): Maximum number of items waiting between two stages.
+            threshold_count (int, optional): Number of files to collect before uploading. Defaults to 3000.
+        """
+        if self.block_range <= 0:
+            logger.error("Pipelined mode needs GRAPH_BLOCK_RANGE > 0, running sequentially")
+            return self.run_loop()
+
+        self._set_current_block_number()
+
+        self.parse_queue = queue.Queue(maxsize=queue_size)
+        self.upload_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.pipeline_error = None
+
+        stages = [
+            threading.Thread(target=self._run_stage, args=(self._fetch_stage,), name="fetch", daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._parse_stage,), name="parse", daemon=True),
+            threading.Thread(
+                target=self._run_stage, args=(self._upload_stage, threshold_count), name="upload", daemon=True
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+
+        if self.pipeline_error is not None:
+            raise self.pipeline_error
+
+    def _run_stage(self, stage, *args):
+        try:
+            stage(*args)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            logger.exception("Pipeline stage {s} failed".format(s=threading.current_thread().name))
+            self.pipeline_error = e
+            self.stop_event.set()
+
+    def _fetch_stage(self):
+        block_number = self.current_block_number
+        i = 0
+
+        while not self.stop_event.is_set():
+            i += 1
+            try:
+                data, max_block_number = self._fetch_data(block_number=block_number)
+            except thegraph.GraphAPIError:
+                # already logged, retry the same range after the sleep
+                data, max_block_number = list(), None
+                self.data_current_timestamp = datetime.utcnow()
+
+            if max_block_number is not None:
+                self._put(self.parse_queue, (data, max_block_number))
+                block_number = max_block_number + 1
+
+            sleep_time = self._get_delay(timestamp=self.data_current_timestamp)
+            if sleep_time > 0:
+                # caught up with the chain, upload what has been parsed so far
+                self._put(self.parse_queue, PIPELINE_FLUSH)
+                logger.info("Sleeping for {s}".format(s=sleep_time))
+                self.stop_event.wait(sleep_time)
+
+            if self.testing and i > 3:
+                self._put(self.parse_queue, PIPELINE_FLUSH)
+                break
+
+        self._put(self.parse_queue, PIPELINE_STOP)
+
+    def _parse_stage(self):
+        while True:
+            item = self._get(self.parse_queue)
+            if item is PIPELINE_STOP or item is PIPELINE_FLUSH:
+                self._put(self.upload_queue, item)
+                if item is PIPELINE_STOP:
+                    return
+                continue
+
+            data, max_block_number = item
+            file_names = self.SwapsToCSV.parse_all_data(data=data, max_block_number=max_block_number)
+            self._put(self.upload_queue, file_names)
+
+    def _upload_stage(self, threshold_count: int):
+        while True:
+            item = self._get(self.upload_queue)
+            flush = item is PIPELINE_STOP or item is PIPELINE_FLUSH
+
+            if self.BatchBuffer is not None:
+                if flush or self.BatchBuffer.is_full():
+                    self.UploadData.upload_buffer(batch_buffer=self.BatchBuffer)
+            else:
+                if not flush:
+                    self.UploadData.add_files_to_upload(full_local_paths=item)
+                if flush or len(self.UploadData.files_to_upload._items) >= threshold_count:
+                    self.UploadData.upload_files()
+
+            if item is PIPELINE_STOP:
+                return
+
+    def _put(self, pipeline_queue: queue.Queue, item):
+        while not self.stop_event.is_set():
+            try:
+                return pipeline_queue.put(item, timeout=1)
+            except queue.Full:
+                pass
+        raise PipelineStopped()
+
+    def _get(self, pipeline_queue: queue.Queue):
+        while not self.stop_event.is_set():
+            try:
+                return pipeline_queue.get(timeout=1)
+            except queue.Empty:
+                pass
+        raise PipelineStopped()
+
     def clear_existing_files(self):
         file_names = [fn for fn in os.listdir(self.local_file_path)]
+        if self.BatchBuffer is not None and self.BatchBuffer.spill_to_disk:
+            # kept for SwapBatchBuffer.recover
+            file_names = [fn for fn in file_names if not fn.startswith(self.BatchBuffer.spill_file_prefix)]
         for file in file_names:
             csv_functions.remove_file(full_filepath=os.path.join(self.local_file_path, file))
 
@@ -84,32 +244,57 @@ class SwapGetter(object):
             initial_block = 8973570
             max_block_uploaded = self._get_last_uploaded_block()
             logger.info("Last block uploaded from file = {b}".format(b=max_block_uploaded))
+
+            if self.BatchBuffer is not None and self.BatchBuffer.spill_to_disk:
+                recovered_block = self.BatchBuffer.recover(block_number_greater_than=max_block_uploaded)
+                if recovered_block > 0:
+                    self.SwapsToCSV.max_block_number_processed = recovered_block
+                    max_block_uploaded = recovered_block
             self.current_block_number = max(max_block_uploaded + 1, initial_block)
         else:
             self.current_block_number = self.SwapsToCSV.max_block_number_processed + 1
 
     def _sleep_time(self):
-        def delay(timestamp: datetime, seconds_to_now: int = 30):
-            sec_diff = datetime.utcnow() - timestamp
-            sleep_time = int(seconds_to_now - sec_diff.total_seconds())
-            return sleep_time
-
-        sleep_time = delay(timestamp=self.data_current_timestamp)
+        sleep_time = self._get_delay(timestamp=self.data_current_timestamp)
 
         if sleep_time > 0:
             self._upload_data(override_flag=True)
-            sleep_time = delay(timestamp=self.data_current_timestamp)
+            sleep_time = self._get_delay(timestamp=self.data_current_timestamp)
             logger.info("Sleeping for {s}".format(s=sleep_time))
             sleep(sleep_time)
 
+    @staticmethod
+    def _get_delay(timestamp: datetime, seconds_to_now: int = 30) -> int:
+        sec_diff = datetime.utcnow() - timestamp
+        sleep_time = int(seconds_to_now - sec_diff.total_seconds())
+        return sleep_time
+
     def _get_data(self, block_number: int):
         """Retrieve data from GraphAPI and parse data via ParseData class.
 
         Args:
             block_number (int): The minimum block number to query
         """
+        data, max_block_number = self._fetch_data(block_number=block_number)
+        self.SwapsToCSV.parse_all_data(data=data, max_block_number=max_block_number)
+
+    def _fetch_data(self, block_number: int):
+        """Retrieve data from GraphAPI and set data_current_timestamp to the time of its last block.
+
+        Args:
+            block_number (int): The minimum block number to query
+
+        Returns:
+            tuple[list, int]: Transaction data and the last block number completely covered by it,
+                              None unless the paginated mode is used
+        """
         request_start = datetime.utcnow()
-        data = self.GraphAPI.get_transactions(block_number=block_number)
+
+        if self.block_range > 0:
+            data, max_block_number = self._get_data_range(block_number=block_number)
+        else:
+            data = self.GraphAPI.get_transactions(block_number=block_number)
+            max_block_number = None
 
         duration = datetime.utcnow() - request_start
 
@@ -126,40 +311,55 @@ class SwapGetter(object):
             )
         )
 
-        self.SwapsToCSV.parse_all_data(data=data)
+        return data, max_block_number
+
+    def _get_data_range(self, block_number: int):
+        """Retrieve every transaction from block_number up to block_range blocks later.
+
+        The range is capped at the latest block indexed by the subgraph, so every block
+        returned is complete.
+
+        Args:
+            block_number (int): The first block number to query
+
+        Returns:
+            tuple[list, int]: Transaction data and the last block number covered by it. The block
+                              number is None if the subgraph has not indexed block_number yet.
+        """
+        end_block_number = block_number + self.block_range
+        if end_block_number > self.indexed_block_number + 1:
+            self.indexed_block_number = self.GraphAPI.get_indexed_block_number()
+            end_block_number = min(end_block_number, self.indexed_block_number + 1)
+
+        if end_block_number <= block_number:
+            return list(), None
+
+        data = self.GraphAPI.get_transactions_range(
+            start_block_number=block_number, end_block_number=end_block_number, page_size=self.page_size
+        )
+        return data, end_block_number - 1
 
     def _upload_data(self, threshold_count: int = 3000, override_flag: bool = False):
+        if self.BatchBuffer is not None:
+            if self.BatchBuffer.is_full() or override_flag or self.testing:
+                self.UploadData.upload_buffer(batch_buffer=self.BatchBuffer)
+            return
+
         self.UploadData.set_files_to_upload()
 
         if len(self.UploadData.files_to_upload._items) >= threshold_count or override_flag or self.testing:
             self.UploadData.upload_files()
 
     def _get_last_uploaded_block(self):
-        blocks_uploaded = azure_storage.get_blob_names(
-            container_name=self.azure_storage_container,
-            blobname_starts_with="swaps_raw",
-            blobname_ends_with=".csv",
-            limit=10,
-        )
-
-        for file in reversed(blocks_uploaded):
-            try:
-                return int(re.search(r"\d+", file).group())
-            except AttributeError:
-                pass
-
-        blocks_uploaded = azure_storage.get_blob_names(
-            container_name=self.azure_storage_container,
-            blobname_starts_with="processed/swaps_raw",
-            blobname_ends_with=".csv",
-            limit=10,
-        )
-
-        for file in reversed(blocks_uploaded):
-            try:
-                return int(re.search(r"\d+", file).group())
-            except AttributeError:
-                pass
+        for blobname_starts_with in ["swaps_raw_", "processed/swaps_raw_"]:
+            block_number = azure_storage.get_last_block_number(
+                container_name=self.azure_storage_container,
+                blobname_starts_with=blobname_starts_with,
+                blobname_ends_with=(".csv", ".parquet"),
+                seek_block_prefixes=blobname_starts_with.startswith("processed/"),
+            )
+            if block_number > 0:
+                return block_number
         return 0
 
 
@@ -168,6 +368,25 @@ def run():
     logger.info("Initializing....")
     # Try/except just keeps ctrl-c from printing an ugly stacktrace
     try:
-        GetSwaps.run_loop()
+        if settings.SWAP_GETTER_PIPELINE is not None:
+            GetSwaps.run_pipeline()
+        else:
+            GetSwaps.run_loop()
+    except (KeyboardInterrupt):
+        sys.exit()
+
+
+def run_backfill():
+    end_block_number = settings.BACKFILL_END_BLOCK
+    if end_block_number == 0:
+        end_block_number = thegraph.get_graph_api().get_indexed_block_number() + 1
+
+    Backfill = backfill.BlockRangeBackfiller(
+        start_block_number=settings.BACKFILL_START_BLOCK, end_block_number=end_block_number
+    )
+    logger.info("Initializing....")
+    # Try/except just keeps ctrl-c from printing an ugly stacktrace
+    try:
+        Backfill.run()
     except (KeyboardInterrupt):
         sys.exit()
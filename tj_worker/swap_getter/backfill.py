@@ -0,0 +1,215 @@
+import asyncio
+import os
+from datetime import datetime
+
+from tj_worker.utils import log
+
+from ..swap_getter import swaps_to_csv, thegraph, upload_data
+from ..utils import azure_storage, csv_functions, settings
+
+logger = log.setup_custom_logger(name=__file__)
+
+
+class BlockRangeBackfiller(object):
+    """Backfill swap data for a [start_block_number, end_block_number) range.
+
+    The range is split into shards of shard_size blocks that are fetched concurrently,
+    with at most max_in_flight shards requested at once. Each shard is written to its own
+    swaps_raw_<block>.csv, named after the last block of the shard. Shard files are uploaded
+    in block order, each after the pairs it references, so that swap_etl never skips a shard
+    that finished late or drops swaps on pairs missing from pairs.csv. Shard files left behind
+    a failed shard are removed, so a rerun from the failed shard starts from empty files.
+
+    Example Usage:
+        Backfill = BlockRangeBackfiller(start_block_number=8973570, end_block_number=9973570)
+        Backfill.run()
+
+    """
+
+    def __init__(
+        self,
+        start_block_number: int,
+        end_block_number: int,
+        shard_size: int = settings.BACKFILL_SHARD_SIZE,
+        max_in_flight: int = settings.BACKFILL_MAX_IN_FLIGHT,
+        page_size: int = settings.GRAPH_PAGE_SIZE,
+        azure_storage_container: str = "swapdata",
+        upload: bool = True,
+        local_file_path: str = None,
+    ):
+        self.azure_storage_container = azure_storage_container
+        self.shard_size = shard_size
+        self.max_in_flight = max_in_flight
+        self.page_size = page_size
+        self.upload = upload
+
+        if local_file_path is None:
+            dir_name = os.path.dirname(__file__).replace(os.getcwd() + "/", "")
+            local_file_path = os.path.join(dir_name, "backfill_data")
+        self.local_file_path = local_file_path
+        if not os.path.exists(self.local_file_path):
+            os.mkdir(self.local_file_path)
+
+        self.GraphAPI = thegraph.get_graph_api()
+        self.SwapsToCSV = swaps_to_csv.SwapParserToCSV(local_file_path=self.local_file_path)
+        self.Pairs = None
+        if self.upload:
+            self.Pairs = upload_data.PairMaintainer(
+                local_file_path=self.local_file_path, azure_storage_container=self.azure_storage_container
+            )
+
+        self.shards = [
+            (shard_start, min(shard_start + self.shard_size, end_block_number))
+            for shard_start in range(start_block_number, end_block_number, self.shard_size)
+        ]
+        self.reset()
+
+    def reset(self):
+        self.completed_shards = dict()
+        self.failed_shards = list()
+        self.next_shard_to_upload = 0
+        self.blocks_fetched = 0
+        self.rows_fetched = 0
+
+    def run(self):
+        """Fetch every shard and upload the shard files with the pairs they reference."""
+        self.reset()
+        logger.info(
+            "Backfilling {s} shards | Blocks {b}-{e} | Max in flight = {m}".format(
+                s=len(self.shards),
+                b=self.shards[0][0] if self.shards else 0,
+                e=self.shards[-1][1] if self.shards else 0,
+                m=self.max_in_flight,
+            )
+        )
+        self.run_start = datetime.utcnow()
+
+        try:
+            self.GraphAPI.run(self._run())
+        finally:
+            self._remove_stranded_shards()
+
+        self._log_throughput(message="Backfill complete")
+
+        if len(self.failed_shards) > 0:
+            logger.error(
+                "Failed shards = {f} | Rerun from block {b}".format(
+                    f=len(self.failed_shards), b=self.shards[self.next_shard_to_upload][0]
+                )
+            )
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        upload_lock = asyncio.Lock()
+
+        await asyncio.gather(
+            *[
+                self._backfill_shard(semaphore=semaphore, upload_lock=upload_lock, shard_number=shard_number)
+                for shard_number in range(len(self.shards))
+            ]
+        )
+
+    async def _backfill_shard(self, semaphore: asyncio.Semaphore, upload_lock: asyncio.Lock, shard_number: int):
+        start_block_number, end_block_number = self.shards[shard_number]
+
+        async with semaphore:
+            try:
+                data = await self.GraphAPI.get_transactions_range_async(
+                    start_block_number=start_block_number,
+                    end_block_number=end_block_number,
+                    page_size=self.page_size,
+                )
+            except thegraph.GraphAPIError as e:
+                logger.error("Shard {s}-{e} failed: {err}".format(s=start_block_number, e=end_block_number, err=e))
+                self.failed_shards.append(self.shards[shard_number])
+                return
+
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(
+            None, lambda: self.SwapsToCSV.parse_to_file(data=data, block_number=end_block_number - 1)
+        )
+
+        pair_ids = {swap["pair"]["id"] for transact_data in data for swap in transact_data["swaps"]}
+        self.blocks_fetched += end_block_number - start_block_number
+        self.rows_fetched += rows
+        self.completed_shards[shard_number] = (rows, pair_ids)
+        self._log_throughput(
+            message="Shard {s}-{e} | Rows = {r}".format(s=start_block_number, e=end_block_number, r=rows)
+        )
+
+        async with upload_lock:
+            await loop.run_in_executor(None, self._upload_completed_shards)
+
+    def _upload_completed_shards(self):
+        """Upload completed shard files in block order, stopping at the first shard still in flight or failed."""
+        while self.next_shard_to_upload in self.completed_shards:
+            shard_number = self.next_shard_to_upload
+            rows, pair_ids = self.completed_shards.pop(shard_number)
+
+            if rows > 0 and self.upload:
+                if not self.Pairs.upload_pairs(pair_ids=list(pair_ids)):
+                    # swap_etl would drop the swaps on the missing pairs and move past the shard
+                    logger.error(
+                        "Pairs of shard {s}-{e} not uploaded".format(
+                            s=self.shards[shard_number][0], e=self.shards[shard_number][1]
+                        )
+                    )
+                    self.failed_shards.append(self.shards[shard_number])
+                    self._remove_shard_file(shard_number=shard_number)
+                    return
+
+                self._upload_shard_file(shard_number=shard_number)
+
+            self.next_shard_to_upload += 1
+
+    def _upload_shard_file(self, shard_number: int):
+        full_local_path = self._shard_filename(shard_number=shard_number)
+        local_files = [full_local_path]
+        if settings.SWAP_FILE_FORMAT == "parquet":
+            full_local_path = csv_functions.csv_to_parquet(
+                full_filepath=full_local_path,
+                dtype=self.SwapsToCSV.file_dtypes,
+                compression=settings.PARQUET_COMPRESSION,
+            )
+            local_files.append(full_local_path)
+
+        azure_storage.upload_localfile(
+            local_file_path=full_local_path,
+            upload_filename=os.path.basename(full_local_path),
+            container_name=self.azure_storage_container,
+        )
+        for local_file in local_files:
+            csv_functions.remove_file(full_filepath=local_file)
+
+    def _remove_stranded_shards(self):
+        """Remove the files of shards completed after a failed shard.
+
+        parse_to_file appends to existing files, so a rerun over the same blocks would otherwise
+        upload every stranded swap twice.
+        """
+        if not self.upload:
+            return
+
+        for shard_number in list(self.completed_shards):
+            self.completed_shards.pop(shard_number)
+            self._remove_shard_file(shard_number=shard_number)
+
+    def _remove_shard_file(self, shard_number: int):
+        full_local_path = self._shard_filename(shard_number=shard_number)
+        if os.path.exists(full_local_path):
+            csv_functions.remove_file(full_filepath=full_local_path)
+
+    def _shard_filename(self, shard_number: int) -> str:
+        return self.SwapsToCSV.block_number_to_filename(block_number=str(self.shards[shard_number][1] - 1))
+
+    def _log_throughput(self, message: str):
+        seconds = max((datetime.utcnow() - self.run_start).total_seconds(), 1e-6)
+        logger.info(
+            "{m} | Blocks = {b} | Rows = {r} | {bs:.1f} blocks/s | {rs:.1f} rows/s".format(
+                m=message,
+                b=self.blocks_fetched,
+                r=self.rows_fetched,
+                bs=self.blocks_fetched / seconds,
+                rs=self.rows_fetched / seconds,
+            )
+        )
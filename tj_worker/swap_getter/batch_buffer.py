@@ -0,0 +1,233 @@
+import csv
+import glob
+import io
+import os
+import threading
+import time
+
+import pandas as pd
+
+from ..utils import csv_functions, log
+
+logger = log.setup_custom_logger(name=__file__)
+
+
+class SwapBatch(object):
+    """Swap rows taken out of a SwapBatchBuffer, ready to be uploaded as one swaps_raw file.
+
+    Args:
+        columns (dict): column name mapped to its list of values
+        max_block_number (int): last block number covered by the batch
+        spill_file (str): spill file holding the rows, None if spilling is disabled
+        file_format (str): "csv" or "parquet"
+    """
+
+    def __init__(self, columns: dict, max_block_number: int, spill_file: str = None, file_format: str = "csv"):
+        self.columns = columns
+        self.max_block_number = max_block_number
+        self.spill_file = spill_file
+        self.file_format = file_format
+
+    @property
+    def row_count(self) -> int:
+        return len(next(iter(self.columns.values()), list()))
+
+    @property
+    def file_name(self) -> str:
+        return "swaps_raw_" + str(self.max_block_number).zfill(10) + "." + self.file_format
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns)
+
+    def to_csv_bytes(self) -> bytes:
+        data = io.StringIO()
+        self.to_dataframe().to_csv(data, quoting=csv.QUOTE_NONNUMERIC, index=False)
+        return data.getvalue().encode("utf-8")
+
+    def to_parquet_bytes(self, compression: str = "zstd") -> bytes:
+        data = io.BytesIO()
+        self.to_dataframe().to_parquet(data, index=False, compression=compression)
+        return data.getvalue()
+
+    def to_bytes(self, compression: str = "zstd") -> bytes:
+        if self.file_format == "parquet":
+            return self.to_parquet_bytes(compression=compression)
+        return self.to_csv_bytes()
+
+
+class SwapBatchBuffer(object):
+    """Collect parsed swap rows in memory, column by column, until a size or age threshold is reached.
+
+    Replaces the per-block swaps_raw files: rows are appended as they are parsed and popped as
+    one SwapBatch that is uploaded directly. With spill_to_disk, every append is also written
+    to a spill file in local_file_path so that a restarted worker can recover the rows. Spill
+    files rotate on each pop and are only removed once the batch is committed, i.e. uploaded.
+    Safe to share between the parse and upload threads of the pipelined mode.
+
+    Example Usage:
+        Buffer = SwapBatchBuffer(headers=headers, local_file_path=local_file_path)
+        Buffer.append(rows=rows, max_block_number=max_block_number)
+        if Buffer.is_full():
+            batch = Buffer.pop()
+            ...
+            Buffer.commit(batch=batch)
+
+    """
+
+    spill_file_prefix = "swaps_buffer_"
+
+    def __init__(
+        self,
+        headers: list,
+        local_file_path: str,
+        max_rows: int = 100000,
+        max_age: int = 600,
+        spill_to_disk: bool = False,
+        file_format: str = "csv",
+    ):
+        self.headers = headers
+        self.local_file_path = local_file_path
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.spill_to_disk = spill_to_disk
+        self.file_format = file_format
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.columns = {header: list() for header in self.headers}
+        self.row_count = 0
+        self.max_block_number = 0
+        self.first_append = None
+
+    @property
+    def spill_file(self) -> str:
+        return os.path.join(self.local_file_path, "{p}{g:08d}.csv".format(p=self.spill_file_prefix, g=self.generation))
+
+    def append(self, rows: list, max_block_number: int):
+        """Append parsed swap rows.
+
+        Args:
+            rows (list): list of rows, in the order of headers
+            max_block_number (int): last block number completely covered by the rows appended so far
+        """
+        with self._lock:
+            if len(rows) > 0:
+                for header, values in zip(self.headers, zip(*rows)):
+                    self.columns[header].extend(values)
+                self.row_count += len(rows)
+
+                if self.spill_to_disk:
+                    csv_functions.append_list_of_lists_to_csv(
+                        full_filepath=self.spill_file, data=rows, headers=self.headers
+                    )
+
+            if self.first_append is None:
+                self.first_append = time.monotonic()
+            self.max_block_number = max(self.max_block_number, max_block_number)
+
+    def append_columns(self, columns: dict, max_block_number: int):
+        """Append parsed swap columns, see SwapParserToCSV.parse_columns.
+
+        Args:
+            columns (dict): header -> array-like of values, every header of headers
+            max_block_number (int): last block number completely covered by the rows appended so far
+        """
+        values = [columns[header].tolist() for header in self.headers]
+        row_count = len(values[0])
+        with self._lock:
+            if row_count > 0:
+                for header, header_values in zip(self.headers, values):
+                    self.columns[header].extend(header_values)
+                self.row_count += row_count
+
+                if self.spill_to_disk:
+                    csv_functions.append_list_of_lists_to_csv(
+                        full_filepath=self.spill_file, data=zip(*values), headers=self.headers
+                    )
+
+            if self.first_append is None:
+                self.first_append = time.monotonic()
+            self.max_block_number = max(self.max_block_number, max_block_number)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            if self.row_count >= self.max_rows:
+                return True
+            return self.first_append is not None and time.monotonic() - self.first_append >= self.max_age
+
+    def pop(self) -> SwapBatch:
+        """Take every buffered row out of the buffer.
+
+        Returns:
+            SwapBatch: buffered rows, None if the buffer is empty
+        """
+        with self._lock:
+            if self.row_count == 0:
+                self._reset()
+                return None
+
+            batch = SwapBatch(
+                columns=self.columns,
+                max_block_number=self.max_block_number,
+                spill_file=self.spill_file if self.spill_to_disk else None,
+                file_format=self.file_format,
+            )
+            self.generation += 1
+            self._reset()
+            return batch
+
+    def commit(self, batch: SwapBatch):
+        """Remove the spill file of a batch once it has been uploaded."""
+        if batch.spill_file is not None:
+            csv_functions.remove_file(full_filepath=batch.spill_file)
+
+    def recover(self, block_number_greater_than: int = 0) -> int:
+        """Load rows left in spill files by a previous run.
+
+        Rows of the last block found are dropped, since that block may have been cut off
+        mid-write; the caller resumes from that block.
+
+        Args:
+            block_number_greater_than (int, optional): Only recover rows after this block, e.g. the
+                                                       last block already uploaded. Defaults to 0.
+
+        Returns:
+            int: last block number completely recovered, 0 if nothing was recovered
+        """
+        spill_files = sorted(glob.glob(os.path.join(self.local_file_path, self.spill_file_prefix + "*.csv")))
+        if len(spill_files) == 0:
+            return 0
+
+        frames = list()
+        for spill_file in spill_files:
+            try:
+                frames.append(
+                    pd.read_csv(spill_file, dtype=str, keep_default_na=False, on_bad_lines="skip", engine="python")
+                )
+            except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+                logger.error("Unable to recover {f}: {e}".format(f=spill_file, e=e))
+
+        for spill_file in spill_files:
+            csv_functions.remove_file(full_filepath=spill_file)
+
+        spill_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=self.headers)
+        spill_df = spill_df.dropna()
+        spill_df = spill_df[spill_df["block_number"].str.fullmatch(r"\d+")]
+        if spill_df.shape[0] == 0:
+            return 0
+
+        block_numbers = spill_df["block_number"].astype(int)
+        last_block_number = block_numbers.max()
+        spill_df = spill_df[(block_numbers < last_block_number) & (block_numbers > block_number_greater_than)]
+        if last_block_number - 1 <= block_number_greater_than:
+            return 0
+
+        for column in ["block_number", "timestamp_unix", "swap_number"]:
+            spill_df[column] = spill_df[column].astype(int)
+
+        rows = spill_df[self.headers].values.tolist()
+        self.append(rows=rows, max_block_number=last_block_number - 1)
+        logger.info("Recovered {r} rows up to block {b}".format(r=len(rows), b=last_block_number - 1))
+        return last_block_number - 1
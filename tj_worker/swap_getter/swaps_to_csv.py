@@ -1,8 +1,10 @@
 import os
 
+import numpy as np
+import pandas as pd
 from tj_worker.utils import log
 
-from ..utils import csv_functions
+from ..utils import csv_functions, settings
 
 logger = log.setup_custom_logger(name=__file__)
 
@@ -24,29 +26,83 @@ class SwapParserToCSV(object):
 
         map_block_to_transact_id_to_swap_id[block_number][transact_id][swap_id]
 
+    With columnar, transactions are decoded column by column with parse_columns instead of into
+    one list per swap.
+
     Example Usage:
         GraphAPI = thegraph.GraphAPI()
         ParseData.parse_all_data(data=data)
 
     """
 
-    def __init__(self, local_file_path: str):
+    amount_headers = ["amount0In", "amount0Out", "amount1In", "amount1Out", "amountUSD"]
+
+    def __init__(self, local_file_path: str, batch_buffer=None, columnar: bool = settings.SWAP_PARSE_COLUMNAR):
         self.max_block_number_processed = 0
         self.local_file_path = local_file_path
+        self.batch_buffer = batch_buffer
+        self.columnar = columnar
+        self.file_headers = [
+            "transact_id",
+            "block_number",
+            "timestamp_unix",
+            "swap_number",
+            "pair_id",
+            "amount0In",
+            "amount0Out",
+            "amount1In",
+            "amount1Out",
+            "amountUSD",
+        ]
+        # amounts stay strings so that no precision is lost before swap_etl
+        self.file_dtypes = {
+            "transact_id": str,
+            "block_number": int,
+            "timestamp_unix": int,
+            "swap_number": int,
+            "pair_id": str,
+            "amount0In": str,
+            "amount0Out": str,
+            "amount1In": str,
+            "amount1Out": str,
+            "amountUSD": str,
+        }
 
-    def parse_all_data(self, data: list):
+    def parse_all_data(self, data: list, max_block_number: int = None):
         """Loop through each transaction of thegraph.com data
 
         Args:
             data (list): Raw data returned by thegraph.com
+            max_block_number (int, optional): Last block number completely covered by data, as
+                                              returned by GraphAPI.get_transactions_range. When set,
+                                              no block is dropped. Defaults to None.
+
+        Returns:
+            list: Full paths of the files written, empty when rows go to batch_buffer
         """
-        if len(data) == 0:
-            return
+        if max_block_number is not None:
+            self.max_block_number_processed = max_block_number
+        elif len(data) == 0:
+            return list()
+        else:
+            # if data is max length, dont process last block as it could be incomplete
+            self.max_block_number_processed = max([int(row["blockNumber"]) for row in data])
+            if len(data) == 100:
+                self.max_block_number_processed -= 1
 
-        # if data is max length, dont process last block as it could be incomplete
-        self.max_block_number_processed = max([int(row["blockNumber"]) for row in data])
-        if len(data) == 100:
-            self.max_block_number_processed -= 1
+        if self.columnar:
+            return self._parse_all_data_columnar(data=data)
+
+        if self.batch_buffer is not None:
+            rows = list()
+            for transact_data in data:
+                if int(transact_data["blockNumber"]) <= self.max_block_number_processed:
+                    rows.extend(self._parse_transaction(transact_data=transact_data))
+            self.batch_buffer.append(rows=rows, max_block_number=self.max_block_number_processed)
+            return list()
+
+        if len(data) == 0:
+            return list()
 
         file_data = dict()
 
@@ -63,27 +119,127 @@ class SwapParserToCSV(object):
 
             file_data[file_name].extend(data)
 
-        file_headers = [
-            "transact_id",
-            "block_number",
-            "timestamp_unix",
-            "swap_number",
-            "pair_id",
-            "amount0In",
-            "amount0Out",
-            "amount1In",
-            "amount1Out",
-            "amountUSD",
-        ]
         for file_name in file_data:
             csv_functions.append_list_of_lists_to_csv(
-                full_filepath=file_name, data=file_data[file_name], headers=file_headers
+                full_filepath=file_name, data=file_data[file_name], headers=self.file_headers
             )
+        return list(file_data)
+
+    def parse_to_file(self, data: list, block_number: int) -> int:
+        """Parse every transaction of data into a single swaps_raw file named after block_number.
+
+        Used for block ranges that are known to be complete, e.g. a backfill shard.
+
+        Args:
+            data (list): Raw data returned by thegraph.com
+            block_number (int): Block number used in the file name
+
+        Returns:
+            int: Number of swap rows written
+        """
+        if self.columnar:
+            columns = self.parse_columns(data=data)
+            row_count = len(columns["block_number"])
+            if row_count > 0:
+                self._write_columns(
+                    full_filepath=self.block_number_to_filename(block_number=str(block_number)), columns=columns
+                )
+            return row_count
+
+        rows = list()
+        for transact_data in data:
+            rows.extend(self._parse_transaction(transact_data=transact_data))
+
+        if len(rows) > 0:
+            csv_functions.append_list_of_lists_to_csv(
+                full_filepath=self.block_number_to_filename(block_number=str(block_number)),
+                data=rows,
+                headers=self.file_headers,
+            )
+        return len(rows)
 
     def block_number_to_filename(self, block_number: str):
         file_name = "swaps_raw_" + block_number.zfill(10) + ".csv"
         return os.path.join(self.local_file_path, file_name)
 
+    def _parse_all_data_columnar(self, data: list) -> list:
+        columns = self.parse_columns(data=data, max_block_number=self.max_block_number_processed)
+
+        if self.batch_buffer is not None:
+            self.batch_buffer.append_columns(columns=columns, max_block_number=self.max_block_number_processed)
+            return list()
+
+        file_names = list()
+        df = pd.DataFrame(columns)
+        for block_number, block_df in df.groupby("block_number", sort=False):
+            file_name = self.block_number_to_filename(block_number=str(block_number))
+            self._write_columns(full_filepath=file_name, columns=block_df)
+            file_names.append(file_name)
+        return file_names
+
+    def parse_columns(self, data: list, max_block_number: int = None) -> dict:
+        """Decode thegraph.com transactions straight into one preallocated array per file header.
+
+        Transaction fields are decoded once per transaction and repeated over its swaps with np.repeat,
+        and every swap field is read in one pass per column. Amounts are kept as the decimal strings
+        returned by thegraph.com, like the row parser.
+
+        Args:
+            data (list): Raw data returned by thegraph.com
+            max_block_number (int, optional): Skip transactions after this block. Defaults to None.
+
+        Returns:
+            dict: file header -> np.ndarray
+        """
+        if max_block_number is not None:
+            data = [transact_data for transact_data in data if int(transact_data["blockNumber"]) <= max_block_number]
+
+        transaction_count = len(data)
+        swap_counts = np.fromiter(
+            (len(transact_data["swaps"]) for transact_data in data), dtype=np.int64, count=transaction_count
+        )
+        swaps = [swap_data for transact_data in data for swap_data in transact_data["swaps"]]
+        swap_count = len(swaps)
+
+        def transaction_column(field: str, dtype) -> np.ndarray:
+            if dtype is object:
+                values = np.empty(transaction_count, dtype=object)
+                values[:] = [transact_data[field] for transact_data in data]
+            else:
+                values = np.fromiter(
+                    (transact_data[field] for transact_data in data), dtype=dtype, count=transaction_count
+                )
+            return np.repeat(values, swap_counts)
+
+        def swap_column(values) -> np.ndarray:
+            column = np.empty(swap_count, dtype=object)
+            column[:] = list(values)
+            return column
+
+        columns = {
+            "transact_id": transaction_column(field="id", dtype=object),
+            "block_number": transaction_column(field="blockNumber", dtype=np.int64),
+            "timestamp_unix": transaction_column(field="timestamp", dtype=np.int64),
+            "swap_number": np.fromiter(
+                (swap_data["id"][swap_data["id"].find("-") + 1 :] for swap_data in swaps),
+                dtype=np.int64,
+                count=swap_count,
+            ),
+            "pair_id": swap_column(swap_data["pair"]["id"] for swap_data in swaps),
+        }
+        for header in self.amount_headers:
+            columns[header] = swap_column(swap_data[header] for swap_data in swaps)
+
+        return columns
+
+    def _write_columns(self, full_filepath: str, columns):
+        """Append parsed columns (dict or data frame) to a swaps_raw file, zipped into rows on the fly."""
+        csv_functions.append_list_of_lists_to_csv(
+            full_filepath=full_filepath,
+            data=zip(*[columns[header].tolist() for header in self.file_headers]),
+            headers=self.file_headers,
+        )
+
     def _parse_transaction(self, transact_data: dict):
         """Parse raw transaction data and append to dim_blocks_objects and dim_transaction_objects
 
@@ -1,34 +1,108 @@
 from __future__ import absolute_import
 
 import asyncio
-from time import sleep
+import atexit
+import json
+import os
+import threading
+import time
 
+import aiohttp
 from gql import Client, gql
+from gql.client import AsyncClientSession
 from gql.transport import exceptions
 from gql.transport.aiohttp import AIOHTTPTransport
-from tj_worker.utils import log
+from tj_worker.utils import log, retry, settings
 
 logger = log.setup_custom_logger(name=__file__)
 
+_shared_graph_api = None
+_shared_graph_api_lock = threading.Lock()
+
+
+class GraphAPIError(Exception):
+    """Raised when a request to thegraph.com fails after every retry, or is refused by the circuit breaker."""
+
+
+def get_graph_api() -> "GraphAPI":
+    """Return the GraphAPI shared by every caller in the process, creating it on first use.
+
+    Returns:
+        GraphAPI: shared instance
+    """
+    global _shared_graph_api
+
+    with _shared_graph_api_lock:
+        if _shared_graph_api is None:
+            _shared_graph_api = GraphAPI()
+            atexit.register(_shared_graph_api.close)
+        return _shared_graph_api
+
 
 class GraphAPI(object):
     """Request data from thegraph.com
 
+    One long-lived session is kept per instance. It runs on a private event loop in a
+    background thread, so the sync methods can be called from any thread and async callers
+    can share the same connection pool through GraphAPI.run. The introspected schema is
+    cached at schema_cache_path, so later startups skip the introspection round-trip.
+
     Example Usage:
-        with thegraph.GraphAPI() as g:
+        with thegraph.get_graph_api() as g:
             data = g.get_pair(id=pair_str)
 
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        schema_cache_path: str = settings.GRAPH_SCHEMA_CACHE_PATH,
+        schema_cache_max_age: int = settings.GRAPH_SCHEMA_CACHE_MAX_AGE,
+        keepalive_timeout: int = settings.GRAPH_KEEPALIVE_TIMEOUT,
+        execute_timeout: int = settings.GRAPH_EXECUTE_TIMEOUT,
+        retry_policy: retry.RetryPolicy = None,
+    ):
         base_url = "https://api.thegraph.com/subgraphs/name/traderjoe-xyz/exchange"
+        self.schema_cache_path = schema_cache_path
+        self.schema_cache_max_age = schema_cache_max_age
+        self.keepalive_timeout = keepalive_timeout
+
+        if retry_policy is None:
+            retry_policy = retry.RetryPolicy(
+                max_retries=settings.GRAPH_MAX_RETRIES,
+                base_delay=settings.GRAPH_RETRY_BASE_DELAY,
+                max_delay=settings.GRAPH_RETRY_MAX_DELAY,
+                retry_on={
+                    # query errors are mostly the subgraph lagging or overloaded, give it longer to recover
+                    exceptions.TransportQueryError: settings.GRAPH_RETRY_BASE_DELAY * 5,
+                    exceptions.TransportServerError: None,
+                    exceptions.TransportProtocolError: None,
+                    aiohttp.ClientError: None,
+                    asyncio.TimeoutError: None,
+                },
+                circuit_breaker=retry.CircuitBreaker(
+                    failure_threshold=settings.GRAPH_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.GRAPH_CIRCUIT_RESET_TIMEOUT,
+                ),
+            )
+        self.retry_policy = retry_policy
 
         # Select your transport with a defined url endpoint
         transport = AIOHTTPTransport(url=base_url)
 
-        # Create a GraphQL client using the defined transport
-        self.client = Client(transport=transport, fetch_schema_from_transport=True)
-        self.retries = 0
+        # Create a GraphQL client using the defined transport, with the cached schema if there is one
+        introspection = self._load_schema_cache()
+        if introspection is None:
+            self.client = Client(
+                transport=transport, fetch_schema_from_transport=True, execute_timeout=execute_timeout
+            )
+        else:
+            self.client = Client(transport=transport, introspection=introspection, execute_timeout=execute_timeout)
+
+        self.session = None
+        self._connect_lock = asyncio.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
 
     def __enter__(self):
         return self
@@ -36,6 +110,56 @@ class GraphAPI(object):
     def __exit__(self, exc_type, exc_value, traceback):
         pass
 
+    def run(self, coroutine):
+        """Run a coroutine on the session's event loop and wait for its result.
+
+        Must not be called from a coroutine already running on that loop.
+
+        Args:
+            coroutine: Coroutine to run
+
+        Returns:
+            any: Result of the coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def connect_async(self) -> AsyncClientSession:
+        """Connect the shared session if it is not connected yet.
+
+        Returns:
+            AsyncClientSession: connected session of self.client
+        """
+        async with self._connect_lock:
+            if self.session is None:
+                self.client.transport.client_session_args = {
+                    "connector": aiohttp.TCPConnector(keepalive_timeout=self.keepalive_timeout)
+                }
+                await self.client.transport.connect()
+                session = AsyncClientSession(client=self.client)
+
+                if self.client.schema is None:
+                    try:
+                        await session.fetch_schema()
+                    except Exception:
+                        await self.client.transport.close()
+                        raise
+                    self._save_schema_cache()
+
+                self.session = session
+
+        return self.session
+
+    def close(self):
+        """Close the shared session and stop its event loop."""
+
+        async def close_session():
+            if self.session is not None:
+                await self.client.transport.close()
+                self.session = None
+
+        self.run(close_session())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
     def get_token(self, id: str):
         """Get Token data
 
@@ -107,6 +231,120 @@ class GraphAPI(object):
         else:
             return None
 
+    def get_transactions_range(self, start_block_number: int, end_block_number: int, page_size: int = 1000) -> list:
+        """Get every transaction where start_block_number <= blockNumber < end_block_number
+
+        The range is paged through with an id cursor, so blocks are never truncated
+        no matter how many transactions they contain.
+
+        Args:
+            start_block_number (int): first block_number of the range
+            end_block_number (int): block_number to stop before
+            page_size (int, optional): Number of transactions per request. Defaults to 1000.
+
+        Returns:
+            list: Transaction data ordered by blockNumber
+        """
+        return self.run(
+            self.get_transactions_range_async(
+                start_block_number=start_block_number, end_block_number=end_block_number, page_size=page_size
+            )
+        )
+
+    async def get_transactions_range_async(
+        self, start_block_number: int, end_block_number: int, page_size: int = 1000
+    ) -> list:
+        """Async version of get_transactions_range, for coroutines started with GraphAPI.run.
+
+        Args:
+            start_block_number (int): first block_number of the range
+            end_block_number (int): block_number to stop before
+            page_size (int, optional): Number of transactions per request. Defaults to 1000.
+
+        Returns:
+            list: Transaction data ordered by blockNumber
+        """
+        query = self._get_transactions_range_query()
+        transactions = list()
+        last_id = None
+
+        while True:
+            variable_values = self._get_transactions_range_variables(
+                start_block_number=start_block_number,
+                end_block_number=end_block_number,
+                page_size=page_size,
+                last_id=last_id,
+            )
+            data = await self._send_request_async(query=query, variable_values=variable_values)
+            page = data.get("transactions", list())
+            transactions.extend(page)
+
+            if len(page) < page_size:
+                break
+            last_id = page[-1]["id"]
+
+        transactions.sort(key=lambda row: int(row["blockNumber"]))
+        return transactions
+
+    @staticmethod
+    def _get_transactions_range_query():
+        return gql(
+            """
+                        query FetchTransactbyBlockRange($transactionFilter: Transaction_filter, $first: Int)
+                        {
+                        transactions(where: $transactionFilter
+                        first: $first
+                        orderBy: id
+                        orderDirection: asc
+                        )
+                        { 	id
+                                timestamp
+                                    blockNumber
+                                swaps{
+                                        id
+                                        amountUSD
+                                        amount0In
+                                        amount0Out
+                                        amount1In
+                                        amount1Out
+                                        pair{	id
+                                            }
+                                }
+                        }
+                        }
+        """
+        )
+
+    @staticmethod
+    def _get_transactions_range_variables(
+        start_block_number: int, end_block_number: int, page_size: int, last_id: str = None
+    ) -> dict:
+        transaction_filter = {
+            "blockNumber_gte": str(start_block_number),
+            "blockNumber_lt": str(end_block_number),
+        }
+        if last_id is not None:
+            transaction_filter["id_gt"] = last_id
+
+        return {"transactionFilter": transaction_filter, "first": page_size}
+
+    def get_indexed_block_number(self) -> int:
+        """Get the latest block number indexed by the subgraph
+
+        Returns:
+            int: block number
+        """
+        query = gql(
+            """
+                        query FetchIndexedBlock
+                        {
+                        _meta { block { number } }
+                        }
+        """
+        )
+        data = self._send_request(query=query)
+        return int(data["_meta"]["block"]["number"])
+
     def get_pair(self, id: str) -> dict:
         """Get Pair data
 
@@ -145,43 +383,126 @@ class GraphAPI(object):
         else:
             return None
 
-    def _send_request(self, query: str = None, variable_values: dict = None, max_retries: int = 3):
-        """Send request to endpoint
+    def get_pairs(self, ids: list, batch_size: int = 100, max_in_flight: int = 4) -> list:
+        """Get Pair data for many pairs, batch_size pairs per request with up to max_in_flight requests at once
+
+        Args:
+            ids (list): ids for pairs to query
+            batch_size (int, optional): Number of pairs per request. Defaults to 100.
+            max_in_flight (int, optional): Number of concurrent requests. Defaults to 4.
+
+        Returns:
+            list: Pair data, pairs unknown to thegraph.com are left out
+        """
+        return self.run(self.get_pairs_async(ids=ids, batch_size=batch_size, max_in_flight=max_in_flight))
+
+    async def get_pairs_async(self, ids: list, batch_size: int = 100, max_in_flight: int = 4) -> list:
+        """Async version of get_pairs, for coroutines started with GraphAPI.run.
+
+        Args:
+            ids (list): ids for pairs to query
+            batch_size (int, optional): Number of pairs per request. Defaults to 100.
+            max_in_flight (int, optional): Number of concurrent requests. Defaults to 4.
+
+        Returns:
+            list: Pair data, pairs unknown to thegraph.com are left out
+        """
+        query = gql(
+            """
+                        query FetchPairsbyIDs($pairFilter: Pair_filter, $first: Int)
+                        {
+                        pairs(where: $pairFilter, first: $first)
+                        { 	id
+                            name
+                            token0 {
+                                id
+                                symbol
+                                name
+                                }
+                            token1 {
+                                id
+                                symbol
+                                name
+                                }
+                        }
+                        }
+        """
+        )
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def get_batch(batch_ids: list) -> list:
+            variable_values = {"pairFilter": {"id_in": batch_ids}, "first": len(batch_ids)}
+            async with semaphore:
+                data = await self._send_request_async(query=query, variable_values=variable_values)
+            return data.get("pairs", list())
+
+        batches = await asyncio.gather(*[get_batch(ids[i : i + batch_size]) for i in range(0, len(ids), batch_size)])
+        return [pair for batch in batches for pair in batch]
+
+    def _send_request(self, query: str = None, variable_values: dict = None):
+        """Send request to endpoint over the shared session
+
+        Args:
+            query (str, optional): Query string for request. Defaults to None.
+            variable_values (dict, optional): variables to populate query with. Defaults to None.
+
+        Raises:
+            GraphAPIError: the request failed after every retry, or the circuit breaker is open
+
+        Returns:
+            dict[str, any]: API response
+        """
+        return self.run(self._send_request_async(query=query, variable_values=variable_values))
+
+    async def _send_request_async(self, query: str = None, variable_values: dict = None):
+        """Async version of _send_request, retried according to self.retry_policy
 
         Args:
             query (str, optional): Query string for request. Defaults to None.
             variable_values (dict, optional): variables to populate query with. Defaults to None.
-            max_retries (int, optional): Number of retry attempts. Defaults to 3.
+
+        Raises:
+            GraphAPIError: the request failed after every retry, or the circuit breaker is open
 
         Returns:
             dict[str, any]: API response
         """
 
-        def retry():
-            self.retries += 1
-            if self.retries > max_retries:
-                exit(1)
-            else:
-                logger.info("Retrying Request....")
-                sleep(30)
-                return self._send_request(
-                    query=query,
-                    variable_values=variable_values,
-                    max_retries=max_retries,
-                )
-
-        # Make the request
+        async def execute():
+            session = await self.connect_async()
+            return await session.execute(query, variable_values=variable_values)
+
         try:
-            response = self.client.execute(query, variable_values=variable_values)
-        except exceptions.TransportQueryError as e:
-            logger.error(e)
-            return retry()
-        except asyncio.CancelledError as e:
-            logger.error(e)
-            return retry()
-        except asyncio.exceptions.TimeoutError as e:
+            return await self.retry_policy.call_async(execute)
+        except retry.RetryError as e:
             logger.error(e)
-            return retry()
+            raise GraphAPIError(str(e)) from e
 
-        self.retries = 0
-        return response
+    def _load_schema_cache(self):
+        """Load the introspection result cached at schema_cache_path, if present and fresh enough.
+
+        Returns:
+            dict: introspection result, None if there is no usable cache
+        """
+        if not self.schema_cache_path or not os.path.exists(self.schema_cache_path):
+            return None
+
+        if time.time() - os.path.getmtime(self.schema_cache_path) > self.schema_cache_max_age:
+            return None
+
+        try:
+            with open(self.schema_cache_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Unable to read schema cache {f}: {e}".format(f=self.schema_cache_path, e=e))
+            return None
+
+    def _save_schema_cache(self):
+        if not self.schema_cache_path or self.client.introspection is None:
+            return
+
+        try:
+            with open(self.schema_cache_path, "w") as f:
+                json.dump(self.client.introspection, f)
+        except OSError as e:
+            logger.error("Unable to write schema cache {f}: {e}".format(f=self.schema_cache_path, e=e))
@@ -3,8 +3,8 @@ from datetime import datetime
 
 import pandas as pd
 
-from ..utils import azure_storage, csv_functions, data_classes, log
-from . import thegraph
+from ..utils import azure_storage, csv_functions, data_classes, log, settings
+from . import batch_buffer, thegraph
 
 logger = log.setup_custom_logger(name=__file__)
 
@@ -69,22 +69,42 @@ class DataUploader(object):
             file_item = data_classes.FileItem(file_name=file, full_local_path=os.path.join(self.local_file_path, file))
             self.files_to_upload.addFile(file=file_item)
 
+    def add_files_to_upload(self, full_local_paths: list):
+        """Queue files written by SwapParserToCSV without listing local_file_path."""
+        for full_local_path in full_local_paths:
+            file_item = data_classes.FileItem(
+                file_name=os.path.basename(full_local_path), full_local_path=full_local_path
+            )
+            self.files_to_upload.addFile(file=file_item)
+
     def upload_files(self):
         if len(self.files_to_upload._items) == 0:
             return
 
         logger.info("Uploading Files: {f}".format(f=len(self.files_to_upload._items)))
 
-        master_df = pd.DataFrame()
         file_to_upload = self.files_to_upload._items[-1]
 
-        for file in self.files_to_upload._items:
-            file_df = csv_functions.read_csv_to_dataframe(
-                full_filepath=file.full_local_path, dtype=self.swap_df_dtypes
-            )
-            master_df = pd.concat([master_df, file_df], ignore_index=True)
+        # every file is written by SwapParserToCSV with the same headers and quoting
+        csv_functions.concat_csv_files(
+            full_filepaths=[file.full_local_path for file in self.files_to_upload._items],
+            output_filepath=file_to_upload.full_local_path,
+        )
+        pair_ids = list(
+            set(pd.read_csv(file_to_upload.full_local_path, usecols=["pair_id"], dtype=str)["pair_id"].tolist())
+        )
 
-        csv_functions.write_dataframe_to_csv(file_to_upload.full_local_path, df=master_df)
+        local_files = [file.full_local_path for file in self.files_to_upload._items]
+        if settings.SWAP_FILE_FORMAT == "parquet":
+            parquet_filepath = csv_functions.csv_to_parquet(
+                full_filepath=file_to_upload.full_local_path,
+                dtype=self.swap_df_dtypes,
+                compression=settings.PARQUET_COMPRESSION,
+            )
+            file_to_upload = data_classes.FileItem(
+                file_name=os.path.basename(parquet_filepath), full_local_path=parquet_filepath
+            )
+            local_files.append(parquet_filepath)
 
         azure_storage.upload_localfile(
             local_file_path=file_to_upload.full_local_path,
@@ -93,24 +113,39 @@ class DataUploader(object):
         )
         logger.info("Uploaded: {f}".format(f=file_to_upload.file_name))
 
-        for file in self.files_to_upload._items:
-            csv_functions.remove_file(full_filepath=file.full_local_path)
-
-        pair_ids = list(set(master_df["pair_id"].tolist()))
+        for full_local_path in local_files:
+            csv_functions.remove_file(full_filepath=full_local_path)
+        self.files_to_upload = data_classes.ListofFiles()
 
         self.Pairs.upload_pairs(pair_ids=pair_ids)
 
+    def upload_buffer(self, batch_buffer: batch_buffer.SwapBatchBuffer):
+        """Upload every row of batch_buffer as one swaps_raw file, without going through local files."""
+        batch = batch_buffer.pop()
+        if batch is None:
+            return
+
+        logger.info("Uploading Rows: {r}".format(r=batch.row_count))
+        azure_storage.upload_data(
+            data=batch.to_bytes(compression=settings.PARQUET_COMPRESSION),
+            upload_filename=batch.file_name,
+            container_name=self.azure_storage_container,
+        )
+        logger.info("Uploaded: {f}".format(f=batch.file_name))
+        batch_buffer.commit(batch=batch)
+
+        self.Pairs.upload_pairs(pair_ids=list(set(batch.columns["pair_id"])))
+
 
 class PairMaintainer(object):
-    """Maintain dictionary of pair data from database. Insert Pair data from thegraph.com.
+    """Maintain pairs.csv in azure blob storage. Add Pair data from thegraph.com.
 
-    map_pair_ids_to_idxs is a dictionary that stores pair data from the database table tj.dim_pairs.
+    pair_ids_uploaded is a dictionary of the pair ids already in pairs.csv.
 
     Example Usage:
-        Pairs = PairMaintainer()
+        Pairs = PairMaintainer(local_file_path=local_file_path, azure_storage_container="swapdata")
 
-        if pair_id not in Pairs.map_pair_ids_to_idxs:
-            Pairs.add_pair(pair_id=swap["pair_id"])
+        Pairs.upload_pairs(pair_ids=[swap["pair_id"] for swap in swaps])
 
     """
 
@@ -136,19 +171,27 @@ class PairMaintainer(object):
         self._set_pair_ids_uploaded()
         csv_functions.remove_file(full_filepath=self.pair_file.full_local_path)
 
-    def upload_pairs(self, pair_ids: list):
+    def upload_pairs(self, pair_ids: list) -> bool:
+        """Add the pairs of pair_ids missing from pairs.csv and upload it.
 
+        Returns:
+            bool: False if thegraph.com could not be queried and the pairs were not added
+        """
         pairs_to_add = [x for x in pair_ids if x not in self.pair_ids_uploaded]
 
         if len(pairs_to_add) == 0:
-            return
+            return True
         logger.info(
             "Pairs to Add: {p} | Existing Pairs: {e}".format(p=len(pairs_to_add), e=len(self.pair_ids_uploaded))
         )
         self._download_master_pair_file()
 
-        for pair_id in pairs_to_add:
-            self.add_pair(pair_id=pair_id)
+        try:
+            self.add_pairs(pair_ids=pairs_to_add)
+        except thegraph.GraphAPIError:
+            # pairs stay out of pair_ids_uploaded, so the next upload retries them
+            csv_functions.remove_file(full_filepath=self.pair_file.full_local_path)
+            return False
 
         azure_storage.delete_blob(file_name=self.pair_file.file_name, container_name=self.azure_storage_container)
         azure_storage.upload_localfile(
@@ -160,6 +203,7 @@ class PairMaintainer(object):
 
         csv_functions.remove_file(full_filepath=self.pair_file.full_local_path)
         logger.info("Removed: {f}".format(f=self.pair_file.full_local_path))
+        return True
 
     def _download_master_pair_file(self):
 
@@ -183,33 +227,38 @@ class PairMaintainer(object):
         except pd.errors.EmptyDataError:
             self.pair_ids_uploaded = dict()
 
-    def add_pair(self, pair_id: str):
-        """Given a pair_id, query thegraph.com and insert the pair into tj.dim_pairs and chain.dim_tokens.
-
-        For pair data returned by API, ensure underlying tokens exist in chain.dim_tokens, if tokens
-        do not exist, insert into chain.dim_tokens
+    def add_pairs(self, pair_ids: list):
+        """Given a list of pair_ids, query thegraph.com in batches and append the pairs to pairs.csv in one write.
 
         Args:
-            pair_id (bytes): id for pair returned by thegraph.com
+            pair_ids (list): ids for pairs returned by thegraph.com
         """
-
         request_start = datetime.utcnow()
 
-        # Get pair information from API
-        with thegraph.GraphAPI() as g:
-            data = g.get_pair(id=pair_id)
+        with thegraph.get_graph_api() as g:
+            data = g.get_pairs(ids=pair_ids, batch_size=settings.GRAPH_PAIR_BATCH_SIZE)
 
         duration = datetime.utcnow() - request_start
-        row_data = [
-            data["id"],
-            data["name"],
-            data["token0"]["id"],
-            data["token0"]["symbol"],
-            data["token0"]["name"],
-            data["token1"]["id"],
-            data["token1"]["symbol"],
-            data["token1"]["name"],
+
+        rows = [self._pair_to_row(pair_data=pair_data) for pair_data in data]
+        csv_functions.append_list_of_lists_to_csv(full_filepath=self.pair_file.full_local_path, data=rows)
+        for pair_data in data:
+            self.pair_ids_uploaded[pair_data["id"]] = True
+
+        missing = len(pair_ids) - len(data)
+        if missing > 0:
+            logger.error("Pairs not found = {m}".format(m=missing))
+        logger.info("Pairs Added = {p} | Request Duration = {d}".format(p=len(rows), d=duration))
+
+    @staticmethod
+    def _pair_to_row(pair_data: dict) -> list:
+        return [
+            pair_data["id"],
+            pair_data["name"],
+            pair_data["token0"]["id"],
+            pair_data["token0"]["symbol"],
+            pair_data["token0"]["name"],
+            pair_data["token1"]["id"],
+            pair_data["token1"]["symbol"],
+            pair_data["token1"]["name"],
         ]
-        csv_functions.append_list_to_csv(full_filepath=self.pair_file.full_local_path, data=row_data)
-        self.pair_ids_uploaded[data["id"]] = True
-        logger.info("Token Added = {name} | Request Duration = {d}".format(name=data["name"], d=duration))
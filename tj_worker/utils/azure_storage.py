@@ -1,15 +1,94 @@
+import io
 import os
-
-from azure.core import exceptions
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from azure.core import MatchConditions, exceptions
+from azure.core.pipeline.transport import RequestsTransport
 from azure.storage.blob import BlobServiceClient, ContainerClient
-from tj_worker.utils import log, settings
+from more_itertools import chunked
+from tj_worker.utils import blob_manifest, data_classes, log, retry, settings
 import re
 
 logger = log.setup_custom_logger(name=__file__)
 
+# Block blobs are named <prefix><block number zero-padded to BLOCK_NUMBER_DIGITS><extension>
+BLOCK_NUMBER_DIGITS = 10
+
+
+class BlobRetryPolicy(retry.RetryPolicy):
+    """RetryPolicy that retries an HttpResponseError only for a transient status: 408, 429 or 5xx.
+
+    Errors such as ResourceNotFoundError or ClientAuthenticationError are raised on the first attempt.
+    """
+
+    def is_retryable(self, exception: Exception) -> bool:
+        if isinstance(exception, exceptions.HttpResponseError):
+            status_code = exception.status_code
+            if status_code is None or not (status_code in (408, 429) or 500 <= status_code < 600):
+                return False
+        return super().is_retryable(exception)
+
+
+download_retry_policy = BlobRetryPolicy(
+    max_retries=settings.BLOB_MAX_RETRIES,
+    retry_on={
+        exceptions.ServiceRequestError: None,
+        exceptions.ServiceResponseError: None,
+        exceptions.HttpResponseError: None,
+    },
+)
+
+
+_blob_service_clients = dict()
+_blob_service_clients_lock = threading.Lock()
+
+_blob_manifest = None
+_blob_manifest_lock = threading.Lock()
+
+
+def get_blob_service_client(conn_str: str = None) -> BlobServiceClient:
+    """Return the BlobServiceClient shared by every caller in the process, creating it on first use.
+
+    One client is kept per connection string. Its HTTP connection pool holds up to BLOB_POOL_SIZE
+    connections that are reused across calls and threads.
+
+    Args:
+        conn_str (str, optional): Connection string. Defaults to settings.AZURE_STORAGE_CONN_STR.
 
-def get_blob_service_client() -> BlobServiceClient:
-    return BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONN_STR)
+    Returns:
+        BlobServiceClient: shared instance
+    """
+    if conn_str is None:
+        conn_str = settings.AZURE_STORAGE_CONN_STR
+
+    with _blob_service_clients_lock:
+        if conn_str not in _blob_service_clients:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=settings.BLOB_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            transport = RequestsTransport(
+                session=session,
+                connection_timeout=settings.BLOB_CONNECTION_TIMEOUT,
+                read_timeout=settings.BLOB_READ_TIMEOUT,
+            )
+            _blob_service_clients[conn_str] = BlobServiceClient.from_connection_string(conn_str, transport=transport)
+        return _blob_service_clients[conn_str]
+
+
+def get_blob_manifest() -> blob_manifest.BlobManifest:
+    """Return the BlobManifest shared by every caller in the process, loading it on first use."""
+    global _blob_manifest
+
+    with _blob_manifest_lock:
+        if _blob_manifest is None:
+            _blob_manifest = blob_manifest.BlobManifest()
+        return _blob_manifest
 
 
 def get_container_client(blob_service_client: BlobServiceClient, container_name: str) -> ContainerClient:
@@ -40,6 +119,16 @@ def upload_localfile(local_file_path: str, upload_filename: str, container_name:
         )
 
 
+def upload_data(data: bytes, upload_filename: str, container_name: str):
+    """Upload in-memory data as a blob, replacing any existing blob with the same name."""
+    blob_service_client = get_blob_service_client()
+
+    blob_client_instance = blob_service_client.get_blob_client(
+        container=container_name, blob=upload_filename, snapshot=None
+    )
+    blob_client_instance.upload_blob(data, overwrite=True)
+
+
 def append_localfile_to_azure(local_file_path: str, upload_filename: str, container_name: str):
     # get gts-internal azure account
     blob_service_client = get_blob_service_client()
@@ -65,10 +154,7 @@ def append_localfile_to_azure(local_file_path: str, upload_filename: str, contai
 
 def append_blob_sample(local_file_path: str, upload_filename: str, container_name: str):
 
-    # Instantiate a new BlobServiceClient using a connection string
-    from azure.storage.blob import BlobServiceClient
-
-    blob_service_client = BlobServiceClient.from_connection_string(settings.AZURE_STORAGE_CONN_STR)
+    blob_service_client = get_blob_service_client()
 
     # Instantiate a new ContainerClient
     container_client = blob_service_client.get_container_client(container_name)
@@ -95,7 +181,9 @@ def download_blobs(
     blobname_ends_with=".csv",
     blobname_contains="",
     destination_folder="",
-):
+    max_concurrency: int = settings.BLOB_DOWNLOAD_CONCURRENCY,
+    to_memory: bool = False,
+) -> list:
     blob_service_client = get_blob_service_client()
     container_client = get_container_client(blob_service_client=blob_service_client, container_name=container_name)
 
@@ -108,15 +196,14 @@ def download_blobs(
 
             blobs_to_download.append(blob.name)
 
-    for i, blob in enumerate(blobs_to_download):
-        if i % 10 == 0:
-            logger.info("{i} of {l} | Downloading file {f}".format(i=i + 1, l=len(blobs_to_download), f=blob))
-
-        blob_client_instance = blob_service_client.get_blob_client(container_name, blob, snapshot=None)
-        local_filepath = os.path.join(destination_folder, blob)
-        with open(local_filepath, "wb") as my_blob:
-            blob_data = blob_client_instance.download_blob()
-            blob_data.readinto(my_blob)
+    return download_blob_list(
+        blob_service_client=blob_service_client,
+        container_name=container_name,
+        blob_names=blobs_to_download,
+        destination_folder=destination_folder,
+        max_concurrency=max_concurrency,
+        to_memory=to_memory,
+    )
 
 
 def download_block_blobs(
@@ -127,37 +214,299 @@ def download_block_blobs(
     destination_folder="",
     limit: int = 10000000,
     block_number_greater_than: int = 0,
-):
+    max_concurrency: int = settings.BLOB_DOWNLOAD_CONCURRENCY,
+    to_memory: bool = False,
+    seek_block_prefixes: bool = False,
+) -> list:
+    """Download the first limit block blobs after block_number_greater_than, in block order.
+
+    blobname_starts_with must be the whole name before the zero-padded block number. See
+    list_block_blob_names for seek_block_prefixes.
+
+    Returns:
+        list: FileItem of each blob, see download_blob_list
+    """
     blob_service_client = get_blob_service_client()
-    container_client = get_container_client(blob_service_client=blob_service_client, container_name=container_name)
 
-    blob_list = container_client.list_blobs(name_starts_with=blobname_starts_with)
+    blobs_to_download = list_block_blob_names(
+        container_name=container_name,
+        blobname_starts_with=blobname_starts_with,
+        blobname_ends_with=blobname_ends_with,
+        blobname_contains=blobname_contains,
+        block_number_greater_than=block_number_greater_than,
+        limit=limit,
+        seek_block_prefixes=seek_block_prefixes,
+    )
 
-    blobs_to_download = list()
-    for blob in blob_list:
+    return download_blob_list(
+        blob_service_client=blob_service_client,
+        container_name=container_name,
+        blob_names=blobs_to_download,
+        destination_folder=destination_folder,
+        max_concurrency=max_concurrency,
+        to_memory=to_memory,
+    )
 
-        if not blob.name.endswith(blobname_ends_with) or blobname_contains not in blob.name:
-            continue
 
+def download_blob_list(
+    blob_service_client: BlobServiceClient,
+    container_name: str,
+    blob_names: list,
+    destination_folder: str,
+    max_concurrency: int = settings.BLOB_DOWNLOAD_CONCURRENCY,
+    retry_policy: retry.RetryPolicy = download_retry_policy,
+    to_memory: bool = False,
+    spill_size: int = settings.BLOB_SPILL_SIZE,
+) -> list:
+    """Download blob_names into destination_folder with up to max_concurrency downloads at once.
+
+    Each blob is retried on its own according to retry_policy. Every download is finished before
+    the first failure is raised, and files of failed downloads are removed so that no partial
+    file is left in destination_folder.
+
+    With to_memory, blobs are kept in memory as FileItem.data instead, unless they are larger
+    than spill_size bytes.
+
+    Returns:
+        list: FileItem of each blob, in the order of blob_names
+
+    Raises:
+        retry.RetryError: a blob still failed after every retry
+    """
+    if len(blob_names) == 0:
+        return list()
+
+    start = time.monotonic()
+
+    def download(i: int, blob: str) -> data_classes.FileItem:
+        if i % 10 == 0:
+            logger.info("{i} of {l} | Downloading file {f}".format(i=i + 1, l=len(blob_names), f=blob))
+
+        local_filepath = os.path.join(destination_folder, blob)
         try:
-            block_number = int(re.search(r"\d+", blob.name).group())
-        except AttributeError:
-            continue
+            return retry_policy.call(
+                _download_blob,
+                blob_service_client=blob_service_client,
+                container_name=container_name,
+                blob=blob,
+                local_filepath=local_filepath,
+                spill_size=spill_size if to_memory else -1,
+            )
+        except Exception:
+            if os.path.exists(local_filepath):
+                os.remove(local_filepath)
+            raise
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = [executor.submit(download, i, blob) for i, blob in enumerate(blob_names)]
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    for error in errors:
+        logger.error("Download failed: {e}".format(e=error))
+
+    files = [future.result() for future in futures if future.exception() is None]
+
+    seconds = max(time.monotonic() - start, 1e-6)
+    size = sum(file.size for file in files)
+    logger.info(
+        "Downloaded {d} of {l} files | {mb:.1f} MB | {fs:.1f} files/s | {mbs:.1f} MB/s".format(
+            d=len(files),
+            l=len(blob_names),
+            mb=size / 1e6,
+            fs=len(files) / seconds,
+            mbs=size / 1e6 / seconds,
+        )
+    )
 
-        if block_number > block_number_greater_than:
-            blobs_to_download.append(blob.name)
+    if len(errors) > 0:
+        raise errors[0]
+    return files
 
-        if len(blobs_to_download) >= limit:
-            break
 
-    for i, blob in enumerate(blobs_to_download):
-        if i % 10 == 0:
-            logger.info("{i} of {l} | Downloading file {f}".format(i=i + 1, l=len(blobs_to_download), f=blob))
-        blob_client_instance = blob_service_client.get_blob_client(container_name, blob, snapshot=None)
-        local_filepath = os.path.join(destination_folder, blob)
+def _download_blob(
+    blob_service_client: BlobServiceClient, container_name: str, blob: str, local_filepath: str, spill_size: int = -1
+) -> data_classes.FileItem:
+    """Download a blob to memory, or to local_filepath if it is larger than spill_size bytes."""
+    blob_client_instance = blob_service_client.get_blob_client(container_name, blob, snapshot=None)
+    blob_data = blob_client_instance.download_blob()
+
+    if blob_data.size > spill_size:
         with open(local_filepath, "wb") as my_blob:
-            blob_data = blob_client_instance.download_blob()
-            blob_data.readinto(my_blob)
+            size = blob_data.readinto(my_blob)
+        return data_classes.FileItem(file_name=blob, full_local_path=local_filepath, size=size)
+
+    data = io.BytesIO()
+    size = blob_data.readinto(data)
+    data.seek(0)
+    return data_classes.FileItem(file_name=blob, full_local_path=local_filepath, data=data, size=size)
+
+
+def download_blob_to_memory(blob_name: str, container_name: str) -> io.BytesIO:
+    """Download a single blob into memory.
+
+    Returns:
+        io.BytesIO: Content of the blob, None if the blob does not exist
+    """
+    blob_service_client = get_blob_service_client()
+    blob_client_instance = blob_service_client.get_blob_client(container_name, blob_name, snapshot=None)
+
+    def download() -> io.BytesIO:
+        data = io.BytesIO()
+        try:
+            blob_client_instance.download_blob().readinto(data)
+        except exceptions.ResourceNotFoundError:
+            return None
+        data.seek(0)
+        return data
+
+    return download_retry_policy.call(download)
+
+
+def download_blob_if_changed(blob_name: str, container_name: str, etag: str = None) -> tuple:
+    """Download a single blob into memory unless its ETag is still etag.
+
+    Returns:
+        tuple[io.BytesIO, str]: Content and ETag of the blob. Content is None if the blob did not change
+                                since etag, and both are None if the blob does not exist.
+    """
+    blob_service_client = get_blob_service_client()
+    blob_client_instance = blob_service_client.get_blob_client(container_name, blob_name, snapshot=None)
+
+    def download() -> tuple:
+        data = io.BytesIO()
+        try:
+            if etag is None:
+                downloader = blob_client_instance.download_blob()
+            else:
+                downloader = blob_client_instance.download_blob(etag=etag, match_condition=MatchConditions.IfModified)
+            downloader.readinto(data)
+        except exceptions.ResourceNotModifiedError:
+            return None, etag
+        except exceptions.ResourceNotFoundError:
+            return None, None
+        data.seek(0)
+        return data, downloader.properties.etag
+
+    return download_retry_policy.call(download)
+
+
+def _block_number_prefixes(block_number_greater_than: int) -> list:
+    """Zero-padded block number prefixes that together match every block number above
+    block_number_greater_than and nothing else, in ascending block order."""
+    padded = str(max(block_number_greater_than, 0)).zfill(BLOCK_NUMBER_DIGITS)
+
+    prefixes = list()
+    for i in reversed(range(len(padded))):
+        prefixes.extend(padded[:i] + str(digit) for digit in range(int(padded[i]) + 1, 10))
+    return prefixes
+
+
+def _block_number(blob_name: str, blobname_starts_with: str) -> int:
+    """Block number in blob_name after blobname_starts_with, 0 if there is none."""
+    match = re.search(r"\d+", blob_name[len(blobname_starts_with) :])
+    return int(match.group()) if match else 0
+
+
+def list_block_blob_names(
+    container_name: str,
+    blobname_starts_with="",
+    blobname_ends_with=".csv",
+    blobname_contains="",
+    block_number_greater_than: int = 0,
+    limit: int = None,
+    max_concurrency: int = settings.BLOB_DOWNLOAD_CONCURRENCY,
+    seek_block_prefixes: bool = False,
+) -> list:
+    """List block blobs after block_number_greater_than, in block order.
+
+    By default this is one listing of blobname_starts_with, which suits swaps_raw_, where the ETL deletes
+    every blob it has processed. With seek_block_prefixes, every name prefix that can only hold newer blocks
+    is listed instead: after block 90000, swaps_raw_0000090001 to swaps_raw_0000090009, then
+    swaps_raw_000009001 to swaps_raw_000009009, and so on. That is about 50 mostly empty listings, run
+    concurrently, so it only pays off for a listing as large as processed/.
+
+    Args:
+        blobname_starts_with (str): Whole name before the zero-padded block number, e.g. "swaps_raw_"
+        limit (int, optional): Maximum number of names returned. Defaults to None, no limit.
+        seek_block_prefixes (bool, optional): List the prefixes of newer blocks. Defaults to False.
+
+    Returns:
+        list: Blob names
+    """
+    blob_service_client = get_blob_service_client()
+    container_client = get_container_client(blob_service_client=blob_service_client, container_name=container_name)
+
+    if not seek_block_prefixes:
+        blob_names = list()
+        for blob in container_client.list_blobs(name_starts_with=blobname_starts_with):
+            if (
+                blob.name.endswith(blobname_ends_with)
+                and blobname_contains in blob.name
+                and _block_number(blob.name, blobname_starts_with) > block_number_greater_than
+            ):
+                blob_names.append(blob.name)
+                if limit is not None and len(blob_names) >= limit:
+                    break
+        return blob_names
+
+    def list_prefix(prefix: str) -> list:
+        return [
+            blob.name
+            for blob in container_client.list_blobs(name_starts_with=prefix)
+            if blob.name.endswith(blobname_ends_with) and blobname_contains in blob.name
+        ]
+
+    prefixes = [blobname_starts_with + prefix for prefix in _block_number_prefixes(block_number_greater_than)]
+
+    blob_names = list()
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    try:
+        for names in executor.map(list_prefix, prefixes):
+            blob_names.extend(names)
+            if limit is not None and len(blob_names) >= limit:
+                break
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return blob_names if limit is None else blob_names[:limit]
+
+
+def get_last_block_number(
+    container_name: str,
+    blobname_starts_with="",
+    blobname_ends_with=".csv",
+    manifest: blob_manifest.BlobManifest = None,
+    seek_block_prefixes: bool = False,
+) -> int:
+    """Return the block number of the last block blob under blobname_starts_with, 0 if there is none.
+
+    The last block number found is kept in a BlobManifest, so only blobs added since the previous
+    call are listed.
+
+    Args:
+        blobname_starts_with (str): Whole name before the zero-padded block number, e.g. "swaps_raw_"
+        manifest (BlobManifest, optional): Defaults to the manifest shared by the process.
+        seek_block_prefixes (bool, optional): See list_block_blob_names. Defaults to False.
+    """
+    if manifest is None:
+        manifest = get_blob_manifest()
+
+    block_number = manifest.get(container_name=container_name, blobname_starts_with=blobname_starts_with)
+
+    blob_names = list_block_blob_names(
+        container_name=container_name,
+        blobname_starts_with=blobname_starts_with,
+        blobname_ends_with=blobname_ends_with,
+        block_number_greater_than=block_number,
+        seek_block_prefixes=seek_block_prefixes,
+    )
+    for blob_name in blob_names:
+        block_number = max(block_number, _block_number(blob_name, blobname_starts_with))
+
+    manifest.update(
+        container_name=container_name, blobname_starts_with=blobname_starts_with, block_number=block_number
+    )
+    return block_number
 
 
 def get_blob_names(
@@ -168,14 +517,13 @@ def get_blob_names(
 
     blob_list = container_client.list_blobs(name_starts_with=blobname_starts_with)
 
-    blob_results = list()
+    # only the last limit names are kept while listing
+    blob_results = deque(maxlen=limit or None)
     for blob in blob_list:
         if blob.name.endswith(blobname_ends_with) and blobname_contains in blob.name:
             blob_results.append(blob.name)
 
-    if limit:
-        blob_results = blob_results[-limit:]
-    return blob_results
+    return list(blob_results)
 
 
 def delete_all_blobs(container_name: str):
@@ -184,8 +532,63 @@ def delete_all_blobs(container_name: str):
 
     blob_list = container_client.list_blobs()
 
-    for blob in blob_list:
-        delete_blob(file_name=blob.name, container_name=container_name)
+    failed = delete_blobs(file_names=[blob.name for blob in blob_list], container_name=container_name)
+    get_blob_manifest().clear(container_name=container_name)
+    if len(failed) > 0:
+        logger.error("Unable to delete {f} blobs from {c}".format(f=len(failed), c=container_name))
+
+
+def delete_blobs(
+    file_names: list,
+    container_name: str,
+    batch_size: int = settings.BLOB_DELETE_BATCH_SIZE,
+    max_concurrency: int = settings.BLOB_DOWNLOAD_CONCURRENCY,
+) -> dict:
+    """Delete file_names with the Blob Batch API, batch_size blobs per request.
+
+    Blobs that do not exist count as deleted. If a batch request is refused as a whole, e.g. by
+    an emulator without batch support, its blobs are deleted one by one on max_concurrency threads.
+
+    Returns:
+        dict: Name of each blob that could not be deleted, mapped to its error
+    """
+    blob_service_client = get_blob_service_client()
+    container_client = get_container_client(blob_service_client=blob_service_client, container_name=container_name)
+
+    failed = dict()
+    for batch in chunked(file_names, batch_size):
+        try:
+            responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+        except exceptions.HttpResponseError as e:
+            logger.info("Batch delete refused, deleting {b} blobs one by one: {e}".format(b=len(batch), e=e.reason))
+            failed.update(
+                _delete_blobs_concurrently(
+                    file_names=batch, container_name=container_name, max_concurrency=max_concurrency
+                )
+            )
+            continue
+
+        for file_name, response in zip(batch, responses):
+            if response.status_code not in (202, 404):
+                failed[file_name] = "{s} {r}".format(s=response.status_code, r=response.reason)
+
+    for file_name, error in failed.items():
+        logger.error("Unable to delete {f}: {e}".format(f=file_name, e=error))
+    return failed
+
+
+def _delete_blobs_concurrently(file_names: list, container_name: str, max_concurrency: int) -> dict:
+    def delete(file_name: str):
+        try:
+            delete_blob(file_name=file_name, container_name=container_name)
+        except exceptions.AzureError as e:
+            return file_name, str(e)
+        return file_name, None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        results = list(executor.map(delete, file_names))
+
+    return {file_name: error for file_name, error in results if error is not None}
 
 
 def delete_blob(file_name: str, container_name: str):
@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+
+from tj_worker.utils import log, settings
+
+logger = log.setup_custom_logger(name=__file__)
+
+
+class BlobManifest(object):
+    """Last block number known for each block blob prefix, kept in a local JSON file.
+
+    Block blobs are only ever added with increasing block numbers, so the last block number seen
+    under a prefix stays valid and later listings only have to look at newer blobs. An unreadable
+    file is treated as an empty manifest. Safe to share between threads.
+
+    Deleting blobs to replay a range breaks that assumption: delete the manifest file too, otherwise the
+    swap_getter resumes after the last block number kept here and skips the replayed blocks. Only
+    azure_storage.delete_all_blobs clears the entries of its container, and only in the running process.
+
+    Example Usage:
+        Manifest = BlobManifest()
+        block_number = Manifest.get(container_name="swapdata", blobname_starts_with="swaps_raw_")
+        Manifest.update(container_name="swapdata", blobname_starts_with="swaps_raw_", block_number=block_number)
+
+    """
+
+    def __init__(self, manifest_path: str = settings.BLOB_MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self.entries = self._load()
+
+    @staticmethod
+    def _key(container_name: str, blobname_starts_with: str) -> str:
+        return container_name + "/" + blobname_starts_with
+
+    def get(self, container_name: str, blobname_starts_with: str) -> int:
+        with self._lock:
+            return self.entries.get(self._key(container_name, blobname_starts_with), 0)
+
+    def update(self, container_name: str, blobname_starts_with: str, block_number: int):
+        key = self._key(container_name, blobname_starts_with)
+        with self._lock:
+            if block_number <= self.entries.get(key, 0):
+                return
+            self.entries[key] = block_number
+            self._save()
+
+    def clear(self, container_name: str):
+        """Forget every prefix of container_name, e.g. after its blobs were deleted."""
+        with self._lock:
+            self.entries = {k: v for k, v in self.entries.items() if not k.startswith(container_name + "/")}
+            self._save()
+
+    def _load(self) -> dict:
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return dict()
+
+        try:
+            with open(self.manifest_path, "r") as f:
+                return {key: int(block_number) for key, block_number in json.load(f).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error("Unable to read blob manifest {f}: {e}".format(f=self.manifest_path, e=e))
+            return dict()
+
+    def _save(self):
+        if not self.manifest_path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+            temp_path = self.manifest_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.manifest_path)
+        except OSError as e:
+            logger.error("Unable to write blob manifest {f}: {e}".format(f=self.manifest_path, e=e))
@@ -1,5 +1,7 @@
 import csv
+import io
 import os
+import shutil
 
 import pandas as pd
 from tj_worker.utils import log
@@ -42,6 +44,35 @@ def remove_file(full_filepath):
         logger.info("File does not exist: {f}".format(f=full_filepath))
 
 
+def concat_csv_files(full_filepaths: list, output_filepath: str):
+    """Concatenate CSV files with identical headers into output_filepath, keeping the first header only.
+
+    Rows are copied as raw bytes, so each file is read once and nothing is held in memory.
+    output_filepath may be one of full_filepaths.
+    """
+    temp_filepath = output_filepath + ".tmp"
+
+    with open(temp_filepath, "wb") as output_file:
+        for i, full_filepath in enumerate(full_filepaths):
+            with open(full_filepath, "rb") as f:
+                if i > 0:
+                    f.readline()
+                shutil.copyfileobj(f, output_file)
+
+    os.replace(temp_filepath, output_filepath)
+
+
+def read_file_to_dataframe(full_filepath, dtype: dict = None, data: io.BytesIO = None):
+    """Read a CSV or Parquet file, picked by its extension. data is read instead of full_filepath if set."""
+    if data is not None:
+        data.seek(0)
+
+    if full_filepath.endswith(".parquet"):
+        df = pd.read_parquet(full_filepath if data is None else data)
+        return df if dtype is None else df.astype(dtype)
+    return read_csv_to_dataframe(full_filepath if data is None else data, dtype=dtype)
+
+
 def read_csv_to_dataframe(full_filepath, dtype: dict = None):
     if dtype is None:
         return pd.read_csv(full_filepath)
@@ -56,6 +87,22 @@ def write_dataframe_to_csv(full_filepath: str, df: pd.DataFrame, index: bool = F
         df.to_csv(full_filepath, quoting=csv.QUOTE_NONNUMERIC, index=index)
 
 
+def write_dataframe_to_parquet(full_filepath: str, df: pd.DataFrame, compression: str = "zstd"):
+    df.to_parquet(full_filepath, index=False, compression=compression)
+
+
+def csv_to_parquet(full_filepath: str, dtype: dict = None, compression: str = "zstd") -> str:
+    """Write a Parquet copy of a CSV file next to it.
+
+    Returns:
+        str: Full path of the Parquet file
+    """
+    parquet_filepath = os.path.splitext(full_filepath)[0] + ".parquet"
+    df = read_csv_to_dataframe(full_filepath, dtype=dtype)
+    write_dataframe_to_parquet(parquet_filepath, df=df, compression=compression)
+    return parquet_filepath
+
+
 def write_empty_file(full_filepath, headers: list = None):
     """Write CSV file"""
     if headers is None:
@@ -1,3 +1,4 @@
+import io
 from dataclasses import dataclass, field
 
 
@@ -8,11 +9,15 @@ class FileItem:
     Args:
         file_name (int): File name
         full_local_path (int): Full local path
+        data (io.BytesIO): Content of the file when it is kept in memory instead of at full_local_path
+        size (int): Size in bytes, if known
     """
 
     file_name: str
     full_local_path: str
     headers: list = field(default_factory=list)
+    data: io.BytesIO = None
+    size: int = 0
 
 
 @dataclass
@@ -1,14 +1,23 @@
-from sqlalchemy import create_engine
-from sqlalchemy.engine import URL
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
-from tj_worker.utils import settings
+from tj_worker.utils import log, settings
+
+logger = log.setup_custom_logger(name=__file__)
 
 Base = declarative_base()
 
+_engine = None
+_session_registry = None
+_engine_lock = threading.Lock()
+_pool_events = {"connect": 0, "checkout": 0, "invalidate": 0}
 
-def get_db_session() -> scoped_session:
-    connection_url = URL.create(
+
+def get_connection_url() -> URL:
+    return URL.create(
         "mssql+pyodbc",
         username=settings.DB_USERNAME,
         password=settings.DB_PASSWORD,
@@ -20,22 +29,76 @@ def get_db_session() -> scoped_session:
         },
     )
 
-    engine = create_engine(connection_url)
 
-    return scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+def get_engine() -> Engine:
+    """Return the engine shared by the process, created on first use.
 
+    Connections are pooled and reused across db_functions calls, so only pool misses pay for an ODBC
+    login. pyodbc's fast_executemany sends every row of an executemany call as one parameter array
+    instead of one round-trip per row.
+    """
+    global _engine
 
-def get_non_scoped_db_session() -> create_engine:
-    connection_url = URL.create(
-        "mssql+pyodbc",
-        username=settings.DB_USERNAME,
-        password=settings.DB_PASSWORD,
-        host=settings.DB_SERVER,
-        port=1433,
-        database=settings.DB_NAME,
-        query={
-            "driver": "ODBC Driver 17 for SQL Server",
-        },
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(
+                get_connection_url(),
+                fast_executemany=True,
+                pool_size=settings.DB_POOL_SIZE,
+                max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+                pool_timeout=settings.DB_POOL_TIMEOUT,
+                pool_recycle=settings.DB_POOL_RECYCLE,
+                pool_pre_ping=settings.DB_POOL_PRE_PING,
+            )
+            _count_pool_events(engine=_engine)
+        return _engine
+
+
+def _count_pool_events(engine: Engine):
+    def counter(name: str):
+        def listener(*args):
+            _pool_events[name] += 1
+
+        return listener
+
+    for name in _pool_events:
+        event.listen(engine, name, counter(name))
+
+
+def get_pool_stats() -> dict:
+    """Pool usage of the shared engine.
+
+    "connect" counts new DBAPI connections and "checkout" counts connections handed out, so a connect count
+    that keeps growing with the checkout count means connections are being churned rather than reused.
+    """
+    stats = dict(_pool_events)
+    if _engine is not None:
+        stats["status"] = _engine.pool.status()
+    return stats
+
+
+def log_pool_stats():
+    stats = get_pool_stats()
+    logger.info(
+        "DB pool | connects = {c} | checkouts = {o} | invalidated = {i} | {s}".format(
+            c=stats["connect"], o=stats["checkout"], i=stats["invalidate"], s=stats.get("status", "no engine")
+        )
     )
 
-    return create_engine(connection_url)
+
+def get_db_session() -> scoped_session:
+    """Return the thread-local session registry bound to the shared engine.
+
+    Calling remove() on it closes the current thread's session and returns its connection to the pool.
+    """
+    global _session_registry
+
+    engine = get_engine()
+    with _engine_lock:
+        if _session_registry is None:
+            _session_registry = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+        return _session_registry
+
+
+def get_non_scoped_db_session() -> Engine:
+    return get_engine()
@@ -1,9 +1,10 @@
-import codecs
+from datetime import datetime
 
 import pandas as pd
-from sqlalchemy import exc, func
-from tj_worker.model import blocks, pairs, swaps, tokens, transactions
-from tj_worker.utils import db
+from sqlalchemy import Column, MetaData, Table, exc, exists, func, select
+from sqlalchemy.engine import Connection, Engine
+from tj_worker.model import blocks, pairs, swaps, tokens, transactions, watermarks
+from tj_worker.utils import db, settings
 
 from ..utils import log
 
@@ -21,35 +22,32 @@ def get_last_inserted_block_number():
     return max_block_number
 
 
-def get_pair_ids_to_dict():
-
-    pairs_dict = dict()
-
+def get_pair_ids_to_dict(pair_idx_greater_than: int = 0) -> dict:
+    """Pair id (20 byte key) -> pair_idx of the rows of tj.dim_pairs after pair_idx_greater_than."""
     db_session = db.get_db_session()
 
-    data = db_session.query(pairs.dimPairs.id, pairs.dimPairs.pair_idx).all()
-
-    for row in data:
-
-        pairs_dict["0x" + codecs.encode(row.id, "hex_codec").decode("ascii")] = row.pair_idx
+    data = (
+        db_session.query(pairs.dimPairs.id, pairs.dimPairs.pair_idx)
+        .where(pairs.dimPairs.pair_idx > pair_idx_greater_than)
+        .all()
+    )
 
     db_session.remove()
-    return pairs_dict
-
+    return {row.id: row.pair_idx for row in data}
 
-def get_token_ids_to_dict():
-
-    tokens_dict = dict()
 
+def get_token_ids_to_dict(token_idx_greater_than: int = 0) -> dict:
+    """Token id (20 byte key) -> token_idx of the rows of chain.dim_tokens after token_idx_greater_than."""
     db_session = db.get_db_session()
 
-    data = db_session.query(tokens.dimTokens.id, tokens.dimTokens.token_idx).all()
-
-    for row in data:
-        tokens_dict["0x" + codecs.encode(row.id, "hex_codec").decode("ascii")] = row.token_idx
+    data = (
+        db_session.query(tokens.dimTokens.id, tokens.dimTokens.token_idx)
+        .where(tokens.dimTokens.token_idx > token_idx_greater_than)
+        .all()
+    )
 
     db_session.remove()
-    return tokens_dict
+    return {row.id: row.token_idx for row in data}
 
 
 def insert_dim_tokens(token_object: tokens.dimTokens) -> int:
@@ -84,6 +82,201 @@ def insert_dim_pairs(pair_object: pairs.dimPairs) -> int:
     return pair_idx
 
 
+def upsert_dim_tokens(tokens_df: pd.DataFrame, engine: Engine = None) -> dict:
+    """Insert the tokens of tokens_df that are not in chain.dim_tokens yet, see upsert_dimension.
+
+    Args:
+        tokens_df (pd.DataFrame): id (20 byte key), symbol and name columns
+
+    Returns:
+        dict: token id -> token_idx for every token of tokens_df
+    """
+    return upsert_dimension(
+        rows_df=tokens_df[["id", "symbol", "name"]],
+        table=tokens.dimTokens.__table__,
+        idx_column="token_idx",
+        engine=engine,
+    )
+
+
+def upsert_dim_pairs(pairs_df: pd.DataFrame, engine: Engine = None) -> dict:
+    """Insert the pairs of pairs_df that are not in tj.dim_pairs yet, see upsert_dimension.
+
+    Args:
+        pairs_df (pd.DataFrame): id (20 byte key), name, token0_idx and token1_idx columns
+
+    Returns:
+        dict: pair id -> pair_idx for every pair of pairs_df
+    """
+    return upsert_dimension(
+        rows_df=pairs_df[["id", "name", "token0_idx", "token1_idx"]],
+        table=pairs.dimPairs.__table__,
+        idx_column="pair_idx",
+        engine=engine,
+    )
+
+
+def upsert_dimension(rows_df: pd.DataFrame, table: Table, idx_column: str, engine: Engine = None) -> dict:
+    """Insert the rows of rows_df whose id is not in table yet and look up the idx of every row.
+
+    Rows are staged in a temp table with one executemany, inserted with a single INSERT ... SELECT ... WHERE NOT
+    EXISTS and read back with one join, all in one transaction.
+
+    Args:
+        rows_df (pd.DataFrame): id column (bytes) and the other non-identity columns of table
+        idx_column (str): identity column of table
+
+    Returns:
+        dict: id -> idx
+    """
+    if rows_df.shape[0] == 0:
+        return dict()
+    if engine is None:
+        engine = db.get_engine()
+
+    rows_df = rows_df.drop_duplicates(subset=["id"])
+
+    columns = [column.name for column in table.columns if column.name != idx_column]
+    staging = get_staging_table(table=table, columns=columns)
+
+    with engine.begin() as conn:
+        staging.create(conn)
+        try:
+            insert_records(conn=conn, table=staging, df=rows_df[columns])
+
+            new_rows = select(*[staging.c[name] for name in columns]).where(
+                ~exists().where(table.c.id == staging.c.id)
+            )
+            conn.execute(table.insert().from_select(columns, new_rows))
+
+            data = conn.execute(
+                select(table.c.id, table.c[idx_column]).join_from(table, staging, table.c.id == staging.c.id)
+            ).all()
+        except Exception:
+            drop_staging_tables(conn=conn, tables=[staging])
+            raise
+        staging.drop(conn)
+
+    return {row[0]: row[1] for row in data}
+
+
+def get_staging_table(table: Table, columns: list) -> Table:
+    # "#" makes it a session temp table on SQL Server
+    return Table("#" + table.name + "_staging", MetaData(), *[Column(name, table.c[name].type) for name in columns])
+
+
+def drop_staging_tables(conn: Connection, tables: list):
+    """Drop staging tables after a failed load without hiding the error that failed it.
+
+    A DROP in a transaction that SQL Server has doomed fails too. The tables were created in that
+    transaction, so its rollback removes them anyway.
+    """
+    for table in tables:
+        try:
+            table.drop(conn)
+        except exc.DBAPIError as e:
+            logger.error("Unable to drop {t}: {e}".format(t=table.name, e=e))
+
+
+def insert_records(conn: Connection, table: Table, df: pd.DataFrame):
+    """executemany df into table in DB_BULK_CHUNK_SIZE row chunks."""
+    records = df.to_dict("records")
+    for i in range(0, len(records), settings.DB_BULK_CHUNK_SIZE):
+        conn.execute(table.insert(), records[i : i + settings.DB_BULK_CHUNK_SIZE])
+
+
+def get_etl_watermark(name: str, engine: Engine = None) -> int:
+    """Last block number loaded by load_blocks_and_swaps for name.
+
+    Reads tj.etl_watermarks, see tj_worker/model/sql/etl_watermarks.sql. Before the first staged load of name,
+    this is the last block number in tj.fact_swap.
+    """
+    if engine is None:
+        engine = db.get_engine()
+
+    table = watermarks.etlWatermarks.__table__
+
+    with engine.connect() as conn:
+        block_number = conn.execute(select(table.c.block_number).where(table.c.name == name)).scalar()
+        if block_number is None:
+            block_number = conn.execute(select(func.max(swaps.factSwaps.block_number))).scalar()
+
+    if block_number is None:
+        return 0
+    return block_number
+
+
+def load_blocks_and_swaps(
+    blocks_df: pd.DataFrame, swaps_df: pd.DataFrame, watermark_name: str, block_number: int, engine: Engine = None
+) -> int:
+    """Load a batch into chain.dim_blocks and tj.fact_swap and advance the watermark, in one transaction.
+
+    Both data frames are bulk inserted into staging tables first. Blocks that are already in dim_blocks and
+    swaps at or below the watermark are skipped, so loading the same batch twice is a no-op and a batch
+    that failed part way leaves nothing behind.
+
+    Args:
+        watermark_name (str): row of tj.etl_watermarks to read and advance
+        block_number (int): last block number of the batch, the watermark after the load
+
+    Returns:
+        int: the watermark after the load
+    """
+    if engine is None:
+        engine = db.get_engine()
+
+    block_table = blocks.dimBlocks.__table__
+    swap_table = swaps.factSwaps.__table__
+    watermark_table = watermarks.etlWatermarks.__table__
+
+    block_columns = [column.name for column in block_table.columns]
+    swap_columns = [column.name for column in swap_table.columns if column.name != "swap_idx"]
+    block_staging = get_staging_table(table=block_table, columns=block_columns)
+    swap_staging = get_staging_table(table=swap_table, columns=swap_columns)
+
+    with engine.begin() as conn:
+        # UPDLOCK, HOLDLOCK keeps the row, or the gap where it will be inserted, locked until the commit,
+        # so two loads of the same watermark run one after the other
+        watermark = conn.execute(
+            select(watermark_table.c.block_number)
+            .where(watermark_table.c.name == watermark_name)
+            .with_hint(watermark_table, "WITH (UPDLOCK, HOLDLOCK)", "mssql")
+        ).scalar()
+        if watermark is None:
+            watermark = conn.execute(select(func.max(swap_table.c.block_number))).scalar() or 0
+
+        block_staging.create(conn)
+        swap_staging.create(conn)
+        try:
+            insert_records(conn=conn, table=block_staging, df=blocks_df[block_columns])
+            insert_records(conn=conn, table=swap_staging, df=swaps_df[swap_columns])
+
+            new_blocks = select(*[block_staging.c[name] for name in block_columns]).where(
+                ~exists().where(block_table.c.block_number == block_staging.c.block_number)
+            )
+            conn.execute(block_table.insert().from_select(block_columns, new_blocks))
+
+            new_swaps = select(*[swap_staging.c[name] for name in swap_columns]).where(
+                swap_staging.c.block_number > watermark
+            )
+            conn.execute(swap_table.insert().from_select(swap_columns, new_swaps))
+        except Exception:
+            drop_staging_tables(conn=conn, tables=[block_staging, swap_staging])
+            raise
+        block_staging.drop(conn)
+        swap_staging.drop(conn)
+
+        watermark = max(watermark, int(block_number))
+        values = {"block_number": watermark, "updated_at": datetime.utcnow()}
+        updated = conn.execute(
+            watermark_table.update().where(watermark_table.c.name == watermark_name).values(**values)
+        )
+        if updated.rowcount == 0:
+            conn.execute(watermark_table.insert().values(name=watermark_name, **values))
+
+    return watermark
+
+
 def insert_dim_blocks(blocks_df: pd.DataFrame, check_integrity: bool = False, check_integrity_count: int = 0):
 
     if check_integrity:
@@ -101,19 +294,11 @@ def insert_dim_blocks(blocks_df: pd.DataFrame, check_integrity: bool = False, ch
 
         blocks_df = blocks_df[~blocks_df["block_number"].isin(blocks_numbers_to_delete)]
 
-    non_scoped_db_session = db.get_non_scoped_db_session()
-
-    conn = non_scoped_db_session.connect()
-
     try:
-        blocks_df.to_sql(
-            blocks.dimBlocks.__tablename__,
+        insert_dataframe(
+            df=blocks_df,
+            table_name=blocks.dimBlocks.__tablename__,
             schema=blocks.dimBlocks.__table_args__["schema"],
-            con=conn,
-            method="multi",
-            index=False,
-            if_exists="append",
-            chunksize=100,
         )
     except exc.IntegrityError as e:
         if check_integrity < 2:
@@ -125,9 +310,6 @@ def insert_dim_blocks(blocks_df: pd.DataFrame, check_integrity: bool = False, ch
             logger.error(blocks_df)
             exit(1)
 
-    conn.close()
-    non_scoped_db_session.dispose()
-
 
 def get_max_transact_idx() -> int:
     db_session = db.get_db_session()
@@ -154,19 +336,49 @@ def get_max_swap_idx() -> int:
 
 
 def insert_fact_swaps(swaps_df: pd.DataFrame):
-
-    non_scoped_db_session = db.get_non_scoped_db_session()
-    conn = non_scoped_db_session.connect()
-
-    swaps_df.to_sql(
-        swaps.factSwaps.__tablename__,
+    insert_dataframe(
+        df=swaps_df,
+        table_name=swaps.factSwaps.__tablename__,
         schema=swaps.factSwaps.__table_args__["schema"],
-        con=conn,
-        method="multi",
-        index=False,
-        if_exists="append",
-        chunksize=100,
     )
 
-    conn.close()
-    non_scoped_db_session.dispose()
+
+def insert_dataframe(
+    df: pd.DataFrame,
+    table_name: str,
+    schema: str = None,
+    insert_mode: str = settings.DB_INSERT_MODE,
+    engine: Engine = None,
+):
+    """Append df to a table.
+
+    Args:
+        insert_mode (str, optional): "bulk" sends df in DB_BULK_CHUNK_SIZE row executemany calls in one
+                                     transaction. "multi" sends multi-row INSERT statements of 100 rows.
+        engine (Engine, optional): Engine to insert with. Defaults to the shared engine of db.get_engine
+    """
+    if engine is None:
+        engine = db.get_engine()
+
+    if insert_mode == "bulk":
+        with engine.begin() as conn:
+            df.to_sql(
+                table_name,
+                schema=schema,
+                con=conn,
+                index=False,
+                if_exists="append",
+                chunksize=settings.DB_BULK_CHUNK_SIZE,
+            )
+        return
+
+    with engine.connect() as conn:
+        df.to_sql(
+            table_name,
+            schema=schema,
+            con=conn,
+            method="multi",
+            index=False,
+            if_exists="append",
+            chunksize=100,
+        )
@@ -0,0 +1,131 @@
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+
+from tj_worker.utils import log
+
+logger = log.setup_custom_logger(name=__file__)
+
+# fact_swap amounts are DECIMAL(36, 18). An amount is held as four int64 parts of 9 digits each, two for its
+# integer part and two for its 18 decimals. Every part is below 10**9, so sums of billions of rows stay exact.
+SCALE_DIGITS = 18
+PART_DIGITS = 9
+PART_SCALE = 10**PART_DIGITS
+PARTS = ("int_hi", "int_lo", "dec_hi", "dec_lo")
+# int_hi of values that are not non-negative finite numbers, so they are neither positive nor zero
+INVALID = -1
+
+
+def part_columns(column: str) -> list:
+    return ["{c}__{p}".format(c=column, p=part) for part in PARTS]
+
+
+def to_parts(values: pd.Series) -> pd.DataFrame:
+    """Split decimal strings like "12.000000000000000001" into int64 parts.
+
+    Decimals past SCALE_DIGITS are truncated. Strings that are not plain decimals, e.g. "1E-7", are
+    formatted through Decimal first. Negative, NaN, infinite or unparsable values get int_hi INVALID,
+    so they are dropped like the float path drops them. So do values of 10**18 or more, out of the
+    range of DECIMAL(36, 18), which are logged.
+
+    Returns:
+        pd.DataFrame: int_hi, int_lo, dec_hi and dec_lo columns, with the index of values
+    """
+    if values.shape[0] == 0:
+        return pd.DataFrame({part: pd.Series(dtype=np.int64) for part in PARTS}, index=values.index)
+
+    values = values.astype(str)
+    is_plain = values.str.fullmatch(r"\d+(\.\d*)?")
+    if not is_plain.all():
+        values = values.where(is_plain, values[~is_plain].map(_to_plain))
+    is_valid = values.notna()
+    values = values.where(is_valid, "0")
+
+    split = values.str.partition(".")
+    integers = split[0].str.lstrip("0")
+    out_of_range = integers.str.len() > SCALE_DIGITS
+    if out_of_range.any():
+        logger.error("Amounts out of range of DECIMAL(36, 18), dropped: {v}".format(v=list(values[out_of_range])))
+        is_valid = is_valid & ~out_of_range
+        integers = integers.where(~out_of_range, "")
+        split[2] = split[2].where(~out_of_range, "")
+    integers = integers.str.pad(SCALE_DIGITS, side="left", fillchar="0")
+    decimals = split[2].str.slice(0, SCALE_DIGITS).str.pad(SCALE_DIGITS, side="right", fillchar="0")
+
+    return pd.DataFrame(
+        {
+            "int_hi": integers.str.slice(0, PART_DIGITS).astype(np.int64).where(is_valid, INVALID),
+            "int_lo": integers.str.slice(PART_DIGITS).astype(np.int64),
+            "dec_hi": decimals.str.slice(0, PART_DIGITS).astype(np.int64),
+            "dec_lo": decimals.str.slice(PART_DIGITS).astype(np.int64),
+        },
+        index=values.index,
+    )
+
+
+def _to_plain(value: str):
+    """value as a plain decimal string, None unless it is a non-negative finite number."""
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        return None
+    if not number.is_finite() or number < 0:
+        return None
+    return format(number.copy_abs(), "f")
+
+
+def expand_columns(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Replace each decimal string column of columns with its <column>__<part> columns."""
+    expanded = [df.drop(columns=columns)]
+    for column in columns:
+        parts = to_parts(df[column])
+        parts.columns = part_columns(column)
+        expanded.append(parts)
+    return pd.concat(expanded, axis=1)
+
+
+def is_positive(df: pd.DataFrame, column: str) -> pd.Series:
+    columns = part_columns(column)
+    return (df[columns[0]] >= 0) & (df[columns] > 0).any(axis=1)
+
+
+def is_zero(df: pd.DataFrame, column: str) -> pd.Series:
+    return (df[part_columns(column)] == 0).all(axis=1)
+
+
+def _carry(df: pd.DataFrame, column: str) -> tuple:
+    """int_hi, int_lo, dec_hi and dec_lo of column with the carry of each part added to the next one."""
+    int_hi_column, int_lo_column, dec_hi_column, dec_lo_column = part_columns(column)
+    dec_lo = df[dec_lo_column]
+    dec_hi = df[dec_hi_column] + dec_lo // PART_SCALE
+    int_lo = df[int_lo_column] + dec_hi // PART_SCALE
+    int_hi = df[int_hi_column] + int_lo // PART_SCALE
+    return int_hi, int_lo, dec_hi, dec_lo
+
+
+def collapse_columns(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Replace the parts of each column of columns, e.g. after a groupby sum, with one exact Decimal column.
+
+    Rows with a total of 10**18 or more, out of the range of DECIMAL(36, 18), or that include INVALID
+    values are logged and dropped.
+    """
+    out_of_range = pd.Series(False, index=df.index)
+    for column in columns:
+        int_hi = _carry(df=df, column=column)[0]
+        out_of_range |= (int_hi >= PART_SCALE) | (df[part_columns(column)[0]] < 0)
+    if out_of_range.any():
+        logger.error("Totals out of range of DECIMAL(36, 18), dropped {r} rows".format(r=int(out_of_range.sum())))
+
+    df = df[~out_of_range].copy()
+    for column in columns:
+        int_hi, int_lo, dec_hi, dec_lo = _carry(df=df, column=column)
+        strings = (
+            (int_hi * PART_SCALE + int_lo % PART_SCALE).astype(str)
+            + "."
+            + (dec_hi % PART_SCALE).astype(str).str.zfill(PART_DIGITS)
+            + (dec_lo % PART_SCALE).astype(str).str.zfill(PART_DIGITS)
+        )
+        df[column] = pd.Series([Decimal(value) for value in strings], index=df.index, dtype=object)
+        df = df.drop(columns=part_columns(column))
+    return df
@@ -0,0 +1,45 @@
+import numpy as np
+
+# EVM addresses (pairs, tokens) are 20 bytes, transaction hashes 32
+ADDRESS_BYTES = 20
+HASH_BYTES = 32
+
+
+def hex_to_bytes(hex_ids, width: int = ADDRESS_BYTES) -> np.ndarray:
+    """Convert 0x prefixed hex ids to width byte keys, with one bytes.fromhex call for all of them.
+
+    Args:
+        hex_ids (list-like): ids like "0x1f98...", all width bytes long
+
+    Returns:
+        np.ndarray: object array of bytes, in the order of hex_ids
+    """
+    hex_ids = np.asarray(hex_ids, dtype=str)
+    if hex_ids.shape[0] == 0:
+        return np.empty(0, dtype=object)
+    if (np.char.str_len(hex_ids) != 2 + width * 2).any():
+        raise ValueError("Expected 0x prefixed ids of {w} bytes".format(w=width))
+
+    # "x" is not a hex digit, so "0x" only matches the prefixes
+    raw = bytes.fromhex("".join(hex_ids.tolist()).replace("0x", ""))
+
+    # void rather than S dtype, which would drop trailing zero bytes
+    return np.array(np.frombuffer(raw, dtype="V{w}".format(w=width)).tolist(), dtype=object)
+
+
+def bytes_to_hex(ids, width: int = ADDRESS_BYTES) -> np.ndarray:
+    """Convert width byte keys back to 0x prefixed lowercase hex, with one bytes.hex call for all of them.
+
+    Returns:
+        np.ndarray: str array, in the order of ids
+    """
+    ids = list(ids)
+    if len(ids) == 0:
+        return np.empty(0, dtype=str)
+
+    raw = b"".join(ids)
+    if len(raw) != len(ids) * width:
+        raise ValueError("Expected {n} ids of {w} bytes".format(n=len(ids), w=width))
+
+    digits = np.frombuffer(raw.hex().encode("ascii"), dtype="S{w}".format(w=width * 2)).astype(str)
+    return np.char.add("0x", digits)
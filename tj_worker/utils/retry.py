@@ -0,0 +1,185 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+from tj_worker.utils import log
+
+logger = log.setup_custom_logger(name=__file__)
+
+
+class RetryError(Exception):
+    """Raised when a call still fails after every retry allowed by its RetryPolicy.
+
+    Args:
+        message (str): Error message
+        last_exception (Exception, optional): Exception raised by the last attempt
+    """
+
+    def __init__(self, message: str, last_exception: Exception = None):
+        super().__init__(message)
+        self.last_exception = last_exception
+
+
+class CircuitOpenError(RetryError):
+    """Raised without making the call while the circuit breaker is open."""
+
+
+class CircuitBreaker(object):
+    """Stop calling an endpoint after failure_threshold consecutive failures.
+
+    Once open, calls fail fast until reset_timeout seconds have passed. One trial call is then
+    let through: a success closes the circuit, a failure opens it again. Safe to share between
+    threads and between sync and async callers.
+
+    Example Usage:
+        Breaker = CircuitBreaker(failure_threshold=5, reset_timeout=60)
+        policy = RetryPolicy(circuit_breaker=Breaker)
+
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half-open: let one trial call through and push the next one back a full timeout
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error("Circuit opened after {f} consecutive failures".format(f=self.failures))
+                self.opened_at = time.monotonic()
+
+
+@dataclass
+class RetryPolicy:
+    """Retry a call with exponential backoff and jitter.
+
+    The delay before retry n (starting at 0) is base_delay * 2 ** n, capped at max_delay and
+    reduced by a random fraction of up to jitter. Only exceptions listed in retry_on are retried,
+    each with its own base delay; any other exception is raised as is. Attempt counts are local
+    to each call, so one policy can be shared by concurrent callers.
+
+    Example Usage:
+        policy = RetryPolicy(max_retries=5, retry_on={TimeoutError: 1.0, ConnectionError: 5.0})
+        data = policy.call(download, name="blob")
+        data = await policy.call_async(download_async, name="blob")
+
+    Args:
+        max_retries (int): Number of retries after the first attempt
+        base_delay (float): Delay in seconds before the first retry, unless overridden in retry_on
+        max_delay (float): Maximum delay in seconds between two attempts
+        jitter (float): Fraction of each delay that is randomized, between 0 and 1
+        retry_on (dict): Exception class to retry, mapped to its base delay. None uses base_delay.
+        circuit_breaker (CircuitBreaker): Optional breaker shared by every call of the policy
+    """
+
+    max_retries: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    jitter: float = 0.5
+    retry_on: dict = field(default_factory=lambda: {Exception: None})
+    circuit_breaker: CircuitBreaker = None
+
+    def get_delay(self, attempt: int, exception: Exception) -> float:
+        base_delay = self.base_delay
+        for exception_class, exception_delay in self.retry_on.items():
+            if isinstance(exception, exception_class) and exception_delay is not None:
+                base_delay = exception_delay
+                break
+
+        delay = min(self.max_delay, base_delay * 2**attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def is_retryable(self, exception: Exception) -> bool:
+        return isinstance(exception, tuple(self.retry_on))
+
+    def call(self, function, *args, **kwargs):
+        """Call function(*args, **kwargs), retrying according to the policy.
+
+        Raises:
+            CircuitOpenError: the circuit breaker is open
+            RetryError: every attempt failed with a retryable exception
+        """
+        attempt = 0
+        while True:
+            self._check_circuit()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self._handle_failure(attempt=attempt, exception=e)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self._record_success()
+            return result
+
+    async def call_async(self, function, *args, **kwargs):
+        """Await function(*args, **kwargs), retrying according to the policy without blocking the loop.
+
+        Raises:
+            CircuitOpenError: the circuit breaker is open
+            RetryError: every attempt failed with a retryable exception
+        """
+        attempt = 0
+        while True:
+            self._check_circuit()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                delay = self._handle_failure(attempt=attempt, exception=e)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            self._record_success()
+            return result
+
+    def _check_circuit(self):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("Circuit open, request not sent")
+
+    def _record_success(self):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+
+    def _handle_failure(self, attempt: int, exception: Exception) -> float:
+        """Return the delay before the next attempt, or raise if the call should not be retried."""
+        if not self.is_retryable(exception):
+            raise exception
+
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+
+        if attempt >= self.max_retries:
+            raise RetryError(
+                "Failed after {a} attempts: {e}".format(a=attempt + 1, e=repr(exception)), last_exception=exception
+            ) from exception
+
+        delay = self.get_delay(attempt=attempt, exception=exception)
+        logger.info("Retrying in {d:.1f}s after {e}".format(d=delay, e=repr(exception)))
+        return delay
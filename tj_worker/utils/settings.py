@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 import dotenv
 
@@ -25,3 +26,85 @@ DB_NAME = os.getenv("DB_NAME")
 AZURE_STORAGE_CONN_STR = os.getenv("AZURE_STORAGE_CONN_STR")
 MODULE_TO_RUN = os.getenv("MODULE_TO_RUN")
 SLEEP_MODE = os.getenv("SLEEP_MODE")
+
+# Number of blocks covered by each paginated transaction request. 0 disables the paginated mode.
+GRAPH_BLOCK_RANGE = int(os.getenv("GRAPH_BLOCK_RANGE", "500"))
+GRAPH_PAGE_SIZE = int(os.getenv("GRAPH_PAGE_SIZE", "1000"))
+GRAPH_PAIR_BATCH_SIZE = int(os.getenv("GRAPH_PAIR_BATCH_SIZE", "100"))
+
+# Concurrent backfill of [BACKFILL_START_BLOCK, BACKFILL_END_BLOCK). An end block of 0 means the subgraph head.
+BACKFILL_START_BLOCK = int(os.getenv("BACKFILL_START_BLOCK", "8973570"))
+BACKFILL_END_BLOCK = int(os.getenv("BACKFILL_END_BLOCK", "0"))
+BACKFILL_SHARD_SIZE = int(os.getenv("BACKFILL_SHARD_SIZE", "2000"))
+BACKFILL_MAX_IN_FLIGHT = int(os.getenv("BACKFILL_MAX_IN_FLIGHT", "8"))
+
+# Shared thegraph.com session
+GRAPH_SCHEMA_CACHE_PATH = os.getenv(
+    "GRAPH_SCHEMA_CACHE_PATH", os.path.join(tempfile.gettempdir(), "tj_worker_graph_schema.json")
+)
+GRAPH_SCHEMA_CACHE_MAX_AGE = int(os.getenv("GRAPH_SCHEMA_CACHE_MAX_AGE", "86400"))
+GRAPH_KEEPALIVE_TIMEOUT = int(os.getenv("GRAPH_KEEPALIVE_TIMEOUT", "120"))
+GRAPH_EXECUTE_TIMEOUT = int(os.getenv("GRAPH_EXECUTE_TIMEOUT", "30"))
+
+# Retries of thegraph.com requests
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "5"))
+GRAPH_RETRY_BASE_DELAY = float(os.getenv("GRAPH_RETRY_BASE_DELAY", "1"))
+GRAPH_RETRY_MAX_DELAY = float(os.getenv("GRAPH_RETRY_MAX_DELAY", "60"))
+GRAPH_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("GRAPH_CIRCUIT_FAILURE_THRESHOLD", "10"))
+GRAPH_CIRCUIT_RESET_TIMEOUT = float(os.getenv("GRAPH_CIRCUIT_RESET_TIMEOUT", "60"))
+
+# Run swap_getter as overlapping fetch / parse / upload threads when set
+SWAP_GETTER_PIPELINE = os.getenv("SWAP_GETTER_PIPELINE")
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+# Collect parsed swaps in memory and upload them as one file per batch, instead of one local file per block
+SWAP_BATCH_BUFFER = os.getenv("SWAP_BATCH_BUFFER", "0") == "1"
+SWAP_BUFFER_MAX_ROWS = int(os.getenv("SWAP_BUFFER_MAX_ROWS", "100000"))
+SWAP_BUFFER_MAX_AGE = int(os.getenv("SWAP_BUFFER_MAX_AGE", "600"))
+SWAP_BUFFER_SPILL = os.getenv("SWAP_BUFFER_SPILL")
+# Decode thegraph.com responses column by column instead of into one list per swap
+SWAP_PARSE_COLUMNAR = os.getenv("SWAP_PARSE_COLUMNAR", "1") == "1"
+
+# Format of the uploaded swaps_raw and processed/ files, "csv" or "parquet" (needs pyarrow)
+SWAP_FILE_FORMAT = os.getenv("SWAP_FILE_FORMAT", "csv")
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+# Aggregate all swaps_raw files of a SwapETL cycle at once instead of one file at a time
+ETL_BATCH_AGGREGATION = os.getenv("ETL_BATCH_AGGREGATION", "1") == "1"
+# Sum swap amounts exactly as fixed point into Decimal values for fact_swap's DECIMAL(36, 18), instead of as floats
+ETL_EXACT_AMOUNTS = os.getenv("ETL_EXACT_AMOUNTS", "1") == "1"
+# "direct" inserts dim_blocks then fact_swap and tracks progress by MAX(fact_swap.block_number),
+# "staged" loads dim_blocks, fact_swap and the tj.etl_watermarks row in one transaction.
+# Only set "staged" once tj_worker/model/sql/etl_watermarks.sql has been deployed.
+ETL_LOAD_MODE = os.getenv("ETL_LOAD_MODE", "direct")
+
+# Database connection pool, shared by the process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# seconds before a pooled connection is replaced, below the idle timeout of Azure SQL
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# log pool stats every n ETL cycles
+DB_POOL_STATS_EVERY = int(os.getenv("DB_POOL_STATS_EVERY", "10"))
+
+# "bulk" inserts fact_swap / dim_blocks with pyodbc fast_executemany, "multi" with multi-row INSERT statements
+DB_INSERT_MODE = os.getenv("DB_INSERT_MODE", "bulk")
+DB_BULK_CHUNK_SIZE = int(os.getenv("DB_BULK_CHUNK_SIZE", "10000"))
+
+# Azure blob storage. One client and connection pool is shared by the process.
+BLOB_POOL_SIZE = int(os.getenv("BLOB_POOL_SIZE", "16"))
+BLOB_CONNECTION_TIMEOUT = int(os.getenv("BLOB_CONNECTION_TIMEOUT", "20"))
+BLOB_READ_TIMEOUT = int(os.getenv("BLOB_READ_TIMEOUT", "60"))
+BLOB_DOWNLOAD_CONCURRENCY = int(os.getenv("BLOB_DOWNLOAD_CONCURRENCY", "8"))
+BLOB_MAX_RETRIES = int(os.getenv("BLOB_MAX_RETRIES", "3"))
+# Blobs read into memory are written to disk instead above this size in bytes
+BLOB_SPILL_SIZE = int(os.getenv("BLOB_SPILL_SIZE", str(64 * 1024 * 1024)))
+BLOB_DELETE_BATCH_SIZE = int(os.getenv("BLOB_DELETE_BATCH_SIZE", "256"))
+# Kept in tj_worker/data, which the swap_getter and swap_etl workers never clear.
+# Mount a volume there, or point BLOB_MANIFEST_PATH at one, to keep it when the container is recreated.
+# Delete the file whenever blobs are deleted to replay a range, otherwise the replayed blocks are skipped.
+BLOB_MANIFEST_PATH = os.getenv(
+    "BLOB_MANIFEST_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "blob_manifest.json"),
+)